@@ -0,0 +1,81 @@
+# app/db/current_values.py
+from datetime import datetime
+
+from sqlalchemy import case, insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+
+from app.db.model import CurrentValue, ValueHistory
+
+
+def save_current_values(
+    db,
+    user_id: int,
+    product_id: int,
+    values: dict[int, str],
+    source_hash: str,
+    card_set: str = "Автопарсинг",
+) -> int:
+    """
+    ✅ Сохранение значений продукта
+    - Текущие значения: один INSERT ... ON CONFLICT DO UPDATE на продукт
+    - Изменившиеся значения уходят в value_history, одинаковые не дублируются
+    Коммит — на стороне вызывающего. Возвращает число изменившихся значений
+    """
+    if not values:
+        return 0
+
+    now = datetime.utcnow()
+
+    # Только колонки, без ORM-объектов: upsert ниже не должен оставлять в сессии устаревшие копии
+    previous = db.query(
+        CurrentValue.characteristic_id, CurrentValue.value, CurrentValue.changed_at
+    ).filter(
+        CurrentValue.user_id == user_id,
+        CurrentValue.product_id == product_id,
+        CurrentValue.characteristic_id.in_(list(values)),
+    ).all()
+
+    history = [
+        {
+            "user_id": user_id,
+            "product_id": product_id,
+            "characteristic_id": row.characteristic_id,
+            "value": row.value,
+            "valid_from": row.changed_at,
+            "valid_to": now,
+        }
+        for row in previous
+        if row.value != values[row.characteristic_id]
+    ]
+    if history:
+        db.execute(insert(ValueHistory), history)
+
+    stmt = sqlite_insert(CurrentValue).values([
+        {
+            "user_id": user_id,
+            "product_id": product_id,
+            "characteristic_id": char_id,
+            "value": value,
+            "source_hash": source_hash,
+            "card_set": card_set,
+            "updated_at": now,
+            "changed_at": now,
+        }
+        for char_id, value in values.items()
+    ])
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[CurrentValue.user_id, CurrentValue.product_id, CurrentValue.characteristic_id],
+        set_={
+            "value": stmt.excluded.value,
+            "source_hash": stmt.excluded.source_hash,
+            "card_set": stmt.excluded.card_set,
+            "updated_at": stmt.excluded.updated_at,
+            "changed_at": case(
+                (CurrentValue.value != stmt.excluded.value, stmt.excluded.changed_at),
+                else_=CurrentValue.changed_at,
+            ),
+        },
+    )
+    db.execute(stmt)
+
+    return len(history)
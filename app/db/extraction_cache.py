@@ -0,0 +1,73 @@
+# app/db/extraction_cache.py
+import hashlib
+import json
+from datetime import datetime, timedelta
+from typing import Optional
+
+from app.db.model import SessionLocal, ExtractionCache
+from config import EXTRACTION_CACHE_TTL, EXTRACTION_CACHE_MAX_ENTRIES
+
+
+def make_extraction_key(kind: str, content: str, chars: list) -> str:
+    """
+    Ключ кэша извлечения: тип источника (html/text), хэш очищенного контента
+    и имена/описания запрошенных характеристик
+    """
+    char_part = json.dumps(
+        sorted([char.name, char.description or ""] for char in chars),
+        ensure_ascii=False,
+    )
+    digest = hashlib.sha256()
+    digest.update(kind.encode("utf-8"))
+    digest.update(b"\0")
+    digest.update(hashlib.sha256(content.encode("utf-8")).digest())
+    digest.update(char_part.encode("utf-8"))
+    return digest.hexdigest()
+
+
+def get_cached_extraction(key: str) -> Optional[dict]:
+    db = SessionLocal()
+    try:
+        entry = db.get(ExtractionCache, key)
+        if not entry or entry.created_at < _expire_before():
+            return None
+        return dict(entry.result)
+    finally:
+        db.close()
+
+
+def save_cached_extraction(key: str, result: dict):
+    db = SessionLocal()
+    try:
+        db.merge(ExtractionCache(key=key, result=result, created_at=datetime.utcnow()))
+        db.commit()
+
+        _evict(db)
+    finally:
+        db.close()
+
+
+def _expire_before() -> datetime:
+    return datetime.utcnow() - timedelta(seconds=EXTRACTION_CACHE_TTL)
+
+
+def _evict(db):
+    """Удаляет записи старше срока жизни и самые старые сверх лимита"""
+    removed = db.query(ExtractionCache).filter(
+        ExtractionCache.created_at < _expire_before()
+    ).delete(synchronize_session=False)
+
+    overflow = db.query(ExtractionCache).count() - EXTRACTION_CACHE_MAX_ENTRIES
+    if overflow > 0:
+        oldest_keys = [
+            row.key for row in db.query(ExtractionCache.key)
+            .order_by(ExtractionCache.created_at.asc())
+            .limit(overflow)
+        ]
+        removed += db.query(ExtractionCache).filter(
+            ExtractionCache.key.in_(oldest_keys)
+        ).delete(synchronize_session=False)
+
+    if removed:
+        db.commit()
+        print(f"🧹 Кэш ответов LLM: удалено {removed} записей")
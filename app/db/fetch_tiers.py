@@ -0,0 +1,81 @@
+# app/db/fetch_tiers.py
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from typing import Optional
+
+from app.db.model import SessionLocal, FetchTierStat
+from config import FETCH_TIER_REPROBE_AFTER
+
+
+# Способы загрузки от дешёвого к дорогому
+TIERS = ("http", "playwright", "special")
+
+# Вес нового замера в сглаженном времени загрузки
+LATENCY_SMOOTHING = 0.3
+
+
+@dataclass
+class TierStat:
+    host: str
+    tier: str
+    latency_ms: Optional[int]
+    content_size: Optional[int]
+    probed_at: Optional[datetime]
+
+    @property
+    def needs_reprobe(self) -> bool:
+        """Запись устарела: пора снова проверить, не хватает ли дешёвого способа"""
+        return (
+            self.probed_at is None
+            or datetime.utcnow() - self.probed_at > timedelta(seconds=FETCH_TIER_REPROBE_AFTER)
+        )
+
+
+def tier_order(stat: Optional[TierStat]) -> tuple[str, ...]:
+    """Порядок попыток: сначала способ, сработавший в прошлый раз, затем остальные по цене"""
+    if stat is None or stat.tier not in TIERS or stat.needs_reprobe:
+        return TIERS
+    return (stat.tier,) + tuple(tier for tier in TIERS if tier != stat.tier)
+
+
+def get_tier_stat(host: str) -> Optional[TierStat]:
+    db = SessionLocal()
+    try:
+        entry = db.get(FetchTierStat, host)
+        if not entry:
+            return None
+        return TierStat(
+            host=entry.host,
+            tier=entry.tier,
+            latency_ms=entry.latency_ms,
+            content_size=entry.content_size,
+            probed_at=entry.probed_at,
+        )
+    finally:
+        db.close()
+
+
+def record_tier_success(host: str, tier: str, latency_ms: int, content_size: int, probed: bool):
+    """
+    Запоминает успешный способ загрузки домена
+    probed — попытки начинались с HTTP, т.е. более дешёвые способы только что проверены
+    """
+    now = datetime.utcnow()
+    db = SessionLocal()
+    try:
+        entry = db.get(FetchTierStat, host) or FetchTierStat(host=host, successes=0)
+        if entry.tier == tier and entry.latency_ms is not None:
+            entry.latency_ms = int(entry.latency_ms + LATENCY_SMOOTHING * (latency_ms - entry.latency_ms))
+            entry.successes = (entry.successes or 0) + 1
+        else:
+            entry.tier = tier
+            entry.latency_ms = latency_ms
+            entry.successes = 1
+        entry.content_size = content_size
+        entry.updated_at = now
+        if probed:
+            entry.probed_at = now
+        db.add(entry)
+        db.commit()
+    finally:
+        db.close()
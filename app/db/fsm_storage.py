@@ -0,0 +1,155 @@
+# app/db/fsm_storage.py
+import asyncio
+import json
+import time
+from typing import Any, Mapping, Optional
+
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, DefaultKeyBuilder, KeyBuilder, StateType, StorageKey
+from aiogram.fsm.storage.memory import MemoryStorage
+from sqlalchemy import Column, Float, MetaData, String, Table, Text, delete, select
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+
+from app.db.model import make_engine
+from config import FSM_STORAGE, FSM_STORAGE_URL, FSM_STATE_TTL
+
+
+DEFAULT_SQLITE_URL = "sqlite:///fsm.db"
+
+# Как часто (сек) удалять брошенные состояния при записи
+CLEANUP_INTERVAL = 600
+
+# Отдельные метаданные: таблица живёт в своей БД, а не в cards.db
+fsm_metadata = MetaData()
+
+fsm_states = Table(
+    "fsm_states",
+    fsm_metadata,
+    Column("key", String, primary_key=True),
+    Column("state", String, nullable=True),
+    Column("data", Text, nullable=False, default="{}"),
+    Column("updated_at", Float, nullable=False, index=True),
+)
+
+
+def _state_name(state: StateType) -> Optional[str]:
+    return state.state if isinstance(state, State) else state
+
+
+class SQLiteStorage(BaseStorage):
+    """
+    ✅ Состояния FSM в SQLite (WAL)
+    - Переживают перезапуск, одну БД могут читать несколько воркеров на одной машине
+    - Запись, не менявшаяся state_ttl секунд, считается брошенной: при чтении её нет,
+      а при очередной записи она удаляется из таблицы
+    """
+
+    def __init__(self, url: str = DEFAULT_SQLITE_URL, state_ttl: int = FSM_STATE_TTL,
+                 key_builder: Optional[KeyBuilder] = None):
+        self.engine = make_engine(url)
+        fsm_metadata.create_all(bind=self.engine)
+        self.state_ttl = state_ttl
+        self.key_builder = key_builder or DefaultKeyBuilder()
+        self._last_cleanup = 0.0
+
+    def _expire_before(self, now: float) -> float:
+        return now - self.state_ttl if self.state_ttl > 0 else 0.0
+
+    def _read(self, key: str) -> Optional[tuple[Optional[str], str]]:
+        with self.engine.connect() as conn:
+            row = conn.execute(
+                select(fsm_states.c.state, fsm_states.c.data).where(
+                    fsm_states.c.key == key,
+                    fsm_states.c.updated_at >= self._expire_before(time.time()),
+                )
+            ).first()
+        return (row.state, row.data) if row else None
+
+    def _write(self, key: str, **fields):
+        now = time.time()
+        fields["updated_at"] = now
+        with self.engine.begin() as conn:
+            if self.state_ttl > 0:
+                # Брошенная запись при чтении уже пуста — вторая колонка не должна ожить после записи первой
+                conn.execute(
+                    delete(fsm_states).where(
+                        fsm_states.c.key == key,
+                        fsm_states.c.updated_at < self._expire_before(now),
+                    )
+                )
+            conn.execute(
+                sqlite_insert(fsm_states)
+                .values(key=key, **fields)
+                .on_conflict_do_update(index_elements=[fsm_states.c.key], set_=fields)
+            )
+            # Пустая запись (после state.clear()) не нужна
+            conn.execute(
+                delete(fsm_states).where(
+                    fsm_states.c.key == key,
+                    fsm_states.c.state.is_(None),
+                    fsm_states.c.data == "{}",
+                )
+            )
+            if self.state_ttl > 0 and now - self._last_cleanup > CLEANUP_INTERVAL:
+                self._last_cleanup = now
+                removed = conn.execute(
+                    delete(fsm_states).where(fsm_states.c.updated_at < self._expire_before(now))
+                ).rowcount
+                if removed:
+                    print(f"🧹 Удалено брошенных состояний FSM: {removed}")
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        await asyncio.to_thread(self._write, self.key_builder.build(key), state=_state_name(state))
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        row = await asyncio.to_thread(self._read, self.key_builder.build(key))
+        return row[0] if row else None
+
+    async def set_data(self, key: StorageKey, data: Mapping[str, Any]) -> None:
+        if not isinstance(data, dict):
+            raise TypeError(f"Data must be a dict, got {type(data).__name__}")
+        await asyncio.to_thread(
+            self._write, self.key_builder.build(key), data=json.dumps(data, ensure_ascii=False)
+        )
+
+    async def get_data(self, key: StorageKey) -> dict[str, Any]:
+        row = await asyncio.to_thread(self._read, self.key_builder.build(key))
+        return json.loads(row[1]) if row else {}
+
+    async def close(self) -> None:
+        self.engine.dispose()
+
+
+def create_fsm_storage(kind: str = FSM_STORAGE, url: str = FSM_STORAGE_URL,
+                       state_ttl: int = FSM_STATE_TTL) -> BaseStorage:
+    """
+    Хранилище FSM по настройке FSM_STORAGE:
+    - memory — в памяти процесса (состояния теряются при перезапуске)
+    - sqlite — файл SQLite, по умолчанию fsm.db
+    - redis — Redis или совместимый сервер, общий для всех воркеров (нужен пакет redis)
+    """
+    if kind == "memory":
+        return MemoryStorage()
+
+    if kind == "sqlite":
+        return SQLiteStorage(url or DEFAULT_SQLITE_URL, state_ttl)
+
+    if kind == "redis":
+        if not url:
+            raise RuntimeError("FSM_STORAGE=redis: укажите FSM_STORAGE_URL, например redis://localhost:6379/0")
+        try:
+            from aiogram.fsm.storage.redis import RedisStorage
+        except ImportError as e:
+            raise RuntimeError("FSM_STORAGE=redis: установите пакет redis (pip install redis)") from e
+        ttl = state_ttl if state_ttl > 0 else None
+        return RedisStorage.from_url(url, state_ttl=ttl, data_ttl=ttl)
+
+    raise RuntimeError(f"Неизвестное FSM_STORAGE: {kind} (memory | sqlite | redis)")
+
+
+# Общее хранилище для Dispatcher
+fsm_storage = create_fsm_storage()
+
+
+async def close_fsm_storage():
+    await fsm_storage.close()
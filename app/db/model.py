@@ -1,10 +1,12 @@
 # app/db/model.py
 from datetime import datetime
 from sqlalchemy import text
-from sqlalchemy import Column, Integer, String, DateTime, Text, JSON, ForeignKey, create_engine
+from sqlalchemy import Column, Integer, String, DateTime, Text, JSON, ForeignKey, Index, create_engine, event
+from sqlalchemy.engine import Engine
 from sqlalchemy.orm import declarative_base, sessionmaker, relationship
 
-from config import SYSTEM_USER_ID, BASE_CHARACTERISTICS
+from config import (SYSTEM_USER_ID, BASE_CHARACTERISTICS, DB_URL, SQLITE_JOURNAL_MODE, SQLITE_SYNCHRONOUS,
+                    SQLITE_BUSY_TIMEOUT, SQLITE_MMAP_SIZE, SQLITE_CACHE_SIZE)
 
 Base = declarative_base()
 
@@ -86,6 +88,37 @@ class Data(Base):
     value = Column(Text, nullable=False, default="")  
 
 
+class CurrentValue(Base):
+    """Текущее значение характеристики продукта: одна строка на ячейку отчёта"""
+    __tablename__ = "current_values"
+
+    user_id = Column(Integer, primary_key=True)
+    product_id = Column(Integer, primary_key=True)
+    characteristic_id = Column(Integer, primary_key=True)
+
+    value = Column(Text, nullable=False, default="")
+    source_hash = Column(String(64))     # хэш страницы, с которой извлечено значение
+    card_set = Column(String(255))
+    updated_at = Column(DateTime, default=datetime.utcnow)  # последнее извлечение
+    changed_at = Column(DateTime, default=datetime.utcnow)  # последнее изменение значения
+
+
+class ValueHistory(Base):
+    """Прежние значения: строка добавляется, только когда значение действительно изменилось"""
+    __tablename__ = "value_history"
+
+    id = Column(Integer, primary_key=True)
+    user_id = Column(Integer, nullable=False)
+    product_id = Column(Integer, nullable=False)
+    characteristic_id = Column(Integer, nullable=False)
+    value = Column(Text, nullable=False, default="")
+    valid_from = Column(DateTime)
+    valid_to = Column(DateTime, default=datetime.utcnow)
+
+    __table_args__ = (
+        Index("ix_value_history_cell", "user_id", "product_id", "characteristic_id", "valid_to"),
+    )
+
 
 class Log(Base):
     __tablename__ = "logs"
@@ -101,7 +134,95 @@ class Log(Base):
     tokens_output = Column(Integer, default=0)  # токены на выход (completion)
 
 
-engine = create_engine("sqlite:///cards.db", echo=False, future=True)
+class ParseJob(Base):
+    """Задача парсинга: переживает перезапуск, готовые продукты повторно не обрабатываются"""
+    __tablename__ = "parse_jobs"
+
+    id = Column(Integer, primary_key=True)
+    user_id = Column(Integer, nullable=False)          # tg id, как в current_values
+    chat_id = Column(Integer, nullable=False)
+    product_ids = Column(JSON, nullable=False)
+    char_ids = Column(JSON, nullable=False)
+    done_product_ids = Column(JSON, nullable=False, default=list)
+    failed_product_ids = Column(JSON, nullable=False, default=list)  # повторяются при перезапуске задачи
+
+    status = Column(String(20), nullable=False, default="queued")  # queued / running / done / failed
+    message_id = Column(Integer)                       # сообщение с прогрессом
+    log_id = Column(Integer)
+    tokens_input = Column(Integer, default=0)
+    tokens_output = Column(Integer, default=0)
+    error = Column(Text)
+
+    created_at = Column(DateTime, default=datetime.utcnow)
+    started_at = Column(DateTime)
+    heartbeat_at = Column(DateTime)                    # обновляется, пока задача выполняется
+    finished_at = Column(DateTime)
+
+    __table_args__ = (
+        Index("ix_parse_jobs_status", "status", "created_at"),
+        Index("ix_parse_jobs_user", "user_id", "created_at"),
+    )
+
+
+class CacheVersion(Base):
+    """Версия справочников для кэшей воркеров: запись увеличивает её, остальные сбрасывают кэш"""
+    __tablename__ = "cache_versions"
+
+    name = Column(String(50), primary_key=True)
+    version = Column(Integer, nullable=False, default=0)
+
+
+class FetchTierStat(Base):
+    """Каким способом последний раз удалось загрузить страницы домена"""
+    __tablename__ = "fetch_tier_stats"
+
+    host = Column(String(255), primary_key=True)
+    tier = Column(String(20), nullable=False)   # http / playwright / special
+    latency_ms = Column(Integer)                # сглаженное время загрузки этим способом
+    content_size = Column(Integer)              # размер последней загруженной страницы
+    successes = Column(Integer, default=0)      # загрузок подряд этим способом
+    probed_at = Column(DateTime)                # последняя проверка, начиная с HTTP
+    updated_at = Column(DateTime, default=datetime.utcnow)
+
+
+class ExtractionCache(Base):
+    __tablename__ = "extraction_cache"
+
+    key = Column(String(64), primary_key=True)  # sha256 от контента и набора характеристик
+    result = Column(JSON, nullable=False)
+    created_at = Column(DateTime, default=datetime.utcnow, index=True)
+
+
+def make_engine(url: str = DB_URL) -> Engine:
+    """
+    ✅ Движок SQLite с настройками для параллельной работы
+    - WAL: чтение не ждёт записи, запись не ждёт чтения
+    - synchronous=NORMAL: fsync только на checkpoint, в WAL это безопасно
+    - busy_timeout: конкурирующая запись ждёт, а не падает с "database is locked"
+    - mmap и увеличенный кэш страниц
+    """
+    engine = create_engine(
+        url,
+        echo=False,
+        future=True,
+        connect_args={"timeout": SQLITE_BUSY_TIMEOUT / 1000},
+    )
+
+    @event.listens_for(engine, "connect")
+    def _set_sqlite_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        cursor.execute(f"PRAGMA journal_mode={SQLITE_JOURNAL_MODE}")
+        cursor.execute(f"PRAGMA synchronous={SQLITE_SYNCHRONOUS}")
+        cursor.execute(f"PRAGMA busy_timeout={int(SQLITE_BUSY_TIMEOUT)}")
+        cursor.execute(f"PRAGMA mmap_size={int(SQLITE_MMAP_SIZE)}")
+        cursor.execute(f"PRAGMA cache_size={int(SQLITE_CACHE_SIZE)}")
+        cursor.execute("PRAGMA temp_store=MEMORY")
+        cursor.close()
+
+    return engine
+
+
+engine = make_engine()
 Base.metadata.create_all(bind=engine) 
 SessionLocal = sessionmaker(bind=engine, autoflush=False, autocommit=False)
 
@@ -116,6 +237,67 @@ def get_sets_for_user(db, user_id: int | None):
 
 
 
+def get_current_values_map(db, user_id: int, product_ids: list[int], char_ids: list[int]) -> dict[tuple[int, int], "CurrentValue"]:
+    """Текущее значение для каждой пары (product_id, characteristic_id)"""
+    records = db.query(CurrentValue).filter(
+        CurrentValue.user_id == user_id,
+        CurrentValue.product_id.in_(product_ids),
+        CurrentValue.characteristic_id.in_(char_ids),
+    ).all()
+    return {(r.product_id, r.characteristic_id): r for r in records}
+
+
+def migrate_current_values():
+    """
+    Однократный перенос последних значений из data в current_values
+    Выполняется, только пока current_values пуста
+    """
+    with engine.begin() as conn:
+        if conn.execute(text("SELECT 1 FROM current_values LIMIT 1")).first():
+            return 0
+
+        result = conn.execute(text("""
+            INSERT INTO current_values
+                (user_id, product_id, characteristic_id, value, source_hash, card_set, updated_at, changed_at)
+            SELECT user_id, product_id, characteristic_id, value,
+                   json_extract(payload, '$.source_hash'), card_set, created_at, created_at
+            FROM (
+                SELECT *, ROW_NUMBER() OVER (
+                    PARTITION BY user_id, product_id, characteristic_id
+                    ORDER BY created_at DESC, id DESC
+                ) AS rn
+                FROM data
+                WHERE user_id IS NOT NULL AND product_id IS NOT NULL AND characteristic_id IS NOT NULL
+            )
+            WHERE rn = 1
+        """))
+
+    if result.rowcount:
+        print(f"✅ Перенесено текущих значений: {result.rowcount}")
+    return result.rowcount
+
+
+def backup_database(path: str):
+    """
+    Согласованная копия базы через backup API SQLite
+    Простое копирование файла в режиме WAL теряет ещё не перенесённые из журнала изменения
+    """
+    import sqlite3
+
+    source = engine.raw_connection()
+    target = sqlite3.connect(path)
+    try:
+        source.driver_connection.backup(target)
+    finally:
+        target.close()
+        source.close()
+
+
+# current_values заполняется из истории при первом запуске, иначе все значения считались бы устаревшими
+migrate_current_values()
+
+
+
 def migrate_products():
     db = SessionLocal()
     
@@ -0,0 +1,132 @@
+# app/db/page_cache.py
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from typing import Optional
+
+from sqlalchemy import Column, DateTime, String, Text
+from sqlalchemy.orm import declarative_base, sessionmaker
+
+from app.db.model import make_engine
+from config import PAGE_CACHE_TTL, PAGE_CACHE_MAX_ENTRIES, PAGE_CACHE_DB_URL
+
+
+# Отдельная база: тела страниц (до мегабайт каждая) не раздувают cards.db и не уходят в /db
+PageCacheBase = declarative_base()
+
+
+class PageCache(PageCacheBase):
+    __tablename__ = "page_cache"
+
+    url = Column(String(500), primary_key=True)
+    body = Column(Text, nullable=False)
+    tier = Column(String(20))            # http / playwright / special
+    etag = Column(String(255))
+    last_modified = Column(String(100))
+    fetched_at = Column(DateTime, default=datetime.utcnow)
+    accessed_at = Column(DateTime, default=datetime.utcnow, index=True)
+
+
+engine = make_engine(PAGE_CACHE_DB_URL)
+PageCacheBase.metadata.create_all(bind=engine)
+SessionLocal = sessionmaker(bind=engine, autoflush=False, autocommit=False)
+
+
+@dataclass
+class CachedPage:
+    url: str
+    body: str
+    tier: Optional[str]
+    etag: Optional[str]
+    last_modified: Optional[str]
+    fetched_at: datetime
+
+    @property
+    def is_fresh(self) -> bool:
+        return datetime.utcnow() - self.fetched_at < timedelta(seconds=PAGE_CACHE_TTL)
+
+    @property
+    def validators(self) -> dict:
+        """Заголовки для условного запроса (304 вместо полной загрузки)"""
+        headers = {}
+        if self.etag:
+            headers["If-None-Match"] = self.etag
+        if self.last_modified:
+            headers["If-Modified-Since"] = self.last_modified
+        return headers
+
+
+def get_cached_page(url: str) -> Optional[CachedPage]:
+    db = SessionLocal()
+    try:
+        entry = db.get(PageCache, url)
+        if not entry:
+            return None
+
+        entry.accessed_at = datetime.utcnow()
+        db.commit()
+
+        return CachedPage(
+            url=entry.url,
+            body=entry.body,
+            tier=entry.tier,
+            etag=entry.etag,
+            last_modified=entry.last_modified,
+            fetched_at=entry.fetched_at,
+        )
+    finally:
+        db.close()
+
+
+def save_cached_page(
+    url: str,
+    body: str,
+    tier: str,
+    etag: Optional[str] = None,
+    last_modified: Optional[str] = None,
+):
+    now = datetime.utcnow()
+    db = SessionLocal()
+    try:
+        entry = db.get(PageCache, url) or PageCache(url=url)
+        entry.body = body
+        entry.tier = tier
+        entry.etag = etag
+        entry.last_modified = last_modified
+        entry.fetched_at = now
+        entry.accessed_at = now
+        db.add(entry)
+        db.commit()
+
+        _evict_lru(db)
+    finally:
+        db.close()
+
+
+def mark_page_revalidated(url: str):
+    """Сервер ответил 304 — страница не изменилась, продлеваем свежесть"""
+    now = datetime.utcnow()
+    db = SessionLocal()
+    try:
+        entry = db.get(PageCache, url)
+        if entry:
+            entry.fetched_at = now
+            entry.accessed_at = now
+            db.commit()
+    finally:
+        db.close()
+
+
+def _evict_lru(db):
+    total = db.query(PageCache).count()
+    overflow = total - PAGE_CACHE_MAX_ENTRIES
+    if overflow <= 0:
+        return
+
+    stale_urls = [
+        row.url for row in db.query(PageCache.url)
+        .order_by(PageCache.accessed_at.asc())
+        .limit(overflow)
+    ]
+    db.query(PageCache).filter(PageCache.url.in_(stale_urls)).delete(synchronize_session=False)
+    db.commit()
+    print(f"🧹 Кэш страниц: вытеснено {len(stale_urls)} записей")
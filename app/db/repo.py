@@ -0,0 +1,396 @@
+# app/db/repo.py
+import asyncio
+import time
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from typing import Callable, Optional
+
+from sqlalchemy import func, select
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.orm import aliased, sessionmaker
+
+from app.db.model import (engine, User, Set, Bank, Product, Characteristic, CurrentValue, Log, ParseJob, CacheVersion,
+                          get_sets_for_user as _get_sets_for_user, get_current_values_map)
+from app.db.current_values import save_current_values
+from config import DB_THREADS, REFERENCE_CACHE_CHECK_INTERVAL
+
+
+# Объекты возвращаются из потока уже после закрытия сессии — атрибуты не должны истекать при commit
+RepoSession = sessionmaker(bind=engine, autoflush=False, autocommit=False, expire_on_commit=False)
+
+_executor = ThreadPoolExecutor(max_workers=max(1, DB_THREADS), thread_name_prefix="db")
+
+
+def _in_session(func: Callable, *args):
+    db = RepoSession()
+    try:
+        result = func(db, *args)
+        db.commit()
+        return result
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        db.close()
+
+
+async def run_db(func: Callable, *args):
+    """
+    ✅ Выполняет func(db, *args) в потоке БД с отдельной сессией и коммитом
+    Event loop не ждёт диск: остальные чаты обслуживаются, пока идёт запрос.
+    Возвращаемые ORM-объекты отсоединены: ленивые связи (relationship) в них не подгружаются
+    """
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_executor, partial(_in_session, func, *args))
+
+
+REFERENCE_VERSION = "reference"
+
+
+def _read_shared_version(db) -> int:
+    entry = db.get(CacheVersion, REFERENCE_VERSION)
+    return entry.version if entry else 0
+
+
+def _bump_shared_version(db):
+    db.execute(
+        sqlite_insert(CacheVersion)
+        .values(name=REFERENCE_VERSION, version=1)
+        .on_conflict_do_update(
+            index_elements=[CacheVersion.name],
+            set_={"version": CacheVersion.version + 1},
+        )
+    )
+
+
+class ReferenceCache:
+    """
+    Кэш справочников в памяти: банки, наборы, продукты и характеристики наборов
+    Любая запись через репозиторий поднимает версию и очищает кэш. Загрузка, начатая
+    до записи, свой результат уже не сохранит — устаревшие данные в кэш не попадут.
+    Запись также поднимает общую версию в БД: другие воркеры сверяют её не чаще
+    check_interval секунд и сбрасывают свой кэш
+    """
+
+    def __init__(self, check_interval: int = REFERENCE_CACHE_CHECK_INTERVAL):
+        self.version = 0
+        self.check_interval = check_interval
+        self._entries: dict[tuple, object] = {}
+        self._shared_version: Optional[int] = None
+        self._checked_at = float("-inf")
+
+    async def _sync(self):
+        now = time.monotonic()
+        if now - self._checked_at < self.check_interval:
+            return
+        self._checked_at = now
+        shared = await run_db(_read_shared_version)
+        if shared != self._shared_version:
+            self._shared_version = shared
+            self._drop()
+
+    async def get(self, key: tuple, loader: Callable, *args):
+        await self._sync()
+        if key in self._entries:
+            return self._entries[key]
+
+        version = self.version
+        value = await run_db(loader, *args)
+        if version == self.version:
+            self._entries[key] = value
+        return value
+
+    def _drop(self):
+        self.version += 1
+        self._entries.clear()
+
+    async def invalidate(self):
+        self._drop()
+        await run_db(_bump_shared_version)
+        # Свою новую версию не запоминаем: при сверке кэш сбросится ещё раз,
+        # зато не пропустим запись другого воркера, случившуюся одновременно
+        self._checked_at = float("-inf")
+
+
+reference_cache = ReferenceCache()
+
+
+async def invalidate_reference_cache():
+    await reference_cache.invalidate()
+
+
+def _get_or_create_user(db, tg_id: int) -> User:
+    user = db.query(User).filter(User.tg_id == tg_id).first()
+    if not user:
+        user = User(tg_id=tg_id)
+        db.add(user)
+        db.flush()
+    return user
+
+
+# --- Пользователи и наборы ---
+
+async def get_or_create_user(tg_id: int) -> User:
+    return await run_db(_get_or_create_user, tg_id)
+
+
+async def get_user_sets(tg_id: int, create_user: bool = True) -> list[Set]:
+    """Наборы пользователя (с системными); без create_user незнакомому пользователю — только системные"""
+    def query(db):
+        if create_user:
+            user = _get_or_create_user(db, tg_id)
+        else:
+            user = db.query(User).filter(User.tg_id == tg_id).first()
+        return _get_sets_for_user(db, user.id if user else None)
+
+    return await reference_cache.get(("sets", tg_id, create_user), query)
+
+
+async def get_set(set_id: int) -> Optional[Set]:
+    return await reference_cache.get(("set", set_id), lambda db: db.get(Set, set_id) if set_id else None)
+
+
+async def create_set(tg_id: int, name: str) -> Optional[Set]:
+    """Новый набор пользователя; None, если набор с таким именем уже есть"""
+    def query(db):
+        user = _get_or_create_user(db, tg_id)
+        if db.query(Set).filter_by(name=name, user_id=user.id).first():
+            return None
+        new_set = Set(name=name, user_id=user.id, description="Пользовательский набор")
+        db.add(new_set)
+        db.flush()
+        return new_set
+
+    new_set = await run_db(query)
+    await invalidate_reference_cache()
+    return new_set
+
+
+async def rename_set(set_id: int, name: str) -> bool:
+    def query(db):
+        set_obj = db.get(Set, set_id) if set_id else None
+        if not set_obj:
+            return False
+        set_obj.name = name
+        return True
+
+    renamed = await run_db(query)
+    await invalidate_reference_cache()
+    return renamed
+
+
+# --- Банки и продукты ---
+
+async def get_bank_names() -> dict[int, str]:
+    return await reference_cache.get(("banks",), lambda db: {b.id: b.name for b in db.query(Bank.id, Bank.name)})
+
+
+async def list_set_products(set_id: int) -> list[Product]:
+    return await reference_cache.get(
+        ("products", set_id), lambda db: db.query(Product).filter(Product.set_id == set_id).all()
+    )
+
+
+async def get_products(product_ids: list[int]) -> list[Product]:
+    return await run_db(lambda db: db.query(Product).filter(Product.id.in_(product_ids)).all())
+
+
+async def add_product(set_id: int, bank_name: str, name: str, url: str) -> Optional[Product]:
+    """Продукт в наборе; None, если банка с таким именем нет"""
+    def query(db):
+        bank = db.query(Bank).filter(Bank.name == bank_name).first()
+        if not bank:
+            return None
+        product = Product(set_id=set_id, bank_id=bank.id, name=name, url=url)
+        db.add(product)
+        db.flush()
+        return product
+
+    product = await run_db(query)
+    await invalidate_reference_cache()
+    return product
+
+
+# --- Характеристики ---
+
+async def list_set_characteristics(set_id: int) -> list[Characteristic]:
+    return await reference_cache.get(
+        ("characteristics", set_id),
+        lambda db: db.query(Characteristic).filter(Characteristic.set_id == set_id).all(),
+    )
+
+
+async def get_characteristics(char_ids: list[int]) -> list[Characteristic]:
+    return await run_db(lambda db: db.query(Characteristic).filter(Characteristic.id.in_(char_ids)).all())
+
+
+async def add_characteristic(tg_id: int, set_id: Optional[int], name: str, description: str, value_hint: str) -> Characteristic:
+    def query(db):
+        user = _get_or_create_user(db, tg_id)
+        char = Characteristic(
+            user_id=user.id,
+            set_id=set_id,
+            name=name,
+            description=description,
+            value_hint=value_hint,
+        )
+        db.add(char)
+        db.flush()
+        return char
+
+    char = await run_db(query)
+    await invalidate_reference_cache()
+    return char
+
+
+# --- Значения и журнал ---
+
+async def get_current_values(user_id: int, product_ids: list[int], char_ids: list[int]) -> dict[tuple[int, int], CurrentValue]:
+    return await run_db(get_current_values_map, user_id, product_ids, char_ids)
+
+
+async def save_product_values(user_id: int, product_id: int, values: dict[int, str], source_hash: str) -> int:
+    """Сохраняет значения продукта (см. save_current_values), возвращает число изменившихся"""
+    return await run_db(save_current_values, user_id, product_id, values, source_hash)
+
+
+async def create_log(user_id: int, action: str) -> int:
+    def query(db):
+        log = Log(user_id=user_id, action=action, status="process", tokens_input=0, tokens_output=0, message="")
+        db.add(log)
+        db.flush()
+        return log.id
+
+    return await run_db(query)
+
+
+async def update_log(log_id: int, **fields):
+    def query(db):
+        db.query(Log).filter(Log.id == log_id).update(fields)
+
+    await run_db(query)
+
+
+# --- Задачи парсинга ---
+
+async def create_job(user_id: int, chat_id: int, product_ids: list[int], char_ids: list[int]) -> ParseJob:
+    def query(db):
+        job = ParseJob(user_id=user_id, chat_id=chat_id, product_ids=list(product_ids),
+                       char_ids=list(char_ids), done_product_ids=[], failed_product_ids=[], status="queued")
+        db.add(job)
+        db.flush()
+        return job
+
+    return await run_db(query)
+
+
+async def list_claimable_jobs(max_per_user: int, limit: int) -> list[int]:
+    """
+    Кандидаты на запуск: самая старая задача в очереди у каждого пользователя,
+    у которого выполняется меньше max_per_user задач (по всем воркерам)
+    """
+    def query(db):
+        busy_users = (
+            select(ParseJob.user_id).where(ParseJob.status == "running")
+            .group_by(ParseJob.user_id).having(func.count() >= max_per_user)
+        )
+        oldest = func.min(ParseJob.id)
+        rows = (
+            db.query(oldest)
+            .filter(ParseJob.status == "queued", ParseJob.user_id.not_in(busy_users))
+            .group_by(ParseJob.user_id).order_by(oldest).limit(limit)
+        )
+        return [job_id for (job_id,) in rows]
+
+    return await run_db(query)
+
+
+async def claim_job(job_id: int, max_running: int, max_per_user: int) -> Optional[ParseJob]:
+    """
+    Переводит задачу из queued в running; None, если её уже забрал другой воркер
+    или заняты общие слоты. Лимиты проверяются в том же UPDATE: запись в SQLite
+    последовательна, поэтому они общие для всех воркеров
+    """
+    def query(db):
+        now = datetime.utcnow()
+        running = aliased(ParseJob)
+        total_running = (
+            select(func.count()).select_from(running).where(running.status == "running").scalar_subquery()
+        )
+        user_running = (
+            select(func.count()).select_from(running)
+            .where(running.status == "running", running.user_id == ParseJob.user_id)
+            .scalar_subquery()
+        )
+        claimed = db.query(ParseJob).filter(
+            ParseJob.id == job_id,
+            ParseJob.status == "queued",
+            total_running < max_running,
+            user_running < max_per_user,
+        ).update(
+            {"status": "running", "started_at": now, "heartbeat_at": now},
+            synchronize_session=False,
+        )
+        return db.get(ParseJob, job_id) if claimed else None
+
+    return await run_db(query)
+
+
+async def requeue_stale_jobs(heartbeat_before: datetime) -> int:
+    """Возвращает в очередь задачи, чей воркер перестал отвечать (перезапуск, падение)"""
+    return await run_db(
+        lambda db: db.query(ParseJob)
+        .filter(ParseJob.status == "running", ParseJob.heartbeat_at < heartbeat_before)
+        .update({"status": "queued"}, synchronize_session=False)
+    )
+
+
+async def update_job(job_id: int, **fields):
+    await run_db(lambda db: db.query(ParseJob).filter(ParseJob.id == job_id).update(fields, synchronize_session=False))
+
+
+async def mark_job_product_done(job_id: int, product_id: int, tokens_input: int, tokens_output: int) -> ParseJob:
+    """Отмечает продукт готовым: после перезапуска задача продолжится с оставшихся"""
+    return await run_db(_mark_job_product, job_id, product_id, True, tokens_input, tokens_output)
+
+
+async def mark_job_product_failed(job_id: int, product_id: int, tokens_input: int, tokens_output: int) -> ParseJob:
+    """Отмечает ошибку продукта: готовым он не считается, при перезапуске задачи разбирается снова"""
+    return await run_db(_mark_job_product, job_id, product_id, False, tokens_input, tokens_output)
+
+
+def _mark_job_product(db, job_id: int, product_id: int, ok: bool, tokens_input: int, tokens_output: int) -> ParseJob:
+    job = db.get(ParseJob, job_id)
+    done = [pid for pid in job.done_product_ids if pid != product_id]
+    failed = [pid for pid in (job.failed_product_ids or []) if pid != product_id]
+    if ok:
+        done.append(product_id)
+    else:
+        failed.append(product_id)
+    job.done_product_ids = done
+    job.failed_product_ids = failed
+    # Токены учитываются и у неудачных продуктов: запрос к LLM мог пройти до ошибки
+    job.tokens_input = (job.tokens_input or 0) + tokens_input
+    job.tokens_output = (job.tokens_output or 0) + tokens_output
+    job.heartbeat_at = datetime.utcnow()
+    db.flush()
+    return job
+
+
+async def list_user_jobs(user_id: int, limit: int = 10) -> list[tuple[ParseJob, int]]:
+    """Последние задачи пользователя и число задач в очереди перед каждой ожидающей"""
+    def query(db):
+        jobs = (
+            db.query(ParseJob).filter(ParseJob.user_id == user_id)
+            .order_by(ParseJob.id.desc()).limit(limit).all()
+        )
+        result = []
+        for job in jobs:
+            ahead = 0
+            if job.status == "queued":
+                ahead = db.query(ParseJob).filter(ParseJob.status == "queued", ParseJob.id < job.id).count()
+            result.append((job, ahead))
+        return result
+
+    return await run_db(query)
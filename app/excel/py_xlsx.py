@@ -1,18 +1,24 @@
-#app/excel/py_xlsx.py 
+#app/excel/py_xlsx.py
 
-import openpyxl
-from openpyxl.styles import Font, PatternFill, Alignment
-from openpyxl.utils import get_column_letter
-import pandas as pd
+import time
+from io import BytesIO
+from itertools import groupby
 from pathlib import Path
 from datetime import datetime
+from typing import BinaryIO, Optional, Union
+
+import openpyxl
+from openpyxl.cell import WriteOnlyCell
+from openpyxl.styles import Font, PatternFill, Alignment, NamedStyle
+from openpyxl.utils import get_column_letter
 from sqlalchemy.orm import Session
-from app.db.model import Data, Product, Characteristic, Bank
+from app.db.model import SessionLocal, CurrentValue, Product, Characteristic, Bank
+from config import REPORT_ARCHIVE_DIR, REPORT_ARCHIVE_MAX_FILES, REPORT_ARCHIVE_MAX_AGE
 
 
 RUSSIAN_CHAR_NAMES = {
     "type": "Тип карты",
-    "currency": "Валюта", 
+    "currency": "Валюта",
     "validity": "Срок действия",
     "maintenance_cost": "Обслуживание",
     "free_conditions": "Бесплатно при",
@@ -24,6 +30,13 @@ RUSSIAN_CHAR_NAMES = {
     "additional": "Дополнительно",
 }
 
+EMPTY_VALUE = "—"
+
+REPORT_PREFIX = "Парсинг_Карт_"
+
+# Сколько значений читать из БД за раз
+DATA_BATCH_SIZE = 500
+
 
 def _get_russian_char_name(char_name: str) -> str:
     if char_name in RUSSIAN_CHAR_NAMES:
@@ -31,170 +44,215 @@ def _get_russian_char_name(char_name: str) -> str:
     return char_name
 
 
-def create_bank_excel_report(
+def _fill(color: str) -> PatternFill:
+    return PatternFill(start_color=color, end_color=color, fill_type="solid")
+
+
+def _build_styles() -> dict[str, NamedStyle]:
+    """
+    Стили отчёта: создаются один раз на книгу и переиспользуются всеми ячейками
+    """
+    center = Alignment(wrap_text=True, vertical='center', horizontal='center')
+    top_left = Alignment(wrap_text=True, vertical='top', horizontal='left')
+
+    return {
+        "header": NamedStyle(
+            name="report_header", font=Font(bold=True, color="FFFFFF", size=11),
+            fill=_fill("4472C4"), alignment=center,
+        ),
+        "link": NamedStyle(
+            name="report_link", font=Font(color="0563C1", underline="single", size=10, bold=True),
+            fill=_fill("E7F0FF"), alignment=center,
+        ),
+        "link_label": NamedStyle(
+            name="report_link_label", font=Font(bold=True, size=10, color="0563C1"),
+            fill=_fill("E7F0FF"), alignment=center,
+        ),
+        "link_plain": NamedStyle(
+            name="report_link_plain", font=Font(bold=True, size=10),
+            fill=_fill("E7F0FF"), alignment=center,
+        ),
+        "cell": NamedStyle(name="report_cell", alignment=top_left),
+        "cell_alt": NamedStyle(name="report_cell_alt", fill=_fill("F2F2F2"), alignment=top_left),
+        "cell_empty": NamedStyle(name="report_cell_empty", fill=_fill("FFE6E6"), alignment=top_left),
+    }
+
+
+def _iter_values(db: Session, user_id: int, product_ids: list[int], char_ids: list[int]):
+    """
+    Значения по характеристикам: (characteristic_id, {product_id: value})
+    Читаются только текущие значения, пачками в порядке характеристик
+    """
+    records = (
+        db.query(CurrentValue.characteristic_id, CurrentValue.product_id, CurrentValue.value)
+        .filter(
+            CurrentValue.user_id == user_id,
+            CurrentValue.product_id.in_(product_ids),
+            CurrentValue.characteristic_id.in_(char_ids),
+        )
+        .order_by(CurrentValue.characteristic_id)
+        .yield_per(DATA_BATCH_SIZE)
+    )
+    for char_id, rows in groupby(records, key=lambda row: row.characteristic_id):
+        yield char_id, {row.product_id: row.value for row in rows}
+
+
+def write_bank_excel_report(
     db: Session,
     user_id: int,
     product_ids: list[int],
     char_ids: list[int],
-    output_dir: str = "./reports/"
-) -> str:
-    
+    target: Union[str, Path, BinaryIO],
+) -> bool:
+    """
+    ✅ Потоковая запись отчёта (openpyxl write_only)
+    - Строки пишутся сразу по мере чтения из БД, без pandas и промежуточной таблицы
+    - Стили общие (NamedStyle), а не новый объект на каждую ячейку
+    Возвращает False, если данных для отчёта нет
+    """
+    has_data = db.query(CurrentValue.value).filter(
+        CurrentValue.user_id == user_id,
+        CurrentValue.product_id.in_(product_ids)
+    ).first()
+    if not has_data:
+        print("Нет данных для создания отчета")
+        return False
+
+    products = db.query(Product).filter(Product.id.in_(product_ids)).order_by(Product.id).all()
+    chars = db.query(Characteristic).filter(Characteristic.id.in_(char_ids)).order_by(Characteristic.id).all()
+    bank_map = {b.id: b.name for b in db.query(Bank.id, Bank.name)}
+
+    print(f"Характеристик: {len(chars)}, Продуктов: {len(products)}")
+
+    wb = openpyxl.Workbook(write_only=True)
+    styles = _build_styles()
+    for style in styles.values():
+        wb.add_named_style(style)
+    ws = wb.create_sheet('Сравнение')
+
+    def cell(value, style: str) -> WriteOnlyCell:
+        c = WriteOnlyCell(ws, value=value)
+        c.style = styles[style].name
+        return c
+
+    # Ширина колонок и высота строк задаются до записи строк
+    ws.column_dimensions['A'].width = 30
+    for col_idx in range(2, len(products) + 2):
+        ws.column_dimensions[get_column_letter(col_idx)].width = 25
+    ws.row_dimensions[1].height = 35  # Шапка (синяя)
+    ws.row_dimensions[2].height = 40  # Ссылки (светло-голубая)
+
+    bank_names = [bank_map.get(product.bank_id, "Unknown") for product in products]
+
+    # Шапка
+    header = [cell("Характеристика", "header")]
+    for product, bank_name in zip(products, bank_names):
+        header.append(cell(f"{bank_name}\n{product.name}", "header"))
+    ws.append(header)
+
+    # Ссылки на сайт
+    links = [cell("Ссылка на сайт", "link_label")]
+    for product, bank_name in zip(products, bank_names):
+        if product.url:
+            c = cell(f"🔗 {bank_name}\n{product.name}", "link")
+            c.hyperlink = product.url
+        else:
+            c = cell(f"{bank_name}\n{product.name}", "link_plain")
+        links.append(c)
+    ws.append(links)
+
+    # Значения: одна строка на характеристику, в памяти только текущая строка
+    values = _iter_values(db, user_id, product_ids, char_ids)
+    pending = next(values, None)
+    for row_idx, char in enumerate(chars):
+        char_values = {}
+        if pending is not None and pending[0] == char.id:
+            char_values = pending[1]
+            pending = next(values, None)
+
+        base = "cell_alt" if row_idx % 2 == 0 else "cell"
+        row = [cell(_get_russian_char_name(char.name), base)]
+        for product in products:
+            value = char_values.get(product.id)
+            if value is None or value == EMPTY_VALUE:
+                row.append(cell(EMPTY_VALUE, "cell_empty"))
+            else:
+                row.append(cell(value, base))
+
+        ws.row_dimensions[row_idx + 3].height = 30
+        ws.append(row)
+
+    wb.save(target)
+    return True
+
+
+def _report_filename() -> str:
+    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    return f"{REPORT_PREFIX}{timestamp}.xlsx"
+
+
+def build_bank_excel_report(
+    user_id: int,
+    product_ids: list[int],
+    char_ids: list[int],
+) -> Optional[tuple[str, bytes]]:
+    """
+    ✅ Отчёт в памяти: (имя файла, содержимое) или None
+    Блокирующая функция — вызывать через asyncio.to_thread.
+    Открывает свою сессию, т.к. сессия обработчика принадлежит event loop
+    """
+    db = SessionLocal()
     try:
-        # Получаем данные
-        data_records = db.query(Data).filter(
-            Data.user_id == user_id,
-            Data.product_id.in_(product_ids)
-        ).all()
-        
-        print(f"Найдено {len(data_records)} записей в БД")
-        
-        if not data_records:
-            print("Нет данных для создания отчета")
+        buffer = BytesIO()
+        if not write_bank_excel_report(db, user_id, product_ids, char_ids, buffer):
             return None
-        
-        # Получаем метаданные
-        products = db.query(Product).filter(Product.id.in_(product_ids)).all()
-        chars = db.query(Characteristic).filter(Characteristic.id.in_(char_ids)).all()
-        banks = db.query(Bank).all()
-        
-        print(f"Характеристик: {len(chars)}, Продуктов: {len(products)}")
-        
-        product_map = {p.id: p for p in products}
-        char_map = {c.id: c for c in chars}
-        bank_map = {b.id: b for b in banks}
-        
-        # Структурируем данные
-        structured_data = {}
-        for record in data_records:
-            if record.product_id not in structured_data:
-                structured_data[record.product_id] = {}
-            structured_data[record.product_id][record.characteristic_id] = record.value
-        
-        table_data = []
-        product_urls = {}  # Для хранения URL продуктов
-        
-        for char in chars:
-            char_display_name = _get_russian_char_name(char.name)
-            
-            row = {
-                "Характеристика": char_display_name
-            }
-            
-            for product in products:
-                value = structured_data.get(product.id, {}).get(char.id, "—")
-                
-                bank_name = bank_map.get(product.bank_id, None)
-                bank_name = bank_name.name if bank_name else "Unknown"
-                col_name = f"{bank_name}\n{product.name}"
-                
-                row[col_name] = value
-                
-                if product.id not in product_urls:
-                    product_urls[product.id] = {
-                        "url": product.url,
-                        "name": product.name,
-                        "bank": bank_name,
-                        "col_name": col_name
-                    }
-            
-            table_data.append(row)
-        
-        # Создаём DataFrame
-        df = pd.DataFrame(table_data)
-        
-        # Генерируем имя файла
-        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        filename = f"Парсинг_Карт_{timestamp}.xlsx"
-        
-        output_path = Path(output_dir)
-        output_path.mkdir(parents=True, exist_ok=True)
-        filepath = output_path / filename
-        
-        with pd.ExcelWriter(filepath, engine='openpyxl') as writer:
-            df.to_excel(
-                writer,
-                sheet_name='Сравнение',
-                index=False,
-                startrow=2,
-                header=False  
-            )
-            
-            worksheet = writer.sheets['Сравнение']
-            
-
-            header_fill = PatternFill(start_color="4472C4", end_color="4472C4", fill_type="solid")
-            header_font = Font(bold=True, color="FFFFFF", size=11)
-            
-            for col in range(1, len(df.columns) + 1):
-                cell = worksheet.cell(row=1, column=col)
-                cell.fill = header_fill
-                cell.font = header_font
-                cell.alignment = Alignment(wrap_text=True, vertical='center', horizontal='center')
-
-                cell.value = df.columns[col - 1]
-            
-            cell = worksheet.cell(row=2, column=1)
-            cell.value = "Ссылка на сайт"
-            cell.font = Font(bold=True, size=10, color="0563C1")
-            cell.alignment = Alignment(wrap_text=True, vertical='center', horizontal='center')
-            cell.fill = PatternFill(start_color="E7F0FF", end_color="E7F0FF", fill_type="solid")
-            
-            # Добавляем гиперссылки для каждого продукта (строка 2)
-            for col_idx, product in enumerate(products, 1):
-                if product.id in product_urls:
-                    product_info = product_urls[product.id]
-                    url = product_info["url"]
-                    name = product_info["name"]
-                    bank = product_info["bank"]
-                    
-                    cell = worksheet.cell(row=2, column=col_idx + 1)
-                    
-                    if url:
-                        cell.hyperlink = url
-                        cell.value = f"🔗 {bank}\n{name}"
-                        cell.font = Font(color="0563C1", underline="single", size=10, bold=True)
-                    else:
-                        cell.value = f"{bank}\n{name}"
-                        cell.font = Font(bold=True, size=10)
-                    
-                    cell.alignment = Alignment(wrap_text=True, vertical='center', horizontal='center')
-                    cell.fill = PatternFill(start_color="E7F0FF", end_color="E7F0FF", fill_type="solid")
-            
-
-            data_start_row = 3  
-            
-            for row_idx, row in enumerate(worksheet.iter_rows(min_row=data_start_row), 1):
-                for col_idx, cell in enumerate(row):
-                    cell.alignment = Alignment(wrap_text=True, vertical='top', horizontal='left')
-                    
-                    # Чередуем цвета строк
-                    if (row_idx + 1) % 2 == 0:
-                        cell.fill = PatternFill(start_color="F2F2F2", end_color="F2F2F2", fill_type="solid")
-                    
-                    # Выделяем пустые ячейки
-                    if cell.value is None or cell.value == "—":
-                        cell.fill = PatternFill(start_color="FFE6E6", end_color="FFE6E6", fill_type="solid")
-            
-            # Ширина колонок
-            worksheet.column_dimensions['A'].width = 30
-            for col_idx in range(2, len(df.columns) + 1):
-                col_letter = get_column_letter(col_idx)
-                worksheet.column_dimensions[col_letter].width = 25
-            
-            # Высота строк
-            worksheet.row_dimensions[1].height = 35  # Шапка (синяя)
-            worksheet.row_dimensions[2].height = 40  # Ссылки (светло-голубая)
-            worksheet.row_dimensions[3].height = 20  # Заголовки pandas
-            for row in range(4, len(df) + 4): 
-                worksheet.row_dimensions[row].height = 30
-            
-
-        
-        print(f"Excel создан: {filepath}")
-        return str(filepath)
-        
+
+        filename = _report_filename()
+        content = buffer.getvalue()
+        print(f"Excel создан в памяти: {filename} ({len(content) // 1024} КБ)")
+
+        if REPORT_ARCHIVE_DIR:
+            _archive_report(filename, content)
+
+        return filename, content
+
     except Exception as e:
         print(f"!!! Ошибка при создании Excel: {e}")
         import traceback
         traceback.print_exc()
-        return None
\ No newline at end of file
+        return None
+    finally:
+        db.close()
+
+
+def _archive_report(filename: str, content: bytes):
+    """Копия отчёта в архив с ограничением по числу файлов и возрасту"""
+    try:
+        archive = Path(REPORT_ARCHIVE_DIR)
+        archive.mkdir(parents=True, exist_ok=True)
+        (archive / filename).write_bytes(content)
+        prune_report_archive(archive)
+    except OSError as e:
+        print(f"⚠️ Не удалось сохранить отчёт в архив: {e}")
+
+
+def prune_report_archive(
+    archive: Path,
+    max_files: int = REPORT_ARCHIVE_MAX_FILES,
+    max_age: int = REPORT_ARCHIVE_MAX_AGE,
+) -> int:
+    """Удаляет отчёты старше max_age секунд и всё сверх max_files самых свежих"""
+    reports = sorted(
+        archive.glob(f"{REPORT_PREFIX}*.xlsx"),
+        key=lambda path: path.stat().st_mtime,
+        reverse=True,
+    )
+    expire_before = time.time() - max_age
+    removed = 0
+    for idx, path in enumerate(reports):
+        if idx >= max_files or path.stat().st_mtime < expire_before:
+            path.unlink(missing_ok=True)
+            removed += 1
+    if removed:
+        print(f"🧹 Удалено старых отчётов: {removed}")
+    return removed
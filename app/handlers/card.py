@@ -1,1326 +0,0 @@
-#app/handlers/card.py
-from aiogram import Router, F
-import asyncio
-from aiogram.types import Message, CallbackQuery
-from aiogram.filters import Command
-from aiogram.types import ReplyKeyboardMarkup, KeyboardButton, InlineKeyboardButton, InlineKeyboardMarkup
-from aiogram.types import FSInputFile
-from datetime import datetime
-from sqlalchemy import and_, or_
-import json
-import urllib3
-urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
-import re
-import os
-from gigachat import GigaChat
-import requests
-from bs4 import BeautifulSoup
-from playwright.async_api import async_playwright
-
-from aiogram.fsm.context import FSMContext
-
-from app.keyboards.start_keyboard import (
-    get_top_level_actions_keyboard,
-)
-from app.state import BankState
-from app.excel.py_xlsx import create_bank_excel_report
-from app.db.model import (SessionLocal, User, Log, Data, Bank, Set, Product, Characteristic,
-                           migrate_products, migrate_banks, init_db, get_sets_for_user, recreate_data_table)
-from config import GIGACHAT_TOKEN, SYSTEM_USER_ID
-
-router = Router()
-
-
-FIELD_NAMES = {
-    "type": "Тип карты",
-    "currency": "Валюта", 
-    "validity": "Срок действия",
-    "maintenance_cost": "Обслуживание",
-    "free_conditions": "Бесплатно при",
-    "sms_notification": "СМС уведомления",
-    "atm_limit_own": "Лимит ATM своего",
-    "atm_limit_other": "Лимит ATM других",
-    "loyalty_program": "Программа лояльности",
-    "interest_rate": "% на остаток",
-    "additional": "Дополнительно",
-}
-
-
-async def get_page_content_playwright(url: str, timeout: int = 30000) -> str | None:
-    try:
-        async with async_playwright() as p:
-            browser = await p.chromium.launch(
-                headless=True,
-                args=[
-                    '--disable-blink-features=AutomationControlled',
-                    '--start-maximized',
-                ]
-            )
-            
-            context = await browser.new_context(
-                viewport={'width': 1920, 'height': 1080},
-                user_agent='Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'
-            )
-            
-            page = await context.new_page()
-            
-            try:
-                await page.goto(url, wait_until='networkidle', timeout=timeout)
-                content = await page.content()
-                await browser.close()
-                return content
-            except Exception as e:
-                print(f"Playwright ошибка для {url}: {e}")
-                await browser.close()
-                return None
-    except Exception as e:
-        print(f"Критическая ошибка Playwright: {e}")
-        return None
-
-
-async def get_page_content(url: str) -> str | None:
-
-    try:
-        response = requests.get(
-            url,
-            timeout=10,
-            verify=False,
-            headers={
-                "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36"
-            }
-        )
-        
-        if response.status_code == 200 and len(response.text) > 500:
-            print(f"{url}: загружено через requests")
-            return response.text
-    except Exception as e:
-        print(f"-! requests не сработал для {url}: {type(e).__name__}")
-    
-
-    print(f"- Пробуем Playwright для {url}...")
-    content = await get_page_content_playwright(url)
-    
-    if content and len(content) > 500:
-        print(f"{url}: загружено через Playwright")
-        return content
-    
-    print(f"-!!! Не удалось загрузить {url}")
-    return None
-
-
-
-@router.message(Command("start"))
-async def start_handler(message: Message, state: FSMContext):
-    db = SessionLocal()
-    try:
-        tg_id = message.from_user.id
-        user = db.query(User).filter(User.tg_id == tg_id).first()
-        if user:
-            sets = get_sets_for_user(db, user.id)
-        else:
-            sets = get_sets_for_user(db, None)
-    finally:
-        db.close()
-
-    await message.answer(
-        "👋 Добро пожаловать в бенчмаркинг‑бот!\n\n"
-        "Выберите действие:",
-        parse_mode="Markdown",
-        reply_markup=get_top_level_actions_keyboard(sets)
-    )
-
-    kb = ReplyKeyboardMarkup(
-        keyboard=[
-            [KeyboardButton(text="📊 Собрать информацию")],
-        ],
-        resize_keyboard=True,
-        one_time_keyboard=False,
-    )
-    await message.answer(
-        "Нажмите 💬 внизу, чтобы начать анализ по картам.",
-        reply_markup=kb
-    )
-
-
-@router.message(Command("actv"))
-async def start_multi(message: Message, state: FSMContext):
-    recreate_data_table()
-    # init_db()          # Банки в SQLite
-    # migrate_banks()    # Наборы «Стандарт/Премиум» к user_id=1
-    # migrate_products()
-    # migrate_base_characteristics()
-    print("✅ Полная миграция завершена!")
-
-
-@router.message(F.text == "📊 Собрать информацию")
-async def click_button_start(message: Message, state: FSMContext):
-    db = SessionLocal()
-    sets = db.query(Set).all()
-    db.close()
-    await message.answer( 
-        "Выберите **набор карт**:",
-        parse_mode="Markdown",
-        reply_markup=get_top_level_actions_keyboard(sets)
-    )
-
-
-@router.message(Command('db'))
-async def dump_data_base(message: Message):
-    db_file_path = "credits.db"  
-    
-    try:
-        document = FSInputFile(db_file_path)
-        await message.answer_document(document, caption="Вот ваша база данных")
-    except Exception as e:
-        await message.answer(f"Ошибка при отправке файла: {e}")
-
-async def show_products_keyboard(callback: CallbackQuery, state: FSMContext, set_id: int):
-    text, markup = await build_products_keyboard(state, set_id)
-    await callback.message.edit_text(
-        text,
-        parse_mode="Markdown",
-        reply_markup=markup,
-    )
-    await callback.answer()
-
-
-
-@router.message(BankState.waiting_new_char_for_set)
-async def handle_new_char_for_set(message: Message, state: FSMContext):
-    name = message.text.strip()
-    if not name:
-        await message.answer("Название не должно быть пустым!")
-        return
-
-    data = await state.get_data()
-    set_id = data["editing_set_id"]
-
-    prompt = f"""
-Сформулируй краткое понятное описание для характеристики финансового продукта с названием: "{name}".
-Также добавь маленький текст‑подсказку о типе значения этой характеристики (например: "в BYN", "% годовых", "без ограничений" и т.п.).
-
-Представь ответ в JSON‑форме одной строкой:
-{{
-  "description": "Описание характеристики...",
-  "value_hint": "Подсказка к формату значения"
-}}
-"""
-    giga = GigaChat(
-        credentials=GIGACHAT_TOKEN,
-        scope="GIGACHAT_API_B2B",
-        verify_ssl_certs=False,
-        model="GigaChat-2-Max",
-    )
-    result = giga.chat(prompt)
-    parsed = _parse_json_safely(result.choices[0].message.content)
-
-    desc = parsed.get("description", "Описание характеристики") if parsed else "Описание характеристики"
-    hint = parsed.get("value_hint", "Формат значения") if parsed else "Формат значения"
-
-    await state.update_data(
-        temp_char_name=name,
-        temp_char_description=desc,
-        temp_char_hint=hint,
-    )
-    await state.set_state(BankState.editing_char_for_set)
-
-    kb = InlineKeyboardMarkup(
-        inline_keyboard=[
-            [
-                InlineKeyboardButton(
-                    text="✅ Добавить в набор",
-                    callback_data="confirm_char_for_set",
-                )
-            ]
-        ]
-    )
-
-    await message.answer(
-        f"🔑 Характеристика: *{name}*\n\n"
-        f"📝 Описание:\n{desc}\n"
-        f"💡 Тип значения: {hint}\n\n"
-        "Добавить в набор?",
-        parse_mode="Markdown",
-        reply_markup=kb,
-    )
-
-
-@router.callback_query(F.data == "confirm_char_for_set", BankState.editing_char_for_set)
-async def confirm_char_for_set(callback: CallbackQuery, state: FSMContext):
-    data = await state.get_data()
-    set_id = data["editing_set_id"]
-    name = data["temp_char_name"]
-    desc = data["temp_char_description"]
-    hint = data["temp_char_hint"]
-
-    user_tg_id = callback.from_user.id
-    db = SessionLocal()
-    try:
-        user = db.query(User).filter(User.tg_id == user_tg_id).first()
-        if not user:
-            user = User(tg_id=user_tg_id)
-            db.add(user)
-            db.commit()
-
-        char = Characteristic(
-            user_id=user.id,   # автор характеристики
-            set_id=set_id,     # ПРИВЯЗКА К КОНКРЕТНОМУ НАБОРУ
-            name=name,
-            description=desc,
-            value_hint=hint,
-        )
-        db.add(char)
-        db.commit()
-
-        await callback.message.edit_text(
-            f"✅ Характеристика *{name}* добавлена в набор!",
-            parse_mode="Markdown",
-        )
-
-        # Возвращаемся в настройки набора
-        await edit_set_menu(callback, state)
-    finally:
-        db.close()
-    await callback.answer()
-
-
-async def show_confirmation(callback: CallbackQuery, state: FSMContext):
-    """Показывает подтверждение выбора"""
-    data = await state.get_data()
-    selected_products = data.get("selected_products", [])
-    selected_chars = data.get("selected_characteristics", [])
-    
-    db = SessionLocal()
-    try:
-        # Получаем имена продуктов
-        product_objects = db.query(Product).filter(Product.id.in_(selected_products)).all()
-        product_names = [p.name for p in product_objects]
-        
-        # Получаем имена характеристик
-        char_objects = db.query(Characteristic).filter(Characteristic.set_id.in_(selected_chars)).all()
-        char_names = [c.name for c in char_objects]
-        display_char_names = [FIELD_NAMES.get(name, name) for name in char_names]
-        
-        # Получаем уникальные банки
-        bank_ids = set(p.bank_id for p in product_objects)
-        banks = db.query(Bank).filter(Bank.id.in_(bank_ids)).all()
-        bank_names = [b.name for b in banks]
-        
-        keyboard = [
-            [InlineKeyboardButton(text="✅ Да, начать парсинг", callback_data="start_parsing")],
-            [InlineKeyboardButton(text="⬅️ Назад", callback_data="back_to_characteristics")]
-        ]
-        
-        text = (
-            "📋 **Подтверждение выбора**\n\n"
-            f"**Продукты:** {', '.join(product_names)}\n\n"
-            f"**Характеристики:** {', '.join(display_char_names)}\n\n"
-            f"**Банки:** {', '.join(bank_names)}\n\n"
-            "Начать парсинг?"
-        )
-        
-        await callback.message.edit_text(
-            text,
-            parse_mode="Markdown",
-            reply_markup=InlineKeyboardMarkup(inline_keyboard=keyboard)
-        )
-    finally:
-        db.close()
-    
-    await callback.answer()
-
-
-
-@router.callback_query(F.data.startswith("set_"))
-async def handle_set_from_main_menu(callback: CallbackQuery, state: FSMContext):
-    data = callback.data  # 'set_3'
-    parts = data.split("_")
-    if len(parts) != 2:
-        await callback.answer()
-        return
-
-    try:
-        set_id = int(parts[1])
-    except ValueError:
-        await callback.answer("Некорректный набор", show_alert=True)
-        return
-
-    db = SessionLocal()
-    try:
-        set_obj = db.query(Set).filter_by(id=set_id).first()
-        if not set_obj:
-            await callback.answer("Набор не найден", show_alert=True)
-            return
-
-        # сохраняем выбранный набор
-        await state.update_data(selected_set_id=set_id,
-                               selected_products=[],
-                               selected_characteristics=[])
-
-        # переходим на шаг выбора продуктов
-        await state.set_state(BankState.waiting_products)
-        await show_products_keyboard(callback, state, set_id)
-    finally:
-        db.close()
-
-    await callback.answer()
-
-@router.callback_query(F.data == "create_new_set")
-async def create_new_set_start(callback: CallbackQuery, state: FSMContext):
-    await state.set_state(BankState.waiting_new_set_name)
-    await callback.message.edit_text("Введите название нового набора:")
-
-from app.keyboards.start_keyboard import get_product_list_keyboard
-
-@router.callback_query(F.data.startswith("set_products_"))
-async def open_set_products(callback: CallbackQuery, state: FSMContext):
-    try:
-        set_id = int(callback.data.split("_")[-1])
-    except (IndexError, ValueError):
-        await callback.answer("Ошибка набора", show_alert=True)
-        return
-
-    db = SessionLocal()
-    try:
-        products = db.query(Product).filter_by(set_id=set_id).all()
-        await state.update_data(current_set_id=set_id)
-
-        if not products:
-            await callback.message.edit_text(
-                "В этом наборе пока нет продуктов.",
-                reply_markup=InlineKeyboardMarkup(
-                    inline_keyboard=[
-                        [InlineKeyboardButton(text="➕ добавить продукт", callback_data="add_product_to_this_set")],
-                        [InlineKeyboardButton(text="⬅️ Назад", callback_data=f"set_{set_id}")],
-                    ]
-                )
-            )
-        else:
-            await callback.message.edit_text(
-                "Продукты набора:",
-                reply_markup=get_product_list_keyboard(products)
-            )
-    finally:
-        db.close()
-    await callback.answer()
-
-
-
-@router.callback_query(F.data == "back_to_main_menu")
-async def back_to_main_menu(callback: CallbackQuery, state: FSMContext):
-    db = SessionLocal()
-    try:
-        # показываем все наборы: системные (user_id is NULL) + этого пользователя
-        tg_id = callback.from_user.id
-        user = db.query(User).filter(User.tg_id == tg_id).first()
-        if user:
-            sets = get_sets_for_user(db, user.id)
-        else:
-            sets = get_sets_for_user(db, None)  # вернёт только глобальные
-    finally:
-        db.close()
-
-    await state.clear()
-    await callback.message.edit_text(
-        "Выберите действие:",
-        reply_markup=get_top_level_actions_keyboard(sets)
-    )
-    await callback.answer()
-
-@router.callback_query(F.data == "go_to_sets")
-async def go_to_sets(callback: CallbackQuery, state: FSMContext):
-    db = SessionLocal()
-    try:
-        sets = db.query(Set).all()
-    finally:
-        db.close()
-
-    await callback.message.edit_text(
-        "Выберите набор карт:",
-        reply_markup=get_top_level_actions_keyboard(sets)
-    )
-    await callback.answer()
-
-
-@router.message(BankState.waiting_new_set_name)
-async def create_set_process(message: Message, state: FSMContext):
-    name = message.text.strip()
-    if not name:
-        await message.answer("Название не должно быть пустым. Введите название набора:")
-        return
-
-    user_id = message.from_user.id
-    db = SessionLocal()
-
-    try:
-        user = db.query(User).filter(User.tg_id == user_id).first()
-        if not user:
-            user = User(tg_id=user_id)
-            db.add(user)
-            db.commit()
-
-        existing = db.query(Set).filter_by(name=name, user_id=user.id).first()
-        if existing:
-            await message.answer(f"Набор с таким именем уже есть: {name}")
-            await state.clear()
-            return
-
-        new_set = Set(
-            name=name,
-            user_id=user.id,
-            description="Пользовательский набор"
-        )
-        db.add(new_set)
-        db.commit()
-        db.refresh(new_set)
-
-        await state.update_data(
-            selected_set_id=new_set.id,
-            selected_products=[],
-            selected_characteristics=[],
-        )
-        await state.set_state(BankState.waiting_products)
-
-        await message.answer(
-            "Набор создан. Теперь выберите продукты:",
-            parse_mode="Markdown",
-        )
-
-    finally:
-        db.close()
-
-
-
-async def build_products_keyboard(state: FSMContext, set_id: int):
-    data = await state.get_data()
-    selected_products = set(data.get("selected_products", []))
-
-    db = SessionLocal()
-    try:
-        products = db.query(Product).filter_by(set_id=set_id).all()
-        set_obj = db.query(Set).filter_by(id=set_id).first()
-    finally:
-        db.close()
-
-    keyboard = []
-    for product in products:
-        is_selected = product.id in selected_products
-        emoji = "✅" if is_selected else ""
-        keyboard.append([
-            InlineKeyboardButton(
-                text=f"{emoji} {product.name}",
-                callback_data=f"toggle_product_{product.id}"
-            )
-        ])
-
-    keyboard.append([
-        InlineKeyboardButton(text="➕ Добавить продукт", callback_data=f"add_product_to_set_{set_id}")
-    ])
-    keyboard.append([
-        InlineKeyboardButton(text="✏️ Настройки набора", callback_data=f"edit_set_{set_id}")
-    ])
-    keyboard.append([
-        InlineKeyboardButton(text="⬅️ Назад", callback_data="back_to_set"),
-        InlineKeyboardButton(text="➡️ Далее", callback_data="show_characteristics")
-    ])
-
-    set_name = set_obj.name if set_obj else "Набор"
-    text = f"📦 **{set_name}**\n\nВыберите продукты\nВыбрано: {len(selected_products)}/{len(products)}"
-
-    markup = InlineKeyboardMarkup(inline_keyboard=keyboard)
-    return text, markup
-
-
-@router.callback_query(F.data == "show_characteristics", BankState.waiting_products)
-async def show_characteristics(callback: CallbackQuery, state: FSMContext):
-    """
-    Экран выбора характеристик для конкретного набора.
-    Характеристики берём только те, что привязаны к set_id (кастомные для набора).
-    """
-    data = await state.get_data()
-    set_id = data.get("selected_set_id")
-    if not set_id:
-        await callback.answer("Набор не выбран", show_alert=True)
-        return
-
-    selected_chars = set(data.get("selected_characteristics", []))
-
-    db = SessionLocal()
-    try:
-        # Берём только характеристики этого набора (никаких глобальных)
-        chars = db.query(Characteristic).filter(
-            Characteristic.set_id == set_id
-        ).all()
-    finally:
-        db.close()
-
-    keyboard: list[list[InlineKeyboardButton]] = []
-
-    for char in chars:
-        is_selected = char.id in selected_chars
-        emoji = "✅" if is_selected else "⬜️"
-        display_name = FIELD_NAMES.get(char.name, char.name)
-        keyboard.append([
-            InlineKeyboardButton(
-                text=f"{emoji} {display_name}",
-                callback_data=f"toggle_char_{char.id}",
-            )
-        ])
-
-    # Управляющие кнопки
-    keyboard.append([
-        InlineKeyboardButton(
-            text="➕ Добавить характеристику",
-            callback_data="add_char_to_set",
-        )
-    ])
-    keyboard.append([
-        InlineKeyboardButton(
-            text="⬅️ Назад к продуктам",
-            callback_data="back_to_products",
-        ),
-        InlineKeyboardButton(
-            text="➡️ Подтвердить",
-            callback_data="confirm_selection",
-        ),
-    ])
-
-    text = (
-        "🔧 Выберите характеристики этого набора\n\n"
-        f"Выбрано: {len(selected_chars)}/{len(chars)}"
-    )
-
-    await state.set_state(BankState.waiting_characteristics)
-    await callback.message.edit_text(
-        text,
-        reply_markup=InlineKeyboardMarkup(inline_keyboard=keyboard),
-    )
-    await callback.answer()
-
-@router.callback_query(F.data.startswith("edit_set_"), BankState.waiting_products)
-async def edit_set_menu(callback: CallbackQuery, state: FSMContext):
-    set_id = int(callback.data.split("_")[-1])
-    await state.update_data(current_set_id=set_id)
-    db = SessionLocal()
-    try:
-        set_obj = db.query(Set).filter_by(id=set_id).first()
-        if not set_obj:
-            await callback.answer("Набор не найден", show_alert=True)
-            return
-
-        text = (
-            f"⚙️ Настройки набора: *{set_obj.name}*\n\n"
-            "Вы можете изменить имя и управлять характеристиками этого набора."
-        )
-
-        keyboard = InlineKeyboardMarkup(
-            inline_keyboard=[
-                [
-                    InlineKeyboardButton(text="✏️ Изменить имя", callback_data="edit_set_name"),
-                ],
-                [
-                    InlineKeyboardButton(text="➕ Добавить характеристику", callback_data="add_char_to_set"),
-                ],
-                [
-                    InlineKeyboardButton(text="⬅️ Назад к продуктам", callback_data="back_to_set_products"),
-                ],
-            ]
-        )
-
-        await callback.message.edit_text(text, parse_mode="Markdown", reply_markup=keyboard)
-    finally:
-        db.close()
-    await callback.answer()
-
-
-@router.callback_query(F.data == "back_to_set_products")
-async def back_to_set_products(callback: CallbackQuery, state: FSMContext):
-    data = await state.get_data()
-    set_id = data.get("current_set_id") or data.get("selected_set_id")
-    await state.set_state(BankState.waiting_products)
-    await show_products_keyboard(callback, state, set_id)
-
-
-@router.callback_query(F.data == "edit_set_name")
-async def edit_set_name_start(callback: CallbackQuery, state: FSMContext):
-    data = await state.get_data()
-    set_id = data.get("current_set_id")
-    if not set_id:
-        await callback.answer("Набор не выбран", show_alert=True)
-        return
-
-    db = SessionLocal()
-    try:
-        set_obj = db.query(Set).filter_by(id=set_id).first()
-        if not set_obj:
-            await callback.answer("Набор не найден", show_alert=True)
-            return
-
-        await state.set_state(BankState.waiting_set_name_edit)
-        await callback.message.edit_text(
-            f"✏️ Текущее имя: *{set_obj.name}*\n\nВведите новое название:",
-            parse_mode="Markdown",
-        )
-    finally:
-        db.close()
-    await callback.answer()
-
-
-@router.message(BankState.waiting_set_name_edit)
-async def process_set_name_edit(message: Message, state: FSMContext):
-    new_name = message.text.strip()
-    if not new_name:
-        await message.answer("Название не должно быть пустым!")
-        return
-
-    data = await state.get_data()
-    set_id = data.get("current_set_id")
-
-    db = SessionLocal()
-    try:
-        set_obj = db.query(Set).filter_by(id=set_id).first()
-        if not set_obj:
-            await message.answer("Набор не найден")
-            return
-
-        set_obj.name = new_name
-        db.commit()
-
-        await message.answer(f"✅ Имя набора изменено на: *{new_name}*", parse_mode="Markdown")
-
-        # Вернём пользователя обратно в настройки набора
-        kb = InlineKeyboardMarkup(
-            inline_keyboard=[
-                [
-                    InlineKeyboardButton(text="✏️ Изменить имя", callback_data="edit_set_name"),
-                ],
-                [
-                    InlineKeyboardButton(text="➕ Добавить характеристику", callback_data="add_char_to_set"),
-                ],
-                [
-                    InlineKeyboardButton(text="⬅️ Назад к продуктам", callback_data="back_to_set_products"),
-                ],
-            ]
-        )
-        await message.answer(
-            f"⚙️ Настройки набора: *{new_name}*",
-            parse_mode="Markdown",
-            reply_markup=kb,
-        )
-        await state.set_state(BankState.waiting_characteristics)  # логически можно оставить отдельное состояние
-    finally:
-        db.close()
-
-@router.callback_query(F.data == "add_char_to_set")
-async def add_char_to_set_start(callback: CallbackQuery, state: FSMContext):
-    data = await state.get_data()
-    set_id = data.get("current_set_id")
-    if not set_id:
-        await callback.answer("Набор не выбран", show_alert=True)
-        return
-
-    await state.update_data(editing_set_id=set_id)
-    await state.set_state(BankState.waiting_new_char_for_set)
-    await callback.message.edit_text("➕ Введите название новой характеристики для этого набора:")
-    await callback.answer()
-
-
-
-@router.callback_query(F.data.startswith("toggle_product_"), BankState.waiting_products)
-async def toggle_product(callback: CallbackQuery, state: FSMContext):
-    """Переключение выбора продукта"""
-    product_id = int(callback.data.split("_", 2)[2])
-    data = await state.get_data()
-    selected_products = set(data.get("selected_products", []))
-    
-    if product_id in selected_products:
-        selected_products.remove(product_id)
-    else:
-        selected_products.add(product_id)
-    
-    set_id = data.get("selected_set_id")
-    await state.update_data(selected_products=list(selected_products))
-    await show_products_keyboard(callback, state, set_id)
-
-
-@router.callback_query(F.data == "back_to_set", BankState.waiting_products)
-async def back_to_set(callback: CallbackQuery, state: FSMContext):
-    """Возврат к главному меню с наборами."""
-    await state.update_data(selected_products=[])
-
-    db = SessionLocal()
-    try:
-        tg_id = callback.from_user.id
-        user = db.query(User).filter(User.tg_id == tg_id).first()
-        if user:
-            sets = get_sets_for_user(db, user.id)
-        else:
-            sets = get_sets_for_user(db, None)
-    finally:
-        db.close()
-
-    await state.clear()
-    await callback.message.edit_text(
-        "👋 Выберите **набор карт**:",
-        parse_mode="Markdown",
-        reply_markup=get_top_level_actions_keyboard(sets)
-    )
-    await callback.answer()
-
-
-
-@router.callback_query(F.data.startswith("add_product_to_set_"))
-async def add_product_start(callback: CallbackQuery, state: FSMContext):
-    set_id = int(callback.data.split("_")[-1])
-    await state.update_data(editing_set_id=set_id)
-    await state.set_state(BankState.waiting_product_url)
-    await callback.message.edit_text("Введите ссылку на страницу продукта (карты/кредита/депозита):")
-
-
-@router.message(BankState.waiting_product_url)
-async def handle_product_url(message: Message, state: FSMContext):
-    url = message.text.strip()
-    if not (url.startswith("http://") or url.startswith("https://")):
-        await message.answer("Введите корректный URL (начинается с http:// или https://)")
-        return
-
-    data = await state.get_data()
-    set_id = data["editing_set_id"]
-    user_id = message.from_user.id
-
-    # Загрузка контента
-    page_content = await get_page_content(url)
-    if not page_content:
-        await message.answer("Не удалось загрузить страницу. Проверьте URL и попробуйте снова.")
-        await state.clear()
-        return
-
-    # Немного HTML или текста на LLM
-    soup = BeautifulSoup(page_content, "html.parser")
-    for tag in soup(['script', 'style', 'meta', 'link', 'svg', 'iframe', 'noscript']):
-        tag.decompose()
-    text = soup.get_text(separator=" ", strip=True)[:10_000]
-
-    # Запрос к GigaChat
-    giga = GigaChat(
-        credentials=GIGACHAT_TOKEN,
-        scope="GIGACHAT_API_B2B",
-        verify_ssl_certs=False,
-        model="GigaChat-2-Max"
-    )
-
-    prompt = f"""
-Проанализируй текст страницы и определи:
-
-1. название банка (кратко: просто "Сбер", "Альфа Банк", "Беларусбанк" и т.п.);
-2. название продукта (карты, кредита или депозита).
-
-Формат ответа — JSON строкой:
-{{
-"bank": "НАЗВАНИЕ_БАНКА",
-"product": "НАЗВАНИЕ_ПРОДУКТА"
-}}
-
-text
-
-ТЕКСТ:
-{text}
-"""
-
-    result = giga.chat(prompt)
-    raw = result.choices[0].message.content
-
-    parsed = _parse_json_safely(raw)
-    if not parsed:
-        bank_guess = "Банк (уточните)"
-        product_guess = "Продукт (уточните)"
-    else:
-        bank_guess = parsed.get("bank", "Банк (уточните)")
-        product_guess = parsed.get("product", "Продукт (уточните)")
-
-    # Сохраняем временные данные в FSM
-    await state.update_data(
-        temp_product_url=url,
-        temp_bank_guess=bank_guess,
-        temp_product_guess=product_guess,
-    )
-    await state.set_state(BankState.waiting_product_confirm)
-
-    keyboard = InlineKeyboardMarkup(
-        inline_keyboard=[
-            [
-                InlineKeyboardButton(text="✅ Подтвердить", callback_data="confirm_product"),
-                InlineKeyboardButton(text="✏️ Редактировать", callback_data="edit_product_bank_product"),
-            ]
-        ]
-    )
-    await message.answer(
-        "LLM предположил:\n"
-        f"🏦 Банк: <b>{bank_guess}</b>\n"
-        f"💳 Продукт: <b>{product_guess}</b>\n\n"
-        "Проверьте и подтвердите или отредактируйте.",
-        parse_mode="HTML",
-        reply_markup=keyboard,
-    )
-
-
-
-@router.callback_query(F.data == "confirm_product", BankState.waiting_product_confirm)
-async def confirm_product(callback: CallbackQuery, state: FSMContext):
-    data = await state.get_data()
-    url = data["temp_product_url"]
-    bank_guess = data["temp_bank_guess"]
-    product_guess = data["temp_product_guess"]
-    set_id = data.get("editing_set_id") or data.get("selected_set_id")
-
-    db = SessionLocal()
-    try:
-        bank = db.query(Bank).filter(Bank.name == bank_guess).first()
-        if not bank:
-            # можно создать банк или попросить уточнить
-            await callback.answer("Банк не найден в БД, добавь вручную.", show_alert=True)
-            return
-
-        product = Product(
-            set_id=set_id,
-            bank_id=bank.id,
-            name=product_guess,
-            url=url,
-        )
-        db.add(product)
-        db.commit()
-    finally:
-        db.close()
-
-    # возвращаемся на выбор продуктов
-    await state.set_state(BankState.waiting_products)
-    await state.update_data(editing_set_id=None)  # очистить временное
-    await show_products_keyboard(callback, state, set_id)
-
-
-@router.callback_query(F.data == "add_characteristic")
-async def add_characteristic_start(callback: CallbackQuery, state: FSMContext):
-    await state.set_state(BankState.waiting_char_name)
-    await callback.message.edit_text("Введите название характеристики (например, \"Обслуживание\"):")
-
-
-@router.message(BankState.waiting_char_name)
-async def handle_char_name(message: Message, state: FSMContext):
-    name = message.text.strip()
-    if not name:
-        await message.answer("Введите не‑пустое название характеристики:")
-        return
-
-    await state.update_data(temp_char_name=name)
-    user_id = message.from_user.id
-
-    db = SessionLocal()
-    try:
-        user = db.query(User).filter(User.tg_id == user_id).first()
-        if not user:
-            user = User(tg_id=user_id)
-            db.add(user)
-            db.commit()
-    finally:
-        db.close()
-
-    # Генерация описания от GigaChat
-    prompt = f"""
-Сформулируй краткое понятное описание для характеристики финансового продукта с названием: "{name}".
-Также добавь маленький текст‑подсказку о типе значения этой характеристики (например: "в BYN", "% годовых", "без ограничений" и т.п.).
-
-Представь ответ в JSON‑форме одной строкой:
-{{
-  "description": "Описание характеристики...",
-  "value_hint": "Подсказка к формату значения"
-}}
-"""
-
-    giga = GigaChat(
-        credentials=GIGACHAT_TOKEN,
-        scope="GIGACHAT_API_B2B",
-        verify_ssl_certs=False,
-        model="GigaChat-2-Max"
-    )
-
-    result = giga.chat(prompt)
-    raw = result.choices[0].message.content
-    parsed = _parse_json_safely(raw)
-
-    if not parsed:
-        desc = "Описание характеристики."
-        hint = "Заполните вручную (BYN, % и т.п.)"
-    else:
-        desc = parsed.get("description", "Описание характеристики.")
-        hint = parsed.get("value_hint", "Подсказка не сформирована")
-
-    await state.update_data(
-        temp_char_description=desc,
-        temp_char_hint=hint,
-    )
-    await state.set_state(BankState.editing_char_desc)
-
-    # Показываем для редактирования
-    kb = InlineKeyboardMarkup(
-        inline_keyboard=[
-            [
-                InlineKeyboardButton(text="✅ Добавить", callback_data="confirm_characteristic"),
-                InlineKeyboardButton(text="✏️ Изменить описание", callback_data="edit_characteristic_desc"),
-            ]
-        ]
-    )
-
-    await message.answer(
-        f"🔑 Характеристика: <b>{name}</b>\n\n"
-        f"📝 Описание:\n<pre>{desc}</pre>\n"
-        f"💡 Тип значения: <code>{hint}</code>\n\n"
-        "Проверьте и подтвердите или отредактируйте.",
-        parse_mode="HTML",
-        reply_markup=kb,
-    )
-
-
-
-
-@router.callback_query(F.data.startswith("toggle_char_"), BankState.waiting_characteristics)
-async def toggle_characteristic(callback: CallbackQuery, state: FSMContext):
-    """Переключение выбора характеристики"""
-    char_id = int(callback.data.split("_", 2)[2])
-    data = await state.get_data()
-    selected_chars = set(data.get("selected_characteristics", []))
-    
-    if char_id in selected_chars:
-        selected_chars.remove(char_id)
-    else:
-        selected_chars.add(char_id)
-    
-    await state.update_data(selected_characteristics=list(selected_chars))
-
-
-@router.callback_query(F.data == "back_to_products", BankState.waiting_characteristics)
-async def back_to_products(callback: CallbackQuery, state: FSMContext):
-    """Возврат к выбору продуктов"""
-    data = await state.get_data()
-    set_id = data.get("selected_set_id")
-    await state.set_state(BankState.waiting_products)
-    await show_products_keyboard(callback, state, set_id)
-
-
-
-@router.callback_query(F.data == "confirm_selection", BankState.waiting_characteristics)
-async def confirm_selection(callback: CallbackQuery, state: FSMContext):
-    """Показывает подтверждение перед парсингом"""
-    data = await state.get_data()
-    
-    if not data.get("selected_characteristics"):
-        await callback.answer("❌ Выберите хотя бы одну характеристику!", show_alert=True)
-        return
-    
-    await show_confirmation(callback, state)
-    await callback.answer()
-
-
-@router.callback_query(F.data == "back_to_characteristics")
-async def back_to_characteristics(callback: CallbackQuery, state: FSMContext):
-    """Возврат к выбору характеристик из подтверждения"""
-    await state.set_state(BankState.waiting_characteristics)
-
-
-@router.callback_query(F.data == "start_parsing")
-async def parse_selected_banks(callback: CallbackQuery, state: FSMContext):
-    """Запуск парсинга"""
-    user_id = callback.from_user.id
-    db = SessionLocal()
-
-    try:
-        log = Log(
-            user_id=user_id,
-            action="parse",
-            status="new",
-            created_at=datetime.utcnow(),
-        )
-        db.add(log)
-        db.commit()
-
-        log.status = "process"
-        db.commit()
-
-        data = await state.get_data()
-        selected_products = data.get("selected_products", [])
-        selected_chars = data.get("selected_characteristics", [])
-
-        # Получаем данные из БД
-        selected_char_names = []
-        selected_product_data = []
-        
-        if selected_chars:
-            char_objects = db.query(Characteristic).filter(
-                Characteristic.id.in_(selected_chars)
-            ).all()
-            selected_char_names = [c.name for c in char_objects]
-            print(f"DEBUG: Выбранные характеристики: {selected_char_names}")
-        
-        if selected_products:
-            selected_product_data = db.query(Product).filter(
-                Product.id.in_(selected_products)
-            ).all()
-            selected_product_names = [p.name for p in selected_product_data]
-        else:
-            await callback.message.edit_text("❌ Выберите хотя бы один продукт")
-            db.close()
-            return
-
-        # Получаем уникальные банки из выбранных продуктов
-        bank_ids = set(p.bank_id for p in selected_product_data)
-        banks = db.query(Bank).filter(Bank.id.in_(bank_ids)).all()
-        all_banks = [b.name for b in banks]
-        
-        if not all_banks:
-            await callback.message.edit_text("❌ Не найдены банки для выбранных продуктов")
-            db.close()
-            return
-
-        giga = GigaChat(
-            credentials=GIGACHAT_TOKEN,
-            scope="GIGACHAT_API_B2B",
-            verify_ssl_certs=False,
-            model="GigaChat-2-Max"
-        )
-
-        # Преобразуем имена характеристик для вывода
-        display_char_names = [FIELD_NAMES.get(name, name) for name in selected_char_names]
-
-        await callback.message.edit_text(
-            f"🔄 Запуск парсинга...\n\n"
-            f"Продукты: {', '.join(selected_product_names)}\n"
-            f"Характеристики: {', '.join(display_char_names) if display_char_names else 'Все'}\n"
-            f"Банки: {', '.join(all_banks)}"
-        )
-        results = []
-
-        total = len(all_banks)
-
-        for i, bank_name in enumerate(all_banks, 1):
-            progress = int(i / total * 10)
-            bar = "█" * progress + "░" * (10 - progress)
-
-            try:
-                await callback.message.edit_text(
-                    f"Запуск сбора информации\n\n"
-                    f"Банк: {bank_name} ({i}/{total})\n[{bar}]"
-                )
-
-                config = db.query(Bank).filter_by(name=bank_name).first()
-                if not config:
-                    print(f"-! Банк {bank_name} не найден в БД")
-                    results.append(_empty_schema(bank_name))
-                    continue
-
-                url = config.url
-
-                # Загружаем контент с fallback на Playwright
-                page_content = await get_page_content(url)
-                
-                if not page_content or len(page_content) < 500:
-                    print(f"-! {bank_name}: не удалось загрузить страницу")
-                    results.append(_empty_schema(bank_name))
-                    continue
-
-                print(f"- {bank_name}: размер HTML {len(page_content)} символов")
-
-                soup = BeautifulSoup(page_content, 'html.parser')
-
-                for tag in soup(['script', 'style', 'meta', 'link', 'svg', 'iframe', 'noscript']):
-                    tag.decompose()
-
-                cleaned_html = str(soup)
-                if len(cleaned_html) > 120000:
-                    cleaned_html = cleaned_html[:120000]
-
-                if len(cleaned_html) < 300:
-                    print(f"-! {bank_name}: После очистки HTML слишком мал ({len(cleaned_html)} символов)")
-                    results.append(_empty_schema(bank_name))
-                    continue
-
-                prompt = f"""Извлеки данные по карте "{bank_name}" из HTML. ВСЕ поля искать везде - в таблицах, списках, divs, spans.
-
-ИНСТРУКЦИИ:
-1. Ищи в <table>, <tr>, <td>, <ul>, <li>, <div>, <span>, <p> - везде
-2. Комбинируй информацию если она разделена на части
-3. Если значение не найдено - напиши null (только null, не "не найдено")
-4. Ответ - ТОЛЬКО JSON в одну строку
-
-ПОЛЯ (примеры в скобках):
-- type: "Mastercard", "Виза", "Мир", "Белкарта" (ищи в заголовках, названиях)
-- currency: "BYN", "USD", "EUR" (ищи "Валюта счета", "currency")
-- validity: "3 года", "4 года", "5 лет" (ищи "Срок", "действия")
-- maintenance_cost: "3 BYN", "бесплатно", "29 BYN" (ищи "обслуживание", "плата", "вознаграждение")
-- free_conditions: "если операции > 600 BYN в месяц", "при выполнении условий" (ищи "условиях", "если")
-- sms_notification: "4.5 BYN", "бесплатно" (ищи "SMS", "информирование", "оповещение")
-- atm_limit_own: "без ограничений", "1000 BYN" (ищи "банкоматы", "свои", "собственные")
-- atm_limit_other: "3.5%", "500 BYN" (ищи "иные банки", "комиссия", "других")
-- loyalty_program: "0.75%", "мани-бэк 3%", "бонусная программа" (ищи "%", "бонус", "кэшбэк")
-- interest_rate: "0.01%", "3%", "проценты" (ищи "% годовых", "на остаток", "ставка")
-- additional: минимальный остаток, условия открытия, льготы, особенности (важное)
-
-ВЫВОД - JSON в одну строку:
-{{"type":"...","currency":"...","validity":"...","maintenance_cost":"...","free_conditions":"...","sms_notification":"...","atm_limit_own":"...","atm_limit_other":"...","loyalty_program":"...","interest_rate":"...","additional":"..."}}
-
-HTML:
-{cleaned_html}"""
-
-                result = giga.chat(prompt)
-                raw_response = result.choices[0].message.content
-
-                print(f"\n🔍 {bank_name} RAW: {repr(raw_response[:150])}")
-
-                parsed_data = _parse_json_safely(raw_response)
-                if not parsed_data:
-                    print(f"!!! {bank_name}: Не удалось распарсить JSON")
-                    results.append(_empty_schema(bank_name))
-                    continue
-
-                has_data = any(v for v in parsed_data.values() if v and v != "null")
-                if not has_data:
-                    print(f"!!!!!{bank_name}: JSON распарсен но все поля null/пусто")
-                    print(f"  >>> Пробуем текстовый парсинг HTML...")
-
-                    text_content = soup.get_text(separator=" ", strip=True)[:70000]
-
-                    prompt_fallback = f"""Извлеки данные карты "{bank_name}" из текста ниже. Очень важно найти ВСЕ значения.
-
-{prompt.split('HTML:')[0]}
-
-ТЕКСТ:
-{text_content}"""
-
-                    try:
-                        result_fallback = giga.chat(prompt_fallback)
-                        raw_response_fallback = result_fallback.choices[0].message.content
-                        parsed_data = _parse_json_safely(raw_response_fallback)
-
-                        if parsed_data and any(v for v in parsed_data.values() if v and v != "null"):
-                            print(f"Текстовый парсинг сработал!")
-                        else:
-                            print(f"Даже текстовый парсинг не помог")
-                            results.append(_empty_schema(bank_name))
-                            continue
-                    except Exception as e:
-                        print(f"Ошибка fallback: {str(e)}")
-                        results.append(_empty_schema(bank_name))
-                        continue
-
-                parsed_data["bank"] = bank_name
-                print(f"{bank_name}: type={parsed_data.get('type')}")
-                results.append(parsed_data)
-
-                await asyncio.sleep(1.0)
-
-            except Exception as e:
-                print(f"{bank_name}: Ошибка {str(e)}")
-                results.append(_empty_schema(bank_name))
-
-        try:
-            # Сохраняем выбранные характеристики
-            if selected_char_names:
-                characteristics = ",".join(selected_char_names)
-            else:
-                characteristics = (
-                    "type,currency,validity,maintenance_cost,"
-                    "free_conditions,sms_notification,atm_limit_own,"
-                    "atm_limit_other,loyalty_program,interest_rate,additional"
-                )
-
-            data_row = Data(
-                user_id=user_id,
-                characteristics=characteristics,
-                card_set=",".join(selected_product_names),
-                payload=results,
-            )
-            db.add(data_row)
-            db.commit()
-
-            excel_path = await asyncio.to_thread(
-                create_bank_excel_report,
-                results,
-                "./reports/",
-                selected_char_names if selected_char_names else None
-            )
-
-            file = FSInputFile(excel_path)
-            await callback.message.answer_document(
-                file,
-                caption=f"✅ Парсинг завершен!\n\n"
-                       f"Продукты: {', '.join(selected_product_names)}\n"
-                       f"Банки: {', '.join(all_banks)}"
-            )
-            os.unlink(excel_path)
-            await callback.message.edit_text("📁 Excel файл отправлен!")
-
-            log.status = "ok"
-            db.commit()
-
-        except Exception as e:
-            log.status = "error"
-            log.message = str(e)
-            db.commit()
-            await callback.message.edit_text(f"❌ Ошибка создания Excel: {str(e)}")
-
-    except Exception as e:
-        print(f"Критическая ошибка: {e}")
-        await callback.message.edit_text(f"❌ Критическая ошибка: {str(e)}")
-    finally:
-        db.close()
-        await state.clear()
-
-
-def _parse_json_safely(raw_response: str) -> dict | None:
-    if not raw_response:
-        return None
-
-    start_idx = raw_response.find('{')
-    end_idx = raw_response.rfind('}')
-
-    if start_idx == -1 or end_idx == -1:
-        print(f"  JSON не найден в ответе")
-        return None
-
-    json_str = raw_response[start_idx:end_idx+1]
-    json_str = json_str.replace('```json', '').replace('```', '').strip()
-
-    try:
-        return json.loads(json_str)
-    except json.JSONDecodeError as e:
-        print(f"!!!! JSON ошибка парсинга: {str(e)[:100]}")
-
-        try:
-            json_str = json_str.replace("'", '"')
-            return json.loads(json_str)
-        except:
-            pass
-
-        try:
-            json_str = re.sub(r'\\n', ' ', json_str)
-            json_str = re.sub(r'\n', ' ', json_str)
-            return json.loads(json_str)
-        except:
-            pass
-
-        return None
-
-
-def _empty_schema(bank_name: str) -> dict:
-    return {
-        "type": None,
-        "currency": None,
-        "validity": None,
-        "maintenance_cost": None,
-        "free_conditions": None,
-        "sms_notification": None,
-        "atm_limit_own": None,
-        "atm_limit_other": None,
-        "loyalty_program": None,
-        "interest_rate": None,
-        "additional": None,
-        "bank": bank_name
-    }
\ No newline at end of file
@@ -1,20 +1,18 @@
-#app/handlers/card.py
+#app/handlers/card_custom.py
 from aiogram import Router, F
 import asyncio
 from aiogram.types import Message, CallbackQuery
 from aiogram.filters import Command
 from aiogram.types import ReplyKeyboardMarkup, KeyboardButton, InlineKeyboardButton, InlineKeyboardMarkup
-from aiogram.types import FSInputFile
-from datetime import datetime
+from aiogram.types import FSInputFile, BufferedInputFile
+from datetime import datetime, timedelta
 from sqlalchemy import and_, or_
 import json
 import urllib3
 urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
 import re
 import os
-from gigachat import GigaChat
 import requests
-from bs4 import BeautifulSoup
 from playwright.async_api import async_playwright
 
 from aiogram.fsm.context import FSMContext
@@ -22,13 +20,28 @@ from aiogram import Bot
 
 from app.keyboards.start_keyboard import (
     get_top_level_actions_keyboard,
+    mark_selected,
+    with_counter,
+    toggle_keyboard_item,
 )
 from app.state import BankState
-from app.excel.py_xlsx import create_bank_excel_report
-from app.handlers.parser import get_page_content, extract_page_text
-from app.db.model import (SessionLocal, User, Log, Data, Bank, Set, Product, Characteristic,
-                           migrate_products, migrate_banks, init_db, get_sets_for_user, recreate_data_table, migrate_base_characteristics, migrate_logs_add_tokens_column)
-from config import GIGACHAT_TOKEN, SYSTEM_USER_ID
+from app.excel.py_xlsx import build_bank_excel_report
+from app.handlers.parser import extract_page_text, get_page_content
+from app.handlers.cpu_pool import run_cpu
+from app.handlers.parsed_page import prepare_page
+from app.handlers.html_compact import build_keywords
+from app.llm.giga_client import chat as giga_chat
+from app.db.extraction_cache import make_extraction_key, get_cached_extraction, save_cached_extraction
+from app.db.repo import (get_or_create_user, get_user_sets, get_set, create_set, rename_set,
+                         get_bank_names, list_set_products, get_products, add_product,
+                         list_set_characteristics, get_characteristics, add_characteristic,
+                         get_current_values, save_product_values, create_log, update_log,
+                         create_job, update_job, mark_job_product_done, mark_job_product_failed, list_user_jobs,
+                         invalidate_reference_cache)
+from app.handlers.job_queue import wake_job_queue
+from app.db.model import (Product, ParseJob, migrate_products, migrate_banks, init_db, recreate_data_table, migrate_base_characteristics, migrate_logs_add_tokens_column,
+                           backup_database)
+from config import SYSTEM_USER_ID, PARSE_VALUE_MAX_AGE
 
 custom = Router()
 
@@ -59,16 +72,7 @@ FIELD_NAMES = {
 
 @custom.message(Command("start"))
 async def start_handler(message: Message, state: FSMContext):
-    db = SessionLocal()
-    try:
-        tg_id = message.from_user.id
-        user = db.query(User).filter(User.tg_id == tg_id).first()
-        if user:
-            sets = get_sets_for_user(db, user.id)
-        else:
-            sets = get_sets_for_user(db, None)
-    finally:
-        db.close()
+    sets = await get_user_sets(message.from_user.id, create_user=False)
 
     await message.answer(
         "👋 Добро пожаловать в бенчмаркинг‑бот!\n\n"
@@ -98,25 +102,14 @@ async def start_multi(message: Message, state: FSMContext):
     # migrate_base_characteristics()
     # recreate_data_table()
     # migrate_logs_add_tokens_column()
+    # Миграции пишут в БД в обход репозитория
+    await invalidate_reference_cache()
     print("✅ Полная миграция завершена!")
 
 
 @custom.message(F.text == "📊 Собрать информацию")
 async def click_button_start(message: Message, state: FSMContext):
-    db = SessionLocal()
-    try:
-        tg_id = message.from_user.id
-        user = db.query(User).filter(User.tg_id == tg_id).first()
-        
-        if not user:
-            user = User(tg_id=tg_id)
-            db.add(user)
-            db.commit()
-            db.refresh(user)
-        
-        sets = get_sets_for_user(db, user.id)
-    finally:
-        db.close()
+    sets = await get_user_sets(message.from_user.id)
     
     await message.answer( 
         "Выберите **набор карт**:",
@@ -127,14 +120,12 @@ async def click_button_start(message: Message, state: FSMContext):
 
 @custom.message(Command('db'))
 async def dump_data_base(message: Message):
-    import shutil
-
     timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
     src_path = "cards.db"
     tmp_path = os.path.join(os.path.dirname(os.path.abspath(src_path)), f"cards_{timestamp}.db")
 
     try:
-        shutil.copy2(src_path, tmp_path)
+        await asyncio.to_thread(backup_database, tmp_path)
         document = FSInputFile(tmp_path, filename=f"cards_{timestamp}.db")
         await message.answer_document(document, caption=f"🗄 База данных {datetime.now().strftime('%d.%m.%Y %H:%M:%S')}")
     except Exception as e:
@@ -145,8 +136,8 @@ async def dump_data_base(message: Message):
         except:
             pass
 
-async def show_products_keyboard(callback: CallbackQuery, state: FSMContext, set_id: int):
-    text, markup = await build_products_keyboard(state, set_id)
+async def show_products_keyboard(callback: CallbackQuery, state: FSMContext, set_id: int, selected_products: set | None = None):
+    text, markup = await build_products_keyboard(state, set_id, selected_products)
     await callback.message.edit_text(
         text,
         parse_mode="Markdown",
@@ -181,13 +172,7 @@ async def handle_new_char_for_set(message: Message, state: FSMContext):
 """
     
     try:
-        giga = GigaChat(
-            credentials=GIGACHAT_TOKEN,
-            scope="GIGACHAT_API_B2B",
-            verify_ssl_certs=False,
-            model="GigaChat-2-Max",
-        )
-        result = giga.chat(prompt)
+        result = await giga_chat(prompt)
         parsed = _parse_json_safely(result.choices[0].message.content)
 
         desc = parsed.get("description", "Описание характеристики") if parsed else "Описание характеристики"
@@ -362,24 +347,8 @@ async def confirm_char_for_set(callback: CallbackQuery, state: FSMContext):
         await callback.answer("❌ Название характеристики не заполнено.", show_alert=True)
         return
 
-    user_tg_id = callback.from_user.id
-    db = SessionLocal()
     try:
-        user = db.query(User).filter(User.tg_id == user_tg_id).first()
-        if not user:
-            user = User(tg_id=user_tg_id)
-            db.add(user)
-            db.commit()
-
-        char = Characteristic(
-            user_id=user.id,
-            set_id=set_id,
-            name=name,
-            description=desc,
-            value_hint=hint,
-        )
-        db.add(char)
-        db.commit()
+        await add_characteristic(callback.from_user.id, set_id, name, desc, hint)
 
         await callback.message.edit_text(
             f"✅ Характеристика *{name}* добавлена в набор!",
@@ -389,12 +358,8 @@ async def confirm_char_for_set(callback: CallbackQuery, state: FSMContext):
         await state.update_data(current_set_id=set_id)
         await state.set_state(BankState.waiting_products)
         
-        db_refresh = SessionLocal()
-        try:
-            set_obj = db_refresh.query(Set).filter_by(id=set_id).first()
-            set_name = set_obj.name if set_obj else "Набор"
-        finally:
-            db_refresh.close()
+        set_obj = await get_set(set_id)
+        set_name = set_obj.name if set_obj else "Набор"
         
         text = (
             f"⚙️ Настройки набора: *{set_name}*\n\n"
@@ -423,8 +388,6 @@ async def confirm_char_for_set(callback: CallbackQuery, state: FSMContext):
     except Exception as e:
         print(f"❌ Ошибка при добавлении характеристики: {e}")
         await callback.answer(f"❌ Ошибка: {str(e)}", show_alert=True)
-    finally:
-        db.close()
     
     await callback.answer()
 
@@ -435,39 +398,35 @@ async def show_confirmation(callback: CallbackQuery, state: FSMContext):
     selected_products = data.get("selected_products", [])
     selected_chars = data.get("selected_characteristics", [])
     
-    db = SessionLocal()
-    try:
-        product_objects = db.query(Product).filter(Product.id.in_(selected_products)).all()
-        product_names = [p.name for p in product_objects]
-        
-        char_objects = db.query(Characteristic).filter(Characteristic.id.in_(selected_chars)).all()
-        char_names = [c.name for c in char_objects]
-        display_char_names = [FIELD_NAMES.get(name, name) for name in char_names]
-        
-        bank_ids = set(p.bank_id for p in product_objects)
-        banks = db.query(Bank).filter(Bank.id.in_(bank_ids)).all()
-        bank_names = [b.name for b in banks]
-        
-        keyboard = [
-            [InlineKeyboardButton(text="✅ Да, начать парсинг", callback_data="start_parsing")],
-            [InlineKeyboardButton(text="⬅️ Назад", callback_data="back_to_characteristics")]
-        ]
-        
-        text = (
-            "📋 **Подтверждение выбора**\n\n"
-            f"**Продукты:** {', '.join(product_names)}\n\n"
-            f"**Характеристики:** {', '.join(display_char_names)}\n\n"
-            f"**Банки:** {', '.join(bank_names)}\n\n"
-            "Начать парсинг?"
-        )
-        
-        await callback.message.edit_text(
-            text,
-            parse_mode="Markdown",
-            reply_markup=InlineKeyboardMarkup(inline_keyboard=keyboard)
-        )
-    finally:
-        db.close()
+    product_objects = await get_products(selected_products)
+    product_names = [p.name for p in product_objects]
+    
+    char_objects = await get_characteristics(selected_chars)
+    char_names = [c.name for c in char_objects]
+    display_char_names = [FIELD_NAMES.get(name, name) for name in char_names]
+    
+    bank_map = await get_bank_names()
+    bank_ids = set(p.bank_id for p in product_objects)
+    bank_names = [bank_map[bank_id] for bank_id in sorted(bank_ids) if bank_id in bank_map]
+    
+    keyboard = [
+        [InlineKeyboardButton(text="✅ Да, начать парсинг", callback_data="start_parsing")],
+        [InlineKeyboardButton(text="⬅️ Назад", callback_data="back_to_characteristics")]
+    ]
+    
+    text = (
+        "📋 **Подтверждение выбора**\n\n"
+        f"**Продукты:** {', '.join(product_names)}\n\n"
+        f"**Характеристики:** {', '.join(display_char_names)}\n\n"
+        f"**Банки:** {', '.join(bank_names)}\n\n"
+        "Начать парсинг?"
+    )
+    
+    await callback.message.edit_text(
+        text,
+        parse_mode="Markdown",
+        reply_markup=InlineKeyboardMarkup(inline_keyboard=keyboard)
+    )
     
     await callback.answer()
 
@@ -487,21 +446,17 @@ async def handle_set_from_main_menu(callback: CallbackQuery, state: FSMContext):
         await callback.answer("Некорректный набор", show_alert=True)
         return
 
-    db = SessionLocal()
-    try:
-        set_obj = db.query(Set).filter_by(id=set_id).first()
-        if not set_obj:
-            await callback.answer("Набор не найден", show_alert=True)
-            return
+    set_obj = await get_set(set_id)
+    if not set_obj:
+        await callback.answer("Набор не найден", show_alert=True)
+        return
 
-        await state.update_data(selected_set_id=set_id,
-                               selected_products=[],
-                               selected_characteristics=[])
+    await state.update_data(selected_set_id=set_id,
+                           selected_products=[],
+                           selected_characteristics=[])
 
-        await state.set_state(BankState.waiting_products)
-        await show_products_keyboard(callback, state, set_id)
-    finally:
-        db.close()
+    await state.set_state(BankState.waiting_products)
+    await show_products_keyboard(callback, state, set_id)
 
     await callback.answer()
 
@@ -520,48 +475,31 @@ async def open_set_products(callback: CallbackQuery, state: FSMContext):
         await callback.answer("Ошибка набора", show_alert=True)
         return
 
-    db = SessionLocal()
-    try:
-        products = db.query(Product).filter_by(set_id=set_id).all()
-        await state.update_data(current_set_id=set_id)
+    products = await list_set_products(set_id)
+    await state.update_data(current_set_id=set_id)
 
-        if not products:
-            await callback.message.edit_text(
-                "В этом наборе пока нет продуктов.",
-                reply_markup=InlineKeyboardMarkup(
-                    inline_keyboard=[
-                        [InlineKeyboardButton(text="➕ добавить продукт", callback_data="add_product_to_this_set")],
-                        [InlineKeyboardButton(text="⬅️ Назад", callback_data=f"set_{set_id}")],
-                    ]
-                )
-            )
-        else:
-            await callback.message.edit_text(
-                "Продукты набора:",
-                reply_markup=get_product_list_keyboard(products)
+    if not products:
+        await callback.message.edit_text(
+            "В этом наборе пока нет продуктов.",
+            reply_markup=InlineKeyboardMarkup(
+                inline_keyboard=[
+                    [InlineKeyboardButton(text="➕ добавить продукт", callback_data="add_product_to_this_set")],
+                    [InlineKeyboardButton(text="⬅️ Назад", callback_data=f"set_{set_id}")],
+                ]
             )
-    finally:
-        db.close()
+        )
+    else:
+        await callback.message.edit_text(
+            "Продукты набора:",
+            reply_markup=get_product_list_keyboard(products)
+        )
     await callback.answer()
 
 
 
 @custom.callback_query(F.data == "back_to_main_menu")
 async def back_to_main_menu(callback: CallbackQuery, state: FSMContext):
-    db = SessionLocal()
-    try:
-        tg_id = callback.from_user.id
-        user = db.query(User).filter(User.tg_id == tg_id).first()
-        
-        if not user:
-            user = User(tg_id=tg_id)
-            db.add(user)
-            db.commit()
-            db.refresh(user)
-        
-        sets = get_sets_for_user(db, user.id)
-    finally:
-        db.close()
+    sets = await get_user_sets(callback.from_user.id)
 
     await state.clear()
     await callback.message.edit_text(
@@ -572,20 +510,7 @@ async def back_to_main_menu(callback: CallbackQuery, state: FSMContext):
 
 @custom.callback_query(F.data == "go_to_sets")
 async def go_to_sets(callback: CallbackQuery, state: FSMContext):
-    db = SessionLocal()
-    try:
-        tg_id = callback.from_user.id
-        user = db.query(User).filter(User.tg_id == tg_id).first()
-        
-        if not user:
-            user = User(tg_id=tg_id)
-            db.add(user)
-            db.commit()
-            db.refresh(user)
-        
-        sets = get_sets_for_user(db, user.id)
-    finally:
-        db.close()
+    sets = await get_user_sets(callback.from_user.id)
 
     await callback.message.edit_text(
         "Выберите набор карт:",
@@ -600,89 +525,58 @@ async def create_set_process(message: Message, state: FSMContext):
         await message.answer("Название не должно быть пустым. Введите название набора:")
         return
 
-    user_id = message.from_user.id
-    db = SessionLocal()
-
-    try:
-        user = db.query(User).filter(User.tg_id == user_id).first()
-        if not user:
-            user = User(tg_id=user_id)
-            db.add(user)
-            db.commit()
-
-        existing = db.query(Set).filter_by(name=name, user_id=user.id).first()
-        if existing:
-            await message.answer(f"Набор с таким именем уже есть: {name}")
-            await state.clear()
-            return
-
-        new_set = Set(
-            name=name,
-            user_id=user.id,
-            description="Пользовательский набор"
-        )
-        db.add(new_set)
-        db.commit()
-        db.refresh(new_set)
-
-        await message.answer(f"✅ Набор '{name}' создан!")
+    new_set = await create_set(message.from_user.id, name)
+    if not new_set:
+        await message.answer(f"Набор с таким именем уже есть: {name}")
+        await state.clear()
+        return
 
-        set_id = new_set.id
-        await state.update_data(current_set_id=set_id)
-        await state.set_state(BankState.waiting_products)
+    await message.answer(f"✅ Набор '{name}' создан!")
 
-        text = (
-            f"⚙️ Настройки набора: *{name}*\n\n"
-            "Добавьте продукты и характеристики для этого набора."
-        )
+    set_id = new_set.id
+    await state.update_data(current_set_id=set_id)
+    await state.set_state(BankState.waiting_products)
 
-        keyboard = InlineKeyboardMarkup(
-            inline_keyboard=[
-                [
-                    InlineKeyboardButton(text="➕ Добавить продукт", callback_data=f"add_product_to_set_{set_id}"),
-                ],
-                [
-                    InlineKeyboardButton(text="➕ Добавить характеристику", callback_data="add_char_to_set"),
-                ],
-                [
-                    InlineKeyboardButton(text="⬅️ Вернуться в меню", callback_data="back_to_main_menu"),
-                ],
-            ]
-        )
+    text = (
+        f"⚙️ Настройки набора: *{name}*\n\n"
+        "Добавьте продукты и характеристики для этого набора."
+    )
 
-        await message.answer(text, parse_mode="Markdown", reply_markup=keyboard)
+    keyboard = InlineKeyboardMarkup(
+        inline_keyboard=[
+            [
+                InlineKeyboardButton(text="➕ Добавить продукт", callback_data=f"add_product_to_set_{set_id}"),
+            ],
+            [
+                InlineKeyboardButton(text="➕ Добавить характеристику", callback_data="add_char_to_set"),
+            ],
+            [
+                InlineKeyboardButton(text="⬅️ Вернуться в меню", callback_data="back_to_main_menu"),
+            ],
+        ]
+    )
 
-    finally:
-        db.close()
+    await message.answer(text, parse_mode="Markdown", reply_markup=keyboard)
 
 
 
-async def build_products_keyboard(state: FSMContext, set_id: int):
+async def build_products_keyboard(state: FSMContext, set_id: int, selected_products: set | None = None):
 
-    data = await state.get_data()
-    selected_products = set(data.get("selected_products", []))
+    # Выбор, уже прочитанный вызывающим, повторно из состояния не берём
+    if selected_products is None:
+        data = await state.get_data()
+        selected_products = set(data.get("selected_products", []))
 
-    db = SessionLocal()
-    try:
-        products = db.query(Product).filter(
-            Product.set_id == set_id
-        ).all()
-        
-        set_obj = db.query(Set).filter_by(id=set_id).first()
-        banks = db.query(Bank).all()
-        bank_map = {b.id: b.name for b in banks}
-    finally:
-        db.close()
+    products = await list_set_products(set_id)
+    set_obj = await get_set(set_id)
+    bank_map = await get_bank_names()
 
     keyboard = []
     for product in products:
-        is_selected = product.id in selected_products
-        emoji = "✅" if is_selected else ""
         bank_name = bank_map.get(product.bank_id, "Unknown")
-        product_text = f"{emoji} {product.name} ({bank_name})"
         keyboard.append([
             InlineKeyboardButton(
-                text=product_text,
+                text=mark_selected(f"{product.name} ({bank_name})", product.id in selected_products),
                 callback_data=f"toggle_product_{product.id}"
             )
         ])
@@ -695,50 +589,31 @@ async def build_products_keyboard(state: FSMContext, set_id: int):
     ])
     keyboard.append([
         InlineKeyboardButton(text="⬅️ Назад", callback_data="back_to_set"),
-        InlineKeyboardButton(text="➡️ Далее", callback_data="show_characteristics")
+        InlineKeyboardButton(
+            text=with_counter("➡️ Далее", len(selected_products), len(products)),
+            callback_data="show_characteristics",
+        )
     ])
 
+    # Счётчик выбора — на кнопке «Далее»: текст сообщения не меняется при нажатии галочек
     set_name = set_obj.name if set_obj else "Набор"
-    text = f"📦 **{set_name}**\n\nВыберите продукты\nВыбрано: {len(selected_products)}/{len(products)}"
+    text = f"📦 **{set_name}**\n\nВыберите продукты"
 
     markup = InlineKeyboardMarkup(inline_keyboard=keyboard)
     return text, markup
 
 
-@custom.callback_query(F.data == "show_characteristics", BankState.waiting_products)
-async def show_characteristics(callback: CallbackQuery, state: FSMContext):
-
-    data = await state.get_data()
-    set_id = data.get("selected_set_id")
-    selected_products = data.get("selected_products", [])
-    
-    if not selected_products:
-        await callback.answer("❌ Выберите хотя бы один продукт!", show_alert=True)
-        return
-    
-    if not set_id:
-        await callback.answer("Набор не выбран", show_alert=True)
-        return
-
-    selected_chars = set(data.get("selected_characteristics", []))
+CHARACTERISTICS_TEXT = "🔧 Выберите характеристики этого набора"
 
-    db = SessionLocal()
-    try:
-        chars = db.query(Characteristic).filter(
-            Characteristic.set_id == set_id
-        ).all()
-    finally:
-        db.close()
 
+def build_characteristics_keyboard(chars: list, selected_chars: set) -> InlineKeyboardMarkup:
     keyboard: list[list[InlineKeyboardButton]] = []
 
     for char in chars:
-        is_selected = char.id in selected_chars
-        emoji = "✅" if is_selected else ""
         display_name = FIELD_NAMES.get(char.name, char.name)
         keyboard.append([
             InlineKeyboardButton(
-                text=f"{emoji} {display_name}",
+                text=mark_selected(display_name, char.id in selected_chars),
                 callback_data=f"toggle_char_{char.id}",
             )
         ])
@@ -755,23 +630,43 @@ async def show_characteristics(callback: CallbackQuery, state: FSMContext):
             callback_data="back_to_products",
         ),
         InlineKeyboardButton(
-            text="➡️ Подтвердить",
+            text=with_counter("➡️ Подтвердить", len(selected_chars), len(chars)),
             callback_data="confirm_selection",
         ),
     ])
 
-    text = (
-        "🔧 Выберите характеристики этого набора\n\n"
-        f"Выбрано: {len(selected_chars)}/{len(chars)}"
-    )
+    return InlineKeyboardMarkup(inline_keyboard=keyboard)
+
+
+async def show_characteristics_keyboard(callback: CallbackQuery, state: FSMContext, set_id: int, selected_chars: set):
+    chars = await list_set_characteristics(set_id)
 
     await state.set_state(BankState.waiting_characteristics)
     await callback.message.edit_text(
-        text,
-        reply_markup=InlineKeyboardMarkup(inline_keyboard=keyboard),
+        CHARACTERISTICS_TEXT,
+        reply_markup=build_characteristics_keyboard(chars, selected_chars),
     )
     await callback.answer()
 
+
+@custom.callback_query(F.data == "show_characteristics", BankState.waiting_products)
+async def show_characteristics(callback: CallbackQuery, state: FSMContext):
+
+    data = await state.get_data()
+    set_id = data.get("selected_set_id")
+    selected_products = data.get("selected_products", [])
+    
+    if not selected_products:
+        await callback.answer("❌ Выберите хотя бы один продукт!", show_alert=True)
+        return
+    
+    if not set_id:
+        await callback.answer("Набор не выбран", show_alert=True)
+        return
+
+    selected_chars = set(data.get("selected_characteristics", []))
+    await show_characteristics_keyboard(callback, state, set_id, selected_chars)
+
 @custom.callback_query(
     F.data.regexp(r"^edit_set_\d+$"),
     BankState.waiting_products
@@ -786,35 +681,31 @@ async def edit_set_menu(callback: CallbackQuery, state: FSMContext):
     set_id = int(parts[-1])
 
     await state.update_data(current_set_id=set_id)
-    db = SessionLocal()
-    try:
-        set_obj = db.query(Set).filter_by(id=set_id).first()
-        if not set_obj:
-            await callback.answer("Набор не найден", show_alert=True)
-            return
+    set_obj = await get_set(set_id)
+    if not set_obj:
+        await callback.answer("Набор не найден", show_alert=True)
+        return
 
-        text = (
-            f"⚙️ Настройки набора: *{set_obj.name}*\n\n"
-            "Вы можете изменить имя и управлять характеристиками этого набора."
-        )
+    text = (
+        f"⚙️ Настройки набора: *{set_obj.name}*\n\n"
+        "Вы можете изменить имя и управлять характеристиками этого набора."
+    )
 
-        keyboard = InlineKeyboardMarkup(
-            inline_keyboard=[
-                [
-                    InlineKeyboardButton(text="✏️ Изменить имя", callback_data="edit_set_name"),
-                ],
-                [
-                    InlineKeyboardButton(text="➕ Добавить характеристику", callback_data="add_char_to_set"),
-                ],
-                [
-                    InlineKeyboardButton(text="⬅️ Назад к продуктам", callback_data="back_to_set_products"),
-                ],
-            ]
-        )
+    keyboard = InlineKeyboardMarkup(
+        inline_keyboard=[
+            [
+                InlineKeyboardButton(text="✏️ Изменить имя", callback_data="edit_set_name"),
+            ],
+            [
+                InlineKeyboardButton(text="➕ Добавить характеристику", callback_data="add_char_to_set"),
+            ],
+            [
+                InlineKeyboardButton(text="⬅️ Назад к продуктам", callback_data="back_to_set_products"),
+            ],
+        ]
+    )
 
-        await callback.message.edit_text(text, parse_mode="Markdown", reply_markup=keyboard)
-    finally:
-        db.close()
+    await callback.message.edit_text(text, parse_mode="Markdown", reply_markup=keyboard)
     await callback.answer()
 
 
@@ -834,20 +725,16 @@ async def edit_set_name_start(callback: CallbackQuery, state: FSMContext):
         await callback.answer("Набор не выбран", show_alert=True)
         return
 
-    db = SessionLocal()
-    try:
-        set_obj = db.query(Set).filter_by(id=set_id).first()
-        if not set_obj:
-            await callback.answer("Набор не найден", show_alert=True)
-            return
+    set_obj = await get_set(set_id)
+    if not set_obj:
+        await callback.answer("Набор не найден", show_alert=True)
+        return
 
-        await state.set_state(BankState.waiting_set_name_edit)
-        await callback.message.edit_text(
-            f"✏️ Текущее имя: *{set_obj.name}*\n\nВведите новое название:",
-            parse_mode="Markdown",
-        )
-    finally:
-        db.close()
+    await state.set_state(BankState.waiting_set_name_edit)
+    await callback.message.edit_text(
+        f"✏️ Текущее имя: *{set_obj.name}*\n\nВведите новое название:",
+        parse_mode="Markdown",
+    )
     await callback.answer()
 
 
@@ -861,39 +748,31 @@ async def process_set_name_edit(message: Message, state: FSMContext):
     data = await state.get_data()
     set_id = data.get("current_set_id")
 
-    db = SessionLocal()
-    try:
-        set_obj = db.query(Set).filter_by(id=set_id).first()
-        if not set_obj:
-            await message.answer("Набор не найден")
-            return
-
-        set_obj.name = new_name
-        db.commit()
+    if not await rename_set(set_id, new_name):
+        await message.answer("Набор не найден")
+        return
 
-        await message.answer(f"✅ Имя набора изменено на: *{new_name}*", parse_mode="Markdown")
+    await message.answer(f"✅ Имя набора изменено на: *{new_name}*", parse_mode="Markdown")
 
-        kb = InlineKeyboardMarkup(
-            inline_keyboard=[
-                [
-                    InlineKeyboardButton(text="✏️ Изменить имя", callback_data="edit_set_name"),
-                ],
-                [
-                    InlineKeyboardButton(text="➕ Добавить характеристику", callback_data="add_char_to_set"),
-                ],
-                [
-                    InlineKeyboardButton(text="⬅️ Назад к продуктам", callback_data="back_to_set_products"),
-                ],
-            ]
-        )
-        await message.answer(
-            f"⚙️ Настройки набора: *{new_name}*",
-            parse_mode="Markdown",
-            reply_markup=kb,
-        )
-        await state.set_state(BankState.waiting_characteristics)
-    finally:
-        db.close()
+    kb = InlineKeyboardMarkup(
+        inline_keyboard=[
+            [
+                InlineKeyboardButton(text="✏️ Изменить имя", callback_data="edit_set_name"),
+            ],
+            [
+                InlineKeyboardButton(text="➕ Добавить характеристику", callback_data="add_char_to_set"),
+            ],
+            [
+                InlineKeyboardButton(text="⬅️ Назад к продуктам", callback_data="back_to_set_products"),
+            ],
+        ]
+    )
+    await message.answer(
+        f"⚙️ Настройки набора: *{new_name}*",
+        parse_mode="Markdown",
+        reply_markup=kb,
+    )
+    await state.set_state(BankState.waiting_characteristics)
 
 
 @custom.callback_query(F.data == "add_char_to_set")
@@ -915,38 +794,44 @@ async def add_char_to_set_start(callback: CallbackQuery, state: FSMContext):
 
 @custom.callback_query(F.data.startswith("toggle_product_"), BankState.waiting_products)
 async def toggle_product(callback: CallbackQuery, state: FSMContext):
+    """
+    ✅ Галочка без запроса к БД: список продуктов уже есть в клавиатуре сообщения,
+    меняются только нажатая кнопка и счётчик на «Далее»
+    """
     product_id = int(callback.data.split("_", 2)[2])
     data = await state.get_data()
     selected_products = set(data.get("selected_products", []))
-    
-    if product_id in selected_products:
-        selected_products.remove(product_id)
-    else:
+
+    selected = product_id not in selected_products
+    if selected:
         selected_products.add(product_id)
-    
-    set_id = data.get("selected_set_id")
+    else:
+        selected_products.discard(product_id)
+
     await state.update_data(selected_products=list(selected_products))
-    await show_products_keyboard(callback, state, set_id)
+
+    markup = toggle_keyboard_item(
+        callback.message.reply_markup,
+        callback.data,
+        selected,
+        len(selected_products),
+        item_prefix="toggle_product_",
+        counter_data="show_characteristics",
+    )
+    if markup is None:
+        # Клавиатура старого формата — строим заново
+        await show_products_keyboard(callback, state, data.get("selected_set_id"), selected_products)
+        return
+
+    await callback.message.edit_reply_markup(reply_markup=markup)
+    await callback.answer()
 
 
 @custom.callback_query(F.data == "back_to_set", BankState.waiting_products)
 async def back_to_set(callback: CallbackQuery, state: FSMContext):
     await state.update_data(selected_products=[])
 
-    db = SessionLocal()
-    try:
-        tg_id = callback.from_user.id
-        user = db.query(User).filter(User.tg_id == tg_id).first()
-        
-        if not user:
-            user = User(tg_id=tg_id)
-            db.add(user)
-            db.commit()
-            db.refresh(user)
-        
-        sets = get_sets_for_user(db, user.id)
-    finally:
-        db.close()
+    sets = await get_user_sets(callback.from_user.id)
 
     await state.clear()
     await callback.message.edit_text(
@@ -1008,13 +893,6 @@ async def handle_product_url(message: Message, state: FSMContext):
             "[████░░░░░░] 40%"
         )
 
-        giga = GigaChat(
-            credentials=GIGACHAT_TOKEN,
-            scope="GIGACHAT_API_B2B",
-            verify_ssl_certs=False,
-            model="GigaChat-2-Max"
-        )
-
         prompt = f"""
 Проанализируй текст страницы и определи:
 
@@ -1031,7 +909,7 @@ async def handle_product_url(message: Message, state: FSMContext):
 {page_text}
 """
 
-        result = giga.chat(prompt)
+        result = await giga_chat(prompt)
         raw = result.choices[0].message.content
 
         await progress_msg.edit_text(
@@ -1101,23 +979,10 @@ async def confirm_product(callback: CallbackQuery, state: FSMContext):
     product_guess = data["temp_product_guess"]
     set_id = data.get("editing_set_id") or data.get("selected_set_id")
 
-    db = SessionLocal()
-    try:
-        bank = db.query(Bank).filter(Bank.name == bank_guess).first()
-        if not bank:
-            await callback.answer("Банк не найден в БД, добавь вручную.", show_alert=True)
-            return
-
-        product = Product(
-            set_id=set_id,
-            bank_id=bank.id,
-            name=product_guess,
-            url=url,
-        )
-        db.add(product)
-        db.commit()
-    finally:
-        db.close()
+    product = await add_product(set_id, bank_guess, product_guess, url)
+    if not product:
+        await callback.answer("Банк не найден в БД, добавь вручную.", show_alert=True)
+        return
 
     await state.set_state(BankState.waiting_products)
     await state.update_data(editing_set_id=None)
@@ -1139,17 +1004,7 @@ async def handle_char_name(message: Message, state: FSMContext):
         return
 
     await state.update_data(temp_char_name=name)
-    user_id = message.from_user.id
-
-    db = SessionLocal()
-    try:
-        user = db.query(User).filter(User.tg_id == user_id).first()
-        if not user:
-            user = User(tg_id=user_id)
-            db.add(user)
-            db.commit()
-    finally:
-        db.close()
+    await get_or_create_user(message.from_user.id)
 
     status_msg = await message.answer("⏳ Генерирую описание...")
 
@@ -1165,14 +1020,7 @@ async def handle_char_name(message: Message, state: FSMContext):
 """
 
     try:
-        giga = GigaChat(
-            credentials=GIGACHAT_TOKEN,
-            scope="GIGACHAT_API_B2B",
-            verify_ssl_certs=False,
-            model="GigaChat-2-Max"
-        )
-
-        result = giga.chat(prompt)
+        result = await giga_chat(prompt)
         raw = result.choices[0].message.content
         parsed = _parse_json_safely(raw)
 
@@ -1331,26 +1179,7 @@ async def confirm_characteristic(callback: CallbackQuery, state: FSMContext):
     desc = data["temp_char_description"]
     hint = data["temp_char_hint"]
     
-    user_id = callback.from_user.id
-    db = SessionLocal()
-    try:
-        user = db.query(User).filter(User.tg_id == user_id).first()
-        if not user:
-            user = User(tg_id=user_id)
-            db.add(user)
-            db.commit()
-        
-        char = Characteristic(
-            user_id=user.id,
-            set_id=None,
-            name=name,
-            description=desc,
-            value_hint=hint
-        )
-        db.add(char)
-        db.commit()
-    finally:
-        db.close()
+    await add_characteristic(callback.from_user.id, None, name, desc, hint)
     
     await callback.message.edit_text(f"✅ Характеристика *{name}* добавлена!", parse_mode="Markdown")
     await state.clear()
@@ -1366,67 +1195,32 @@ async def edit_characteristic_desc(callback: CallbackQuery, state: FSMContext):
 
 @custom.callback_query(F.data.startswith("toggle_char_"), BankState.waiting_characteristics)
 async def toggle_characteristic(callback: CallbackQuery, state: FSMContext):
+    """Как toggle_product: одно обновление состояния и одно редактирование клавиатуры"""
     char_id = int(callback.data.split("_", 2)[2])
     data = await state.get_data()
     selected_chars = set(data.get("selected_characteristics", []))
-    
-    if char_id in selected_chars:
-        selected_chars.remove(char_id)
-    else:
-        selected_chars.add(char_id)
-    
-    await state.update_data(selected_characteristics=list(selected_chars))
-    
-    set_id = data.get("selected_set_id")
-    db = SessionLocal()
-    try:
-        chars = db.query(Characteristic).filter(
-            Characteristic.set_id == set_id
-        ).all()
-    finally:
-        db.close()
 
-    keyboard: list[list[InlineKeyboardButton]] = []
-    updated_data = await state.get_data()
-    updated_selected = set(updated_data.get("selected_characteristics", []))
-    
-    for char in chars:
-        is_selected = char.id in updated_selected
-        emoji = "✅" if is_selected else ""
-        display_name = FIELD_NAMES.get(char.name, char.name)
-        keyboard.append([
-            InlineKeyboardButton(
-                text=f"{emoji} {display_name}",
-                callback_data=f"toggle_char_{char.id}",
-            )
-        ])
+    selected = char_id not in selected_chars
+    if selected:
+        selected_chars.add(char_id)
+    else:
+        selected_chars.discard(char_id)
 
-    keyboard.append([
-        InlineKeyboardButton(
-            text="➕ Добавить характеристику",
-            callback_data="add_char_to_set",
-        )
-    ])
-    keyboard.append([
-        InlineKeyboardButton(
-            text="⬅️ Назад к продуктам",
-            callback_data="back_to_products",
-        ),
-        InlineKeyboardButton(
-            text="➡️ Подтвердить",
-            callback_data="confirm_selection",
-        ),
-    ])
+    await state.update_data(selected_characteristics=list(selected_chars))
 
-    text = (
-        "🔧 Выберите характеристики этого набора\n\n"
-        f"Выбрано: {len(updated_selected)}/{len(chars)}"
+    markup = toggle_keyboard_item(
+        callback.message.reply_markup,
+        callback.data,
+        selected,
+        len(selected_chars),
+        item_prefix="toggle_char_",
+        counter_data="confirm_selection",
     )
+    if markup is None:
+        await show_characteristics_keyboard(callback, state, data.get("selected_set_id"), selected_chars)
+        return
 
-    await callback.message.edit_text(
-        text,
-        reply_markup=InlineKeyboardMarkup(inline_keyboard=keyboard),
-    )
+    await callback.message.edit_reply_markup(reply_markup=markup)
     await callback.answer()
 
 
@@ -1456,56 +1250,7 @@ async def back_to_characteristics(callback: CallbackQuery, state: FSMContext):
     data = await state.get_data()
     set_id = data.get("selected_set_id")
     selected_chars = set(data.get("selected_characteristics", []))
-    
-    db = SessionLocal()
-    try:
-        chars = db.query(Characteristic).filter(
-            Characteristic.set_id == set_id
-        ).all()
-    finally:
-        db.close()
-
-    keyboard: list[list[InlineKeyboardButton]] = []
-
-    for char in chars:
-        is_selected = char.id in selected_chars
-        emoji = "✅" if is_selected else ""
-        display_name = FIELD_NAMES.get(char.name, char.name)
-        keyboard.append([
-            InlineKeyboardButton(
-                text=f"{emoji} {display_name}",
-                callback_data=f"toggle_char_{char.id}",
-            )
-        ])
-
-    keyboard.append([
-        InlineKeyboardButton(
-            text="➕ Добавить характеристику",
-            callback_data="add_char_to_set",
-        )
-    ])
-    keyboard.append([
-        InlineKeyboardButton(
-            text="⬅️ Назад к продуктам",
-            callback_data="back_to_products",
-        ),
-        InlineKeyboardButton(
-            text="➡️ Подтвердить",
-            callback_data="confirm_selection",
-        ),
-    ])
-
-    text = (
-        "🔧 Выберите характеристики этого набора\n\n"
-        f"Выбрано: {len(selected_chars)}/{len(chars)}"
-    )
-
-    await state.set_state(BankState.waiting_characteristics)
-    await callback.message.edit_text(
-        text,
-        reply_markup=InlineKeyboardMarkup(inline_keyboard=keyboard),
-    )
-    await callback.answer()
+    await show_characteristics_keyboard(callback, state, set_id, selected_chars)
 
 
 def _parse_json_safely(raw_response: str) -> dict | None:
@@ -1552,12 +1297,8 @@ async def no_confirm_char_for_set(callback: CallbackQuery, state: FSMContext):
     if set_id:
         await state.set_state(BankState.waiting_products)
         
-        db = SessionLocal()
-        try:
-            set_obj = db.query(Set).filter_by(id=set_id).first()
-            set_name = set_obj.name if set_obj else "Набор"
-        finally:
-            db.close()
+        set_obj = await get_set(set_id)
+        set_name = set_obj.name if set_obj else "Набор"
         
         text = (
             f"⚙️ Настройки набора: *{set_name}*\n\n"
@@ -1596,195 +1337,206 @@ async def start_parsing(callback: CallbackQuery, state: FSMContext):
         await callback.answer("Выберите продукты и характеристики!", show_alert=True)
         return
     
-    await callback.message.edit_text("🔄 **Начинаем парсинг...**\n\nЭто может занять несколько минут.", parse_mode="Markdown")
-    await callback.answer()
-    
-    asyncio.create_task(parse_selected_data_with_response(
-        callback.from_user.id, 
-        selected_products, 
-        selected_chars,
-        callback.message.chat.id,
-        callback.bot
-    ))
-
-async def parse_selected_data_with_response(
-    user_id: int, 
-    product_ids: list[int], 
-    char_ids: list[int],
-    chat_id: int,
-    bot: Bot
-):
-
-    db = SessionLocal()
-    message_id = None
-
-    log = Log(
-        user_id=user_id,
-        action="parse",
-        status="process",
-        tokens_input=0,
-        tokens_output=0,
-        message=""
+    # Парсинг выполняется очередью задач: задача в БД переживает перезапуск бота
+    job = await create_job(callback.from_user.id, callback.message.chat.id, selected_products, selected_chars)
+    wake_job_queue()
+
+    await callback.message.edit_text(
+        f"🔄 **Парсинг поставлен в очередь** (задача #{job.id})\n\n"
+        f"Это может занять несколько минут. Статус: /jobs",
+        parse_mode="Markdown",
     )
-    db.add(log)
-    db.commit()
-    db.refresh(log)
+    await callback.answer()
+
+
+JOB_STATUS_NAMES = {
+    "queued": "⏳ в очереди",
+    "running": "🔄 выполняется",
+    "done": "✅ готово",
+    "failed": "❌ ошибка",
+}
+
+
+@custom.message(Command("jobs"))
+async def show_jobs(message: Message):
+    jobs = await list_user_jobs(message.from_user.id)
+    if not jobs:
+        await message.answer("Задач парсинга пока нет")
+        return
+
+    lines = ["🗂 Ваши задачи парсинга:\n"]
+    for job, ahead in jobs:
+        line = (
+            f"#{job.id} {JOB_STATUS_NAMES.get(job.status, job.status)} — "
+            f"продуктов {len(job.done_product_ids)}/{len(job.product_ids)}, "
+            f"{job.created_at:%d.%m %H:%M}"
+        )
+        if job.failed_product_ids:
+            line += f", с ошибкой {len(job.failed_product_ids)}"
+        if job.status == "queued" and ahead:
+            line += f", перед ней {ahead}"
+        if job.status == "failed" and job.error:
+            line += f"\n    {job.error[:200]}"
+        lines.append(line)
+
+    await message.answer("\n".join(lines))
+
+
+class ParseJobError(Exception):
+    """Ошибка задачи, о которой пользователь уже уведомлён"""
+
+
+async def run_parse_job(job: ParseJob, bot: Bot):
+    """
+    ✅ Выполнение задачи парсинга (вызывается очередью задач)
+    Продукты, готовые до перезапуска, повторно не загружаются.
+    Ошибка пробрасывается дальше — очередь отметит задачу как failed
+    """
+    user_id = job.user_id
+    chat_id = job.chat_id
+    product_ids = job.product_ids
+    char_ids = job.char_ids
+
+    log_id = job.log_id
+    if log_id is None:
+        log_id = await create_log(user_id, "parse")
+        await update_job(job.id, log_id=log_id)
+    tokens_input = job.tokens_input or 0
+    tokens_output = job.tokens_output or 0
+    tasks = []
     
     try:
-        print(f"\nНачинаем парсинг: {len(product_ids)} продуктов × {len(char_ids)} характеристик")
-        
-        products = db.query(Product).filter(Product.id.in_(product_ids)).all()
-        chars = db.query(Characteristic).filter(Characteristic.id.in_(char_ids)).all()
-        banks = db.query(Bank).all()
+        done_ids = set(job.done_product_ids)
+        print(f"\nЗадача #{job.id}: {len(product_ids)} продуктов × {len(char_ids)} характеристик, готово {len(done_ids)}")
         
-        bank_map = {b.id: b for b in banks}
-        
-        giga = GigaChat(
-            credentials=GIGACHAT_TOKEN,
-            scope="GIGACHAT_API_B2B",
-            verify_ssl_certs=False,
-            model="GigaChat-2-Max"
-        )
+        products = await get_products(product_ids)
+        chars = await get_characteristics(char_ids)
+        bank_map = await get_bank_names()
         
         total_products = len(products)
+        pending = [product for product in products if product.id not in done_ids]
         
-        # Отправляем начальное сообщение
-        init_msg = await bot.send_message(
-            chat_id=chat_id,
-            text=f"📊 Парсинг начинается...\n\n"
-                 f"Продуктов: {total_products}\n"
-                 f"Характеристик: {len(chars)}"
-        )
-        message_id = init_msg.message_id
+        # Начальное сообщение; после перезапуска продолжаем обновлять прежнее
+        message_id = job.message_id
+        if message_id is None:
+            init_msg = await bot.send_message(
+                chat_id=chat_id,
+                text=f"📊 Парсинг начинается...\n\n"
+                     f"Продуктов: {total_products}\n"
+                     f"Характеристик: {len(chars)}"
+            )
+            message_id = init_msg.message_id
+            await update_job(job.id, message_id=message_id)
         
-        for idx, product in enumerate(products, 1):
-            progress = int((idx - 1) / total_products * 20)
+        keywords = build_keywords(chars)
+        sizes = {"original": 0, "compact": 0}
+
+        tasks = [
+            asyncio.create_task(_parse_one_product(product, chars, keywords, user_id, sizes))
+            for product in pending
+        ]
+
+        # Продукты обрабатываются параллельно, прогресс обновляется по мере готовности
+        done = total_products - len(pending)
+        failed = 0
+        for task in asyncio.as_completed(tasks):
+            product, ok, tokens_in, tokens_out = await task
+            tokens_input += tokens_in
+            tokens_output += tokens_out
+            done += 1
+            if ok:
+                await mark_job_product_done(job.id, product.id, tokens_in, tokens_out)
+            else:
+                failed += 1
+                await mark_job_product_failed(job.id, product.id, tokens_in, tokens_out)
+            await update_log(log_id, tokens_input=tokens_input, tokens_output=tokens_output)
+
+            progress = int(done / total_products * 20)
             bar = "█" * progress + "░" * (20 - progress)
-            bank_name = bank_map.get(product.bank_id).name if product.bank_id in bank_map else "Unknown"
-            
+            bank_name = bank_map.get(product.bank_id, "Unknown")
+
             try:
                 await bot.edit_message_text(
                     chat_id=chat_id,
                     message_id=message_id,
                     text=f"📊 Парсинг продуктов\n\n"
-                         f"Продукт: {product.name}\n"
+                         f"{'Готов' if ok else 'Ошибка'}: {product.name}\n"
                          f"Банк: {bank_name}\n"
-                         f"Прогресс: [{bar}] {idx}/{total_products}\n\n"
+                         f"Прогресс: [{bar}] {done}/{total_products}\n\n"
                          f"⏱️ Идет сбор данных...\n"
                 )
             except Exception as e:
                 print(f" Ошибка обновления: {e}")
-            
-            print(f"\n Парсим {product.name} ({bank_name})...")
-            
-            try:
-                # Загружаем контент
-                page_content = await get_page_content(product.url)
-                
-                if not page_content or len(page_content) < 500:
-                    print(f"  !!! Не удалось загрузить страницу")
-                    continue
-                
-                print(f" Загружено {len(page_content)} символов")
-                
-                # Очищаем HTML
-                soup = BeautifulSoup(page_content, 'html.parser')
-                for tag in soup(['script', 'style', 'meta', 'link', 'svg', 'iframe', 'noscript']):
-                    tag.decompose()
-                
-                cleaned_html = str(soup)
-                if len(cleaned_html) > 120000:
-                    cleaned_html = cleaned_html[:120000]
-                
-                if len(cleaned_html) < 300:
-                    print(f" -! HTML слишком мал, используем текстовый парсинг")
-                    text_content = soup.get_text(separator=" ", strip=True)[:70000]
-                    tokens_in, tokens_out = await _parse_product_text(giga, product, chars, db, user_id, text_content)
-                    log.tokens_input += tokens_in
-                    log.tokens_output += tokens_out
-                    continue
-                
-
-                tokens_in, tokens_out = await _parse_product_html(giga, product, chars, db, user_id, cleaned_html)
-                log.tokens_input += tokens_in
-                log.tokens_output += tokens_out
-                
-                if tokens_in == 0 and tokens_out == 0:
-                    print(f"  >>> Пробуем текстовый парсинг...")
-                    text_content = soup.get_text(separator=" ", strip=True)[:70000]
-                    tokens_in, tokens_out = await _parse_product_text(giga, product, chars, db, user_id, text_content)
-                    log.tokens_input += tokens_in
-                    log.tokens_output += tokens_out
-                
-            except Exception as e:
-                print(f"  !!! Ошибка парсинга: {e}")
-                continue
-            
 
-            db.commit()
-            await asyncio.sleep(0.5)
-    
-        
-        excel_path = create_bank_excel_report(db, user_id, product_ids, char_ids)
+        # Отчёт собирается в отдельном потоке и отправляется из памяти, без записи на диск
+        report = await asyncio.to_thread(build_bank_excel_report, user_id, product_ids, char_ids)
         
-        if excel_path:
-            print(f"Excel готов: {excel_path}")
-            
+        if not report:
+            await update_log(log_id, status="error", message="Не удалось создать Excel")
             try:
-                document = FSInputFile(excel_path)
-                await bot.send_document(
-                    chat_id=chat_id,
-                    document=document,
-                    caption=f"📊 Готовый отчет парсинга!\n\n"
-                            f"- Обработано {len(products)} продуктов\n"
-                            f"- {len(chars)} характеристик\n"
-                            f"Файл готов к скачиванию!"
-                )
-                print(f"Excel отправлен пользователю")
-                
-                await bot.edit_message_text(
+                await bot.send_message(
                     chat_id=chat_id,
-                    message_id=message_id,
-                    text=f"✅ Парсинг завершен!\n\n"
-                         f"📁 Excel отправлен\n"
+                    text="!!! Ошибка при создании Excel файла"
                 )
-                
-                log.status = "ok"
-                log.message = f"Успешно: {len(products)} продуктов, {len(chars)} характеристик, вход: {log.tokens_input} / выход: {log.tokens_output} токенов"
-                db.commit()
-                
-            except Exception as e:
-                print(f"!!! Ошибка при отправке файла: {e}")
-                log.status = "error"
-                log.message = f"Ошибка: {str(e)}"
-                db.commit()
-                try:
-                    await bot.send_message(
-                        chat_id=chat_id,
-                        text=f"!!! Ошибка: {e}"
-                    )
-                except:
-                    pass
-        else:
-            log.status = "error"
-            log.message = "Не удалось создать Excel"
-            db.commit()
+            except:
+                pass
+            raise ParseJobError("Не удалось создать Excel")
+
+        filename, content = report
+        print(f"Excel готов: {filename}")
+        
+        try:
+            document = BufferedInputFile(content, filename=filename)
+            await bot.send_document(
+                chat_id=chat_id,
+                document=document,
+                caption=f"📊 Готовый отчет парсинга!\n\n"
+                        f"- Обработано {len(products) - failed} продуктов\n"
+                        + (f"- Не удалось разобрать: {failed}\n" if failed else "")
+                        + f"- {len(chars)} характеристик\n"
+                        f"Файл готов к скачиванию!"
+            )
+            print(f"Excel отправлен пользователю")
+            
+            await bot.edit_message_text(
+                chat_id=chat_id,
+                message_id=message_id,
+                text=f"✅ Парсинг завершен!\n\n"
+                     f"📁 Excel отправлен\n"
+            )
+            
+            compression = sizes["original"] / sizes["compact"] if sizes["compact"] else 0
+            await update_log(
+                log_id,
+                status="ok",
+                message=(
+                    f"Успешно: {len(products) - failed} продуктов, с ошибкой: {failed}, {len(chars)} характеристик, "
+                    f"вход: {tokens_input} / выход: {tokens_output} токенов, "
+                    f"HTML сжат в {compression:.1f} раз"
+                ),
+            )
+            
+        except Exception as e:
+            print(f"!!! Ошибка при отправке файла: {e}")
+            await update_log(log_id, status="error", message=f"Ошибка: {str(e)}")
             try:
                 await bot.send_message(
                     chat_id=chat_id,
-                    text="!!! Ошибка при создании Excel файла"
+                    text=f"!!! Ошибка: {e}"
                 )
             except:
                 pass
-        
+            raise ParseJobError(f"Ошибка при отправке файла: {e}") from e
+
+    except ParseJobError:
+        raise
+
     except Exception as e:
         print(f"-! Ошибка: {e}")
         import traceback
         traceback.print_exc()
         
-        log.status = "error"
-        log.message = f"Ошибка: {str(e)}"
-        db.commit()
+        await update_log(log_id, status="error", message=f"Ошибка: {str(e)}")
         
         try:
             await bot.send_message(
@@ -1793,8 +1545,85 @@ async def parse_selected_data_with_response(
             )
         except:
             pass
+        raise
+
     finally:
-        db.close()
+        # При остановке бота незавершённые продукты не должны работать без задачи
+        for task in tasks:
+            task.cancel()
+
+
+async def _parse_one_product(product, chars, keywords: list[str], user_id: int, sizes: dict) -> tuple[Product, bool, int, int]:
+    """
+    Загрузка, очистка и разбор одного продукта.
+    Возвращает (продукт, разобран ли, токены вход, токены выход); токены учитываются и при ошибке
+    """
+    print(f"\n Парсим {product.name}...")
+    tokens_in = 0
+    tokens_out = 0
+
+    try:
+        # Загружаем контент
+        page_content = await get_page_content(product.url)
+
+        if not page_content or len(page_content) < 500:
+            print(f"  !!! Не удалось загрузить страницу {product.url}")
+            return product, False, 0, 0
+
+        print(f" Загружено {len(page_content)} символов")
+
+        # Очищаем и сжимаем HTML по ключевым словам характеристик
+        page = await run_cpu(prepare_page, page_content, keywords)
+        sizes["original"] += page.original_size
+        sizes["compact"] += page.compact_size
+        print(f"  🗜 HTML сжат: {page.original_size} → {page.compact_size} символов (в {page.compression_ratio:.1f} раз)")
+        source_hash = page.source_hash
+
+        # Спрашиваем LLM только о недостающих и устаревших характеристиках
+        current = await get_current_values(user_id, [product.id], [c.id for c in chars])
+        stale_chars = _select_stale_chars(product, chars, current, source_hash)
+        if not stale_chars:
+            print(f"  💾 Все {len(chars)} характеристик актуальны, LLM не нужен")
+            return product, True, 0, 0
+
+        print(f"  Извлекаем {len(stale_chars)} из {len(chars)} характеристик")
+
+        # Хорошо сжатая страница бывает короче пары сотен символов — на текст переходим, только если блоков нет
+        if not page.html:
+            print(f" -! В HTML нет блоков с содержимым, используем текстовый парсинг")
+            tokens_in, tokens_out, saved = await _parse_product_text(product, stale_chars, user_id, page.text, source_hash)
+            return product, saved, tokens_in, tokens_out
+
+        tokens_in, tokens_out, saved = await _parse_product_html(product, stale_chars, user_id, page.html, source_hash)
+
+        if not saved:
+            print(f"  >>> Пробуем текстовый парсинг...")
+            text_in, text_out, saved = await _parse_product_text(product, stale_chars, user_id, page.text, source_hash)
+            tokens_in += text_in
+            tokens_out += text_out
+
+        return product, saved, tokens_in, tokens_out
+
+    except Exception as e:
+        print(f"  !!! Ошибка парсинга {product.name}: {e}")
+        return product, False, tokens_in, tokens_out
+
+
+def _select_stale_chars(product, chars, latest: dict, source_hash: str) -> list:
+    """Характеристики без значения, со старым значением или со сменившейся страницей-источником"""
+    threshold = datetime.utcnow() - timedelta(seconds=PARSE_VALUE_MAX_AGE)
+
+    stale = []
+    for char in chars:
+        record = latest.get((product.id, char.id))
+        if (
+            record is None
+            or record.updated_at is None
+            or record.updated_at < threshold
+            or record.source_hash != source_hash
+        ):
+            stale.append(char)
+    return stale
 
 
 @custom.callback_query(F.data == "edit_product_bank_product", BankState.waiting_product_confirm)
@@ -1876,7 +1705,7 @@ async def add_product_to_current_set(callback: CallbackQuery, state: FSMContext)
     await callback.answer()
 
 
-async def _parse_product_html(giga: GigaChat, product, chars, db, user_id: int, cleaned_html: str) -> tuple[int, int]:
+async def _parse_product_html(product, chars, user_id: int, cleaned_html: str, source_hash: str) -> tuple[int, int, bool]:
 
     char_instructions = []
     for char in chars:
@@ -1901,51 +1730,11 @@ async def _parse_product_html(giga: GigaChat, product, chars, db, user_id: int,
 HTML:
 {cleaned_html}"""
 
-    try:
-        result = giga.chat(prompt)
-        raw_response = result.choices[0].message.content
-        
-        usage = result.usage if hasattr(result, 'usage') else None
-        tokens_input = 0
-        tokens_output = 0
-        if usage:
-            tokens_input = getattr(usage, 'prompt_tokens', 0) or 0
-            tokens_output = getattr(usage, 'completion_tokens', 0) or 0
-        
-        parsed_data = _parse_json_safely(raw_response)
-        if not parsed_data:
-            print(f"  !!! JSON парсинг не удался")
-            return tokens_input, tokens_output
-        
-        has_data = any(v for v in parsed_data.values() if v and v != "null" and v is not None)
-        if not has_data:
-            print(f"  -! Все поля null")
-            return tokens_input, tokens_output
-        
-        # Сохраняем в БД
-        for char in chars:
-            value = parsed_data.get(char.name) or "Не указано"
-            if value == "null":
-                value = "Не указано"
-            
-            data_record = Data(
-                user_id=user_id,
-                product_id=product.id,
-                characteristic_id=char.id,
-                card_set="Автопарсинг",
-                value=str(value)
-            )
-            db.add(data_record)
-        
-        print(f"  ✅ Сохранено {len(chars)} характеристик")
-        return tokens_input, tokens_output
-        
-    except Exception as e:
-        print(f"  !!! Ошибка: {e}")
-        return 0, 0
+    cache_key = make_extraction_key("html", cleaned_html, chars)
+    return await _extract_and_save(product, chars, user_id, prompt, cache_key, source_hash, "")
 
 
-async def _parse_product_text(giga: GigaChat, product, chars, db, user_id: int, text_content: str) -> tuple[int, int]:
+async def _parse_product_text(product, chars, user_id: int, text_content: str, source_hash: str) -> tuple[int, int, bool]:
     
     char_instructions = []
     for char in chars:
@@ -1965,49 +1754,68 @@ async def _parse_product_text(giga: GigaChat, product, chars, db, user_id: int,
 ТЕКСТ:
 {text_content}"""
 
+    cache_key = make_extraction_key("text", text_content, chars)
+    return await _extract_and_save(product, chars, user_id, prompt, cache_key, source_hash, " (текстовый парсинг)")
+
+
+async def _extract_and_save(
+    product, chars, user_id: int, prompt: str, cache_key: str, source_hash: str, source: str
+) -> tuple[int, int, bool]:
+    """
+    Запрос к LLM с кэшем по хэшу контента и набору характеристик.
+    Возвращает (токены вход, токены выход, сохранены ли данные)
+    """
+    parsed_data = await asyncio.to_thread(get_cached_extraction, cache_key)
+    if parsed_data:
+        await _save_product_values(product, chars, user_id, parsed_data, source_hash)
+        print(f"  💾 Сохранено {len(chars)} характеристик из кэша{source}")
+        return 0, 0, True
+
+    tokens_input = 0
+    tokens_output = 0
     try:
-        result = giga.chat(prompt)
+        result = await giga_chat(prompt)
         raw_response = result.choices[0].message.content
         
         usage = result.usage if hasattr(result, 'usage') else None
-        tokens_input = 0
-        tokens_output = 0
         if usage:
             tokens_input = getattr(usage, 'prompt_tokens', 0) or 0
             tokens_output = getattr(usage, 'completion_tokens', 0) or 0
         
-        
         parsed_data = _parse_json_safely(raw_response)
         if not parsed_data:
             print(f"  !!! JSON парсинг не удался")
-            return tokens_input, tokens_output
+            return tokens_input, tokens_output, False
         
         has_data = any(v for v in parsed_data.values() if v and v != "null" and v is not None)
         if not has_data:
             print(f"  -! Все поля null")
-            return tokens_input, tokens_output
+            return tokens_input, tokens_output, False
         
-        # Сохраняем в БД
-        for char in chars:
-            value = parsed_data.get(char.name) or "Не указано"
-            if value == "null":
-                value = "Не указано"
-            
-            data_record = Data(
-                user_id=user_id,
-                product_id=product.id,
-                characteristic_id=char.id,
-                card_set="Автопарсинг",
-                value=str(value)
-            )
-            db.add(data_record)
+        await asyncio.to_thread(save_cached_extraction, cache_key, parsed_data)
+        await _save_product_values(product, chars, user_id, parsed_data, source_hash)
         
-        print(f"  ✅ Сохранено {len(chars)} характеристик (текстовый парсинг)")
-        return prompt_tokens, completion_tokens
+        print(f"  ✅ Сохранено {len(chars)} характеристик{source}")
+        return tokens_input, tokens_output, True
         
     except Exception as e:
         print(f"  !!! Ошибка: {e}")
-        return 0, 0
+        # Ответ LLM мог прийти до ошибки сохранения — потраченные токены не теряем
+        return tokens_input, tokens_output, False
+
+
+async def _save_product_values(product, chars, user_id: int, parsed_data: dict, source_hash: str):
+    # Сохраняем в БД: текущие значения обновляются, изменившиеся уходят в историю
+    values = {}
+    for char in chars:
+        value = parsed_data.get(char.name) or "Не указано"
+        if value == "null":
+            value = "Не указано"
+        values[char.id] = str(value)
+
+    changed = await save_product_values(user_id, product.id, values, source_hash)
+    if changed:
+        print(f"🔁 {product.name}: изменилось значений: {changed}")
 
 
 def _parse_json_safely(raw_response: str) -> dict | None:
@@ -0,0 +1,82 @@
+# app/handlers/cpu_pool.py
+import asyncio
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Callable, Optional
+
+from config import PARSE_CPU_WORKERS, PARSE_CPU_CONCURRENCY
+
+
+def _get_context():
+    """
+    forkserver: процессы пула порождаются от чистого сервера, а не от процесса бота —
+    не наследуют event loop, потоки и сокеты. bs4/lxml сервер импортирует один раз заранее.
+    Где forkserver нет (Windows) — spawn.
+    Оба способа заново импортируют запускаемый файл (main.py), поэтому в нём нет тяжёлых импортов на уровне модуля
+    """
+    if "forkserver" not in multiprocessing.get_all_start_methods():
+        return multiprocessing.get_context("spawn")
+    context = multiprocessing.get_context("forkserver")
+    context.set_forkserver_preload(["app.handlers.parsed_page"])
+    return context
+
+
+class CpuPool:
+    """
+    Пул процессов для разбора HTML
+    BeautifulSoup держит GIL, поэтому потоки не спасают event loop — нужны отдельные процессы.
+    Функции и аргументы должны сериализоваться (pickle): передаём строки, получаем простые данные.
+    """
+
+    def __init__(self, workers: int = PARSE_CPU_WORKERS, concurrency: int = PARSE_CPU_CONCURRENCY):
+        self._workers = max(1, workers)
+        self._pool: Optional[ProcessPoolExecutor] = None
+        # Ограничивает число задач в очереди пула, чтобы не копить HTML в памяти
+        self._semaphore = asyncio.Semaphore(max(1, concurrency))
+
+    def _get_pool(self) -> ProcessPoolExecutor:
+        if self._pool is None:
+            self._pool = ProcessPoolExecutor(
+                max_workers=self._workers,
+                mp_context=_get_context(),
+            )
+            print(f"⚙️ Запущен пул процессов: {self._workers}")
+        return self._pool
+
+    async def run(self, func: Callable, *args):
+        """
+        ✅ Выполняет func(*args) в пуле процессов
+        Event loop только ждёт результат
+        """
+        async with self._semaphore:
+            loop = asyncio.get_running_loop()
+            try:
+                return await loop.run_in_executor(self._get_pool(), func, *args)
+            except BrokenProcessPool:
+                # Воркер упал (например, по памяти) — пересоздаём пул и повторяем один раз
+                print("⚠️ Пул процессов сломан, перезапускаю")
+                self._reset()
+                return await loop.run_in_executor(self._get_pool(), func, *args)
+
+    def _reset(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+
+    async def close(self):
+        if self._pool is not None:
+            pool, self._pool = self._pool, None
+            await asyncio.to_thread(pool.shutdown, True, cancel_futures=True)
+
+
+# Глобальный пул
+cpu_pool = CpuPool()
+
+
+async def run_cpu(func: Callable, *args):
+    return await cpu_pool.run(func, *args)
+
+
+async def close_cpu_pool():
+    await cpu_pool.close()
@@ -0,0 +1,208 @@
+# app/handlers/html_compact.py
+import re
+from html import escape
+
+from bs4 import BeautifulSoup, NavigableString, PageElement, Tag
+
+
+# Грубая оценка: столько символов HTML/текста приходится на один токен LLM
+CHARS_PER_TOKEN = 3
+
+DROP_TAGS = [
+    'script', 'style', 'meta', 'link', 'svg', 'iframe', 'noscript',
+    'nav', 'footer', 'header', 'form', 'button', 'input', 'select', 'textarea',
+    'img', 'picture', 'video', 'audio', 'canvas',
+]
+
+# Инлайн-обёртки снимаются, текст остаётся
+INLINE_TAGS = ['span', 'a', 'b', 'strong', 'i', 'em', 'font', 'small', 'label', 'sup', 'sub', 'u', 'abbr']
+
+# Блоки, которые всегда отправляются целиком
+ATOMIC_BLOCKS = {'table', 'ul', 'ol', 'dl', 'p', 'h1', 'h2', 'h3', 'h4', 'h5', 'h6'}
+
+# Если внутри элемента есть такие теги — это обёртка, спускаемся глубже
+CONTAINER_TAGS = list(ATOMIC_BLOCKS) + ['div', 'section', 'article', 'main', 'aside', 'li']
+
+KEEP_ATTRS = {'colspan', 'rowspan'}
+
+# Слова, которые встречаются в описаниях характеристик, но ничего не говорят о месте на странице
+STOP_WORDS = {
+    'например', 'если', 'или', 'при', 'для', 'это', 'как', 'так', 'что', 'без',
+    'найти', 'значение', 'значения', 'характеристика', 'характеристики', 'формат',
+    'особенности', 'карты', 'карта', 'карте',
+}
+
+# Признаки тарифной информации, полезные для любой характеристики
+BASE_KEYWORDS = ['byn', 'usd', 'eur', '%', 'тариф', 'комисс', 'стоимост', 'бесплатн']
+
+
+def build_keywords(chars) -> list[str]:
+    """Ключевые слова (основы) из name/description/value_hint выбранных характеристик"""
+    keywords = set(BASE_KEYWORDS)
+    for char in chars:
+        source = " ".join(filter(None, [char.name, char.description, char.value_hint]))
+        for word in re.findall(r"[a-zа-яё]+", source.lower().replace("_", " ")):
+            if len(word) < 4 or word in STOP_WORDS:
+                continue
+            # Отрезаем окончание, чтобы «обслуживание» находило «обслуживания»
+            keywords.add(word[:6] if len(word) > 6 else word)
+    return sorted(keywords)
+
+
+def compact_soup(soup: BeautifulSoup, keywords: list[str], token_budget: int) -> str:
+    """
+    ✅ Сжатие HTML перед отправкой в LLM
+    - Удаляет служебные теги, атрибуты и классы
+    - Схлопывает обёртки до листовых блоков
+    - Оценивает блоки по ключевым словам характеристик
+    - Оставляет лучшие блоки в пределах бюджета токенов, в исходном порядке
+    Дерево не изменяется, его можно использовать дальше
+    """
+    blocks: list[tuple[str, str, PageElement]] = []
+    _collect_blocks(soup.body or soup, blocks)
+    if not blocks:
+        return ""
+
+    budget = max(1, token_budget) * CHARS_PER_TOKEN
+    scores = [_score_block(name, text, keywords) for name, text, _ in blocks]
+
+    # Соседи сильного блока получают часть его веса: значение часто лежит рядом с заголовком
+    smoothed = []
+    for idx, score in enumerate(scores):
+        neighbours = (scores[idx - 1] if idx > 0 else 0) + (scores[idx + 1] if idx + 1 < len(scores) else 0)
+        smoothed.append(score + 0.5 * neighbours)
+
+    if not any(smoothed):
+        # Ключевые слова не нашлись — берём начало страницы, как раньше
+        order = range(len(blocks))
+    else:
+        order = sorted(
+            (idx for idx in range(len(blocks)) if smoothed[idx] > 0),
+            key=lambda idx: smoothed[idx],
+            reverse=True,
+        )
+
+    selected = set()
+    used = 0
+    for idx in order:
+        size = len(blocks[idx][1])
+        if used + size > budget:
+            if not selected:
+                # Самый релевантный блок больше бюджета — берём его начало целыми строками и элементами
+                blocks[idx] = (blocks[idx][0], _truncate_block(*blocks[idx], budget), blocks[idx][2])
+                selected.add(idx)
+                used = budget
+            continue
+        selected.add(idx)
+        used += size
+
+    return "\n".join(blocks[idx][1] for idx in sorted(selected))
+
+
+def _collect_blocks(node: Tag, out: list[tuple[str, str, PageElement]]):
+    for child in node.children:
+        if type(child) is NavigableString:
+            text = child.strip()
+            if text:
+                out.append(("text", re.sub(r"\s+", " ", escape(text, quote=False)), child))
+            continue
+
+        if not isinstance(child, Tag) or child.name in DROP_TAGS:
+            continue
+
+        if child.name in ATOMIC_BLOCKS or not child.find(CONTAINER_TAGS):
+            if child.name in ATOMIC_BLOCKS:
+                block = f"<{child.name}>{_render(child)}</{child.name}>"
+            else:
+                # Листовая обёртка без структуры — оставляем только текст
+                block = f"<p>{_render_text(child)}</p>"
+            if re.sub(r"<[^>]+>", "", block).strip():
+                out.append((child.name, re.sub(r"\s+", " ", block), child))
+        else:
+            _collect_blocks(child, out)
+
+
+def _render(node: Tag) -> str:
+    """Сериализация без служебных тегов, атрибутов и инлайн-обёрток"""
+    return "".join(_render_node(child) for child in node.children)
+
+
+def _render_node(node: PageElement) -> str:
+    if type(node) is NavigableString:
+        return escape(str(node), quote=False)
+    if not isinstance(node, Tag) or node.name in DROP_TAGS:
+        return ""
+    inner = _render(node)
+    if node.name in INLINE_TAGS:
+        return inner
+    return f"<{node.name}{_render_attrs(node)}>{inner}</{node.name}>"
+
+
+def _render_attrs(node: Tag) -> str:
+    return "".join(f' {k}="{escape(str(v))}"' for k, v in node.attrs.items() if k in KEEP_ATTRS)
+
+
+def _truncate_block(name: str, block: str, node: PageElement, limit: int) -> str:
+    """Начало блока не длиннее limit символов: режем между словами и элементами, теги остаются закрытыми"""
+    if name == "text":
+        return _cut_words(block, limit)
+    if name not in ATOMIC_BLOCKS:
+        return f"<p>{_cut_words(block[len('<p>'):-len('</p>')], limit - len('<p></p>'))}</p>"
+    return re.sub(r"\s+", " ", _truncate_element(node, limit, ""))
+
+
+def _truncate_element(node: Tag, limit: int, attrs: str) -> str:
+    opening, closing = f"<{node.name}{attrs}>", f"</{node.name}>"
+    parts = []
+    used = len(opening) + len(closing)
+    has_content = False
+    for child in node.children:
+        piece = _render_node(child)
+        if used + len(piece) > limit:
+            # Первый же элемент не помещается (tbody, огромная ячейка) — берём его начало
+            if not has_content:
+                if type(child) is NavigableString:
+                    parts.append(_cut_words(piece, limit - used))
+                elif isinstance(child, Tag) and child.name in INLINE_TAGS:
+                    parts.append(_cut_words(_render_text(child), limit - used))
+                elif isinstance(child, Tag):
+                    parts.append(_truncate_element(child, limit - used, _render_attrs(child)))
+            break
+        parts.append(piece)
+        used += len(piece)
+        has_content = has_content or bool(piece.strip())
+    return opening + "".join(parts) + closing
+
+
+def _cut_words(text: str, limit: int) -> str:
+    if len(text) <= limit:
+        return text
+    cut = text[:max(0, limit)]
+    if " " in cut:
+        cut = cut.rsplit(" ", 1)[0]
+    # Не оставляем обрезанную сущность вроде &am
+    return re.sub(r"&[^;\s]*$", "", cut)
+
+
+def _render_text(node: Tag) -> str:
+    parts = []
+    for child in node.children:
+        if type(child) is NavigableString:
+            parts.append(escape(child.strip(), quote=False))
+        elif isinstance(child, Tag) and child.name not in DROP_TAGS:
+            parts.append(_render_text(child))
+    return " ".join(part for part in parts if part)
+
+
+def _score_block(name: str, block: str, keywords: list[str]) -> float:
+    text = block.lower()
+    hits = sum(text.count(keyword) for keyword in keywords)
+    if not hits:
+        return 0.0
+
+    score = float(hits)
+    if re.search(r"\d", text):
+        score += 1
+    if name in ('table', 'ul', 'ol', 'dl'):
+        score *= 2
+    return score
@@ -0,0 +1,129 @@
+# app/handlers/job_queue.py
+import asyncio
+from datetime import datetime, timedelta
+from typing import Awaitable, Callable, Optional
+
+from app.db.model import ParseJob
+from app.db.repo import list_claimable_jobs, claim_job, requeue_stale_jobs, update_job
+from config import (JOB_MAX_RUNNING, JOB_MAX_PER_USER, JOB_POLL_INTERVAL,
+                    JOB_HEARTBEAT_INTERVAL, JOB_STALE_AFTER)
+
+
+JobRunner = Callable[[ParseJob], Awaitable[None]]
+
+
+class JobQueue:
+    """
+    ✅ Очередь задач парсинга поверх таблицы parse_jobs
+    - Одновременно выполняется не больше max_running задач и max_per_user задач одного пользователя
+      на все воркеры (лимиты проверяются в БД при захвате задачи), остальные ждут в статусе queued —
+      нагрузка не превращается в десятки Chromium сразу
+    - Выполняющаяся задача обновляет heartbeat; задача без heartbeat дольше stale_after
+      (воркер перезапущен или упал) возвращается в очередь и продолжается с оставшихся продуктов
+    - Несколько процессов могут разбирать одну очередь: задачу забирает тот, кто первым сменил статус
+    """
+
+    def __init__(self, max_running: int = JOB_MAX_RUNNING, max_per_user: int = JOB_MAX_PER_USER,
+                 poll_interval: int = JOB_POLL_INTERVAL, heartbeat_interval: int = JOB_HEARTBEAT_INTERVAL,
+                 stale_after: int = JOB_STALE_AFTER):
+        self.max_running = max(1, max_running)
+        self.max_per_user = max(1, max_per_user)
+        self.poll_interval = poll_interval
+        self.heartbeat_interval = heartbeat_interval
+        self.stale_after = stale_after
+
+        self._runner: Optional[JobRunner] = None
+        self._wake = asyncio.Event()
+        self._loop_task: Optional[asyncio.Task] = None
+        # Ссылки на выполняющиеся задачи: без них asyncio может собрать задачу сборщиком мусора
+        self._running: dict[int, asyncio.Task] = {}
+
+    def start(self, runner: JobRunner):
+        if self._loop_task is not None:
+            return
+        self._runner = runner
+        self._loop_task = asyncio.create_task(self._dispatch_loop())
+        print(f"🗂 Очередь задач запущена: до {self.max_running} задач, до {self.max_per_user} на пользователя")
+
+    def wake(self):
+        """Новая задача в очереди — проверить сразу, не дожидаясь poll_interval"""
+        self._wake.set()
+
+    async def _dispatch_loop(self):
+        while True:
+            try:
+                requeued = await requeue_stale_jobs(datetime.utcnow() - timedelta(seconds=self.stale_after))
+                if requeued:
+                    print(f"♻️ Возвращено в очередь прерванных задач: {requeued}")
+                await self._dispatch()
+            except Exception as e:
+                print(f"-! Ошибка очереди задач: {e}")
+
+            self._wake.clear()
+            try:
+                await asyncio.wait_for(self._wake.wait(), timeout=self.poll_interval)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _dispatch(self):
+        # За раунд — по одной задаче на пользователя; повторяем, пока удаётся что-то запустить
+        while True:
+            started = 0
+            for job_id in await list_claimable_jobs(self.max_per_user, self.max_running):
+                claimed = await claim_job(job_id, self.max_running, self.max_per_user)
+                if claimed is None:
+                    continue
+                self._running[claimed.id] = asyncio.create_task(self._run(claimed))
+                started += 1
+            if not started:
+                return
+
+    async def _run(self, job: ParseJob):
+        heartbeat = asyncio.create_task(self._heartbeat(job.id))
+        try:
+            await self._runner(job)
+            await update_job(job.id, status="done", finished_at=datetime.utcnow())
+        except asyncio.CancelledError:
+            # Остановка процесса: задача продолжится после перезапуска
+            await asyncio.shield(update_job(job.id, status="queued"))
+            raise
+        except Exception as e:
+            print(f"-! Задача #{job.id} завершилась ошибкой: {e}")
+            await update_job(job.id, status="failed", error=str(e), finished_at=datetime.utcnow())
+        finally:
+            heartbeat.cancel()
+            self._running.pop(job.id, None)
+            self.wake()
+
+    async def _heartbeat(self, job_id: int):
+        while True:
+            await asyncio.sleep(self.heartbeat_interval)
+            try:
+                await update_job(job_id, heartbeat_at=datetime.utcnow())
+            except Exception as e:
+                print(f"-! Не удалось обновить heartbeat задачи #{job_id}: {e}")
+
+    async def close(self):
+        tasks = list(self._running.values())
+        if self._loop_task is not None:
+            tasks.append(self._loop_task)
+            self._loop_task = None
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+
+# Глобальная очередь
+job_queue = JobQueue()
+
+
+def start_job_queue(runner: JobRunner):
+    job_queue.start(runner)
+
+
+def wake_job_queue():
+    job_queue.wake()
+
+
+async def close_job_queue():
+    await job_queue.close()
@@ -0,0 +1,124 @@
+# app/handlers/parsed_page.py
+import hashlib
+import re
+from dataclasses import dataclass
+from functools import cached_property
+
+from bs4 import BeautifulSoup
+
+from app.handlers.html_compact import compact_soup
+from config import PARSE_PROMPT_TOKEN_BUDGET
+
+try:
+    import lxml  # noqa: F401
+    HTML_PARSER = "lxml"
+except ImportError:
+    HTML_PARSER = "html.parser"
+
+
+# Теги, которые не несут содержимого страницы
+NOISE_TAGS = ['script', 'style', 'meta', 'link', 'svg', 'iframe',
+              'noscript', 'nav', 'footer', 'button', 'form']
+
+
+class ParsedPage:
+    """
+    ✅ Страница, разобранная один раз
+    HTML, текст, таблицы и списки считаются лениво из одного дерева
+    """
+
+    def __init__(self, html: str):
+        self.raw_size = len(html)
+        self.soup = BeautifulSoup(html, HTML_PARSER)
+        for tag in self.soup(NOISE_TAGS):
+            tag.decompose()
+
+    @cached_property
+    def text(self) -> str:
+        text = self.soup.get_text(separator=" ", strip=True)
+        return re.sub(r'\s+', ' ', text)
+
+    @cached_property
+    def source_hash(self) -> str:
+        """Хэш видимого текста: меняется только при изменении содержимого"""
+        return hashlib.sha256(self.text.encode("utf-8")).hexdigest()
+
+    @cached_property
+    def tables(self) -> list[list[list[str]]]:
+        tables = []
+        for table in self.soup.find_all('table'):
+            rows = []
+            for tr in table.find_all('tr'):
+                cells = [td.get_text(strip=True) for td in tr.find_all(['td', 'th'])]
+                if cells:
+                    rows.append(cells)
+            if rows:
+                tables.append(rows)
+        return tables
+
+    @cached_property
+    def lists(self) -> list[list[str]]:
+        lists = []
+        for lst in self.soup.find_all(['ul', 'ol']):
+            items = [li.get_text(strip=True) for li in lst.find_all('li')]
+            if items:
+                lists.append(items)
+        return lists
+
+    def compact(self, keywords: list[str], token_budget: int) -> str:
+        """Сжатый по релевантности HTML для промпта (см. html_compact)"""
+        return compact_soup(self.soup, keywords, token_budget)
+
+
+# Функции ниже выполняются в пуле процессов (app/handlers/cpu_pool.py):
+# на вход — строка HTML, на выход — простые данные без дерева BeautifulSoup
+
+@dataclass
+class PreparedPage:
+    source_hash: str     # хэш видимого текста страницы: меняется только при изменении содержимого
+    html: str            # сжатый HTML для промпта
+    text: str            # текст страницы для запасного текстового парсинга
+    original_size: int
+    compact_size: int
+
+    @property
+    def compression_ratio(self) -> float:
+        return self.original_size / self.compact_size if self.compact_size else 0.0
+
+
+def prepare_page(page_content: str, keywords: list[str], token_budget: int = PARSE_PROMPT_TOKEN_BUDGET) -> PreparedPage:
+    """
+    ✅ Подготовка страницы к отправке в LLM
+    Возвращает сжатый HTML, текст страницы и хэш содержимого
+    """
+    page = ParsedPage(page_content)
+    compacted = page.compact(keywords, token_budget)
+
+    return PreparedPage(
+        source_hash=page.source_hash,
+        html=compacted,
+        text=page.text[:70000],
+        original_size=page.raw_size,
+        compact_size=len(compacted),
+    )
+
+
+def page_text(html: str, limit: int = 8000) -> str:
+    """Видимый текст страницы (8000 символов достаточно для LLM)"""
+    return ParsedPage(html).text[:limit]
+
+
+def page_structured_data(html: str) -> dict:
+    """Первые 3 таблицы (по 10 строк) и первые 5 списков страницы"""
+    page = ParsedPage(html)
+    data = {}
+
+    tables = [rows[:10] for rows in page.tables[:3]]
+    if tables:
+        data['tables'] = tables
+
+    lists = page.lists[:5]
+    if lists:
+        data['lists'] = lists
+
+    return data
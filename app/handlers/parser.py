@@ -1,13 +1,277 @@
 #app/parsers/bank_parser.py
 import asyncio
-import re
-from typing import Optional
-from bs4 import BeautifulSoup
-from playwright.async_api import async_playwright
-import requests
-import urllib3
+import time
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Optional
+from urllib.parse import urlparse
+import aiohttp
+from playwright.async_api import async_playwright, Browser, Page, Playwright, Route
 
-urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
+from app.handlers.cpu_pool import run_cpu
+from app.handlers.parsed_page import page_text, page_structured_data
+from app.db.page_cache import CachedPage, get_cached_page, save_cached_page, mark_page_revalidated
+from app.db.fetch_tiers import get_tier_stat, record_tier_success, tier_order
+from app.single_flight import SingleFlight, normalize_url
+from config import (
+    PLAYWRIGHT_MAX_PAGES, PLAYWRIGHT_RECYCLE_AFTER, PLAYWRIGHT_BLOCK_RESOURCES, PLAYWRIGHT_SETTLE_TIMEOUT,
+    HTTP_MAX_CONNECTIONS, HTTP_MAX_CONNECTIONS_PER_HOST, HTTP_DNS_CACHE_TTL, FETCH_MAX_BYTES,
+    PARSE_FETCH_CONCURRENCY, FETCH_HOST_RATE, FETCH_HOST_BURST, FETCH_HOST_MAX_IN_FLIGHT, FETCH_HOST_BACKOFF,
+)
+
+try:
+    # aiohttp распаковывает brotli только при установленном пакете
+    import brotli  # noqa: F401
+    ACCEPT_ENCODING = "gzip, deflate, br"
+except ImportError:
+    ACCEPT_ENCODING = "gzip, deflate"
+
+
+# Ответы, похожие на страницу; пустой Content-Type тоже пропускаем
+HTML_CONTENT_TYPES = {"", "text/html", "application/xhtml+xml", "text/plain", "text/xml", "application/xml"}
+
+READ_CHUNK_SIZE = 64 * 1024
+
+
+def is_html_content_type(content_type: Optional[str]) -> bool:
+    return (content_type or "").split(";")[0].strip().lower() in HTML_CONTENT_TYPES
+
+
+class RejectedContent(Exception):
+    """Сервер ответил, но не страницей (PDF, картинка, архив): другие способы загрузки не помогут"""
+
+
+# Ресурсы, которые не нужны для текста страницы
+BLOCKED_RESOURCE_TYPES = {"image", "media", "font"}
+
+# Счётчики, аналитика и чаты: только замедляют рендер
+TRACKER_DOMAINS = (
+    "google-analytics.com", "googletagmanager.com", "doubleclick.net", "googlesyndication.com",
+    "mc.yandex.ru", "mc.yandex.by", "metrika.yandex", "top-fwz1.mail.ru", "counter.yadro.ru",
+    "facebook.net", "connect.facebook.com", "vk.com/rtrg", "hotjar.com", "clarity.ms",
+    "jivosite.com", "jivo.ru", "livetex.ru", "bitrix24.by/b", "criteo.com", "adriver.ru",
+)
+
+# Прокрутка до конца, пока DOM растёт: пауза между замерами и сколько замеров подряд без роста
+SETTLE_SCRIPT = """
+async ({interval, stableRounds, maxWait}) => {
+    const root = () => document.body || document.documentElement;
+    const size = () => document.getElementsByTagName('*').length + ':' + root().scrollHeight;
+    const started = Date.now();
+    let last = size();
+    let stable = 0;
+    while (stable < stableRounds && Date.now() - started < maxWait) {
+        window.scrollTo(0, root().scrollHeight);
+        await new Promise((resolve) => setTimeout(resolve, interval));
+        const current = size();
+        stable = current === last ? stable + 1 : 0;
+        last = current;
+    }
+    return Date.now() - started;
+}
+"""
+SETTLE_INTERVAL_MS = 300
+SETTLE_STABLE_ROUNDS = 2
+
+# Основной блок страницы без меню и подвала, если в нём не меньше minShare всего текста
+MAIN_CONTENT_SCRIPT = """
+({minShare}) => {
+    const body = document.body;
+    if (!body) return null;
+    const total = (body.innerText || '').length;
+    const candidates = document.querySelectorAll('main, [role="main"], article, #content, .content, .main');
+    for (const el of candidates) {
+        const share = total ? (el.innerText || '').length / total : 0;
+        if (share >= minShare) {
+            const clone = el.cloneNode(true);
+            clone.querySelectorAll('script, style, noscript, svg, iframe, template').forEach((node) => node.remove());
+            return '<html><head><title>' + document.title + '</title></head><body>' + clone.outerHTML + '</body></html>';
+        }
+    }
+    return null;
+}
+"""
+MAIN_CONTENT_MIN_SHARE = 0.5
+
+
+class BrowserPool:
+    """
+    ✅ Долгоживущий Chromium для загрузок через Playwright
+    - Запускается лениво при первой загрузке
+    - Каждая загрузка получает свой контекст (cookies не пересекаются)
+    - Браузер перезапускается после recycle_after страниц, чтобы не копить утечки
+    """
+
+    def __init__(self, max_pages: int = PLAYWRIGHT_MAX_PAGES, recycle_after: int = PLAYWRIGHT_RECYCLE_AFTER):
+        self.recycle_after = max(1, recycle_after)
+        self._semaphore = asyncio.Semaphore(max(1, max_pages))
+        self._lock = asyncio.Lock()
+        self._playwright: Optional[Playwright] = None
+        self._browser: Optional[Browser] = None
+        self._pages_served = 0
+        self._active: dict[Browser, int] = {}
+
+    async def _acquire_browser(self) -> Browser:
+        async with self._lock:
+            # Отправляем старый браузер на покой: закроется, когда отдаст последнюю страницу
+            if self._browser is not None and self._pages_served >= self.recycle_after:
+                print(f"♻️ Перезапуск Chromium после {self._pages_served} страниц")
+                retired = self._browser
+                self._browser = None
+                if not self._active.get(retired):
+                    await self._close_browser(retired)
+
+            if self._browser is not None and not self._browser.is_connected():
+                self._active.pop(self._browser, None)
+                self._browser = None
+
+            if self._playwright is None:
+                self._playwright = await async_playwright().start()
+
+            if self._browser is None:
+                self._browser = await self._playwright.chromium.launch(
+                    headless=True,
+                    args=[
+                        '--disable-blink-features=AutomationControlled',
+                        '--disable-dev-shm-usage',
+                        '--no-sandbox',
+                        '--disable-setuid-sandbox',
+                    ]
+                )
+                self._pages_served = 0
+
+            self._pages_served += 1
+            self._active[self._browser] = self._active.get(self._browser, 0) + 1
+            return self._browser
+
+    async def _release_browser(self, browser: Browser):
+        async with self._lock:
+            if browser not in self._active:
+                return
+            self._active[browser] -= 1
+            if browser is not self._browser and self._active[browser] <= 0:
+                await self._close_browser(browser)
+
+    async def _close_browser(self, browser: Browser):
+        self._active.pop(browser, None)
+        try:
+            await browser.close()
+        except Exception as e:
+            print(f"  ⚠️ Ошибка закрытия Chromium: {type(e).__name__}")
+
+    @asynccontextmanager
+    async def page(self, **context_options) -> AsyncIterator[Page]:
+        """Выдаёт новую страницу в отдельном контексте, не больше max_pages одновременно"""
+        async with self._semaphore:
+            browser = await self._acquire_browser()
+            try:
+                context = await browser.new_context(**context_options)
+                try:
+                    yield await context.new_page()
+                finally:
+                    await context.close()
+            finally:
+                await self._release_browser(browser)
+
+    async def close(self):
+        async with self._lock:
+            for browser in list(self._active):
+                await self._close_browser(browser)
+            self._browser = None
+            if self._playwright is not None:
+                await self._playwright.stop()
+                self._playwright = None
+
+
+class TokenBucket:
+    """Токены пополняются со скоростью rate в секунду, копится не больше burst"""
+
+    def __init__(self, rate: float, burst: int):
+        self.rate = rate
+        self.burst = max(1, burst)
+        self.tokens = float(self.burst)
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+        # Lock в asyncio честный (FIFO): ожидающие получают токены в порядке очереди
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        if self.rate <= 0 and self.paused_until <= time.monotonic():
+            return
+
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if self.rate > 0:
+                    self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+
+                wait = self.paused_until - now
+                if wait <= 0:
+                    if self.rate <= 0:
+                        return
+                    if self.tokens >= 1:
+                        self.tokens -= 1
+                        return
+                    wait = (1 - self.tokens) / self.rate
+                await asyncio.sleep(wait)
+
+    def pause(self, seconds: float):
+        """Хост попросил подождать (429/503): новых запросов до истечения паузы не будет"""
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+        self.tokens = 0.0
+
+
+class FetchScheduler:
+    """
+    ✅ Планировщик загрузок по хостам
+    - Не больше host_in_flight страниц одного хоста одновременно и host_rate запросов в секунду
+    - Задача сначала ждёт очереди своего хоста и только потом занимает общий слот:
+      пока один банк ограничен, общие слоты достаются страницам других банков
+    - После 429/503 хост ставится на паузу (Retry-After или FETCH_HOST_BACKOFF)
+    """
+
+    def __init__(self, concurrency: int = PARSE_FETCH_CONCURRENCY, host_rate: float = FETCH_HOST_RATE,
+                 host_burst: int = FETCH_HOST_BURST, host_in_flight: int = FETCH_HOST_MAX_IN_FLIGHT):
+        self.host_rate = host_rate
+        self.host_burst = host_burst
+        self.host_in_flight = max(1, host_in_flight)
+        self._global = asyncio.Semaphore(max(1, concurrency))
+        self._hosts: dict[str, tuple[asyncio.Semaphore, TokenBucket]] = {}
+
+    @staticmethod
+    def host_of(url: str) -> str:
+        host = (urlparse(url).hostname or "").lower()
+        return host.removeprefix("www.")
+
+    def _host(self, url: str) -> tuple[asyncio.Semaphore, TokenBucket]:
+        host = self.host_of(url)
+        if host not in self._hosts:
+            self._hosts[host] = (
+                asyncio.Semaphore(self.host_in_flight),
+                TokenBucket(self.host_rate, self.host_burst),
+            )
+        return self._hosts[host]
+
+    @asynccontextmanager
+    async def slot(self, url: str) -> AsyncIterator[None]:
+        """Загрузка страницы: место в очереди хоста, затем общий слот"""
+        host_limit, _ = self._host(url)
+        async with host_limit:
+            async with self._global:
+                yield
+
+    async def throttle(self, url: str):
+        """Перед каждым сетевым запросом к хосту"""
+        await self._host(url)[1].acquire()
+
+    def back_off(self, url: str, retry_after: Optional[str] = None):
+        try:
+            seconds = float(retry_after) if retry_after else FETCH_HOST_BACKOFF
+        except ValueError:
+            # Retry-After в виде даты — берём паузу по умолчанию
+            seconds = FETCH_HOST_BACKOFF
+        print(f"  🐢 {self.host_of(url)} просит подождать: пауза {seconds:.0f} с")
+        self._host(url)[1].pause(seconds)
 
 
 class BankPageParser:
@@ -18,132 +282,286 @@ class BankPageParser:
             "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36",
             "Accept": "text/html,application/xhtml+xml,application/xml;q=0.9,image/webp,*/*;q=0.8",
             "Accept-Language": "ru-RU,ru;q=0.9",
-            "Accept-Encoding": "gzip, deflate",
+            "Accept-Encoding": ACCEPT_ENCODING,
             "DNT": "1",
             "Connection": "keep-alive",
             "Upgrade-Insecure-Requests": "1"
         }
-        self.cache = {}
+        self.browser_pool = BrowserPool()
+        self.scheduler = FetchScheduler()
+        # Одинаковые URL, запрошенные одновременно, загружаются один раз
+        self._in_flight = SingleFlight()
+        # Способ загрузки: (загрузчик, название попытки, как сообщить об успехе)
+        self._tiers = {
+            "http": (self._load_with_requests, "HTTP", "по HTTP"),
+            "playwright": (self._load_with_playwright, "Playwright", "через Playwright"),
+            "special": (self._load_with_special_handling, "Специальная обработка", "со специальной обработкой"),
+        }
+        self._session: Optional[aiohttp.ClientSession] = None
+        # ETag / Last-Modified последнего ответа по URL, сохраняются в кэш вместе со страницей
+        self._validators: dict[str, tuple[Optional[str], Optional[str]]] = {}
+
+    def _get_session(self) -> aiohttp.ClientSession:
+        """Общая HTTP-сессия: keep-alive соединения по хостам и кэш DNS"""
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(
+                limit=HTTP_MAX_CONNECTIONS,
+                limit_per_host=HTTP_MAX_CONNECTIONS_PER_HOST,
+                ttl_dns_cache=HTTP_DNS_CACHE_TTL,
+                ssl=False,
+            )
+            self._session = aiohttp.ClientSession(
+                connector=connector,
+                headers=self.headers,
+                auto_decompress=True,
+            )
+        return self._session
+
+    async def _http_get(
+        self,
+        url: str,
+        headers: Optional[dict] = None,
+        timeout: int = 10,
+        encoding: Optional[str] = None,
+    ) -> Optional[str]:
+        """GET через общую сессию. Возвращает тело при статусе 200"""
+        await self.scheduler.throttle(url)
+        session = self._get_session()
+        async with session.get(
+            url,
+            headers=headers,
+            timeout=aiohttp.ClientTimeout(total=timeout),
+            allow_redirects=True,
+        ) as response:
+            if response.status in (429, 503):
+                self.scheduler.back_off(url, response.headers.get("Retry-After"))
+            if response.status == 200:
+                content = await self._read_body(response, url, encoding)
+                if content is not None:
+                    self._validators[url] = (response.headers.get("ETag"), response.headers.get("Last-Modified"))
+                return content
+        return None
+
+    async def _read_body(
+        self,
+        response: aiohttp.ClientResponse,
+        url: str,
+        encoding: Optional[str] = None,
+        max_bytes: int = FETCH_MAX_BYTES,
+    ) -> str:
+        """
+        ✅ Потоковое чтение тела ответа
+        - Не HTML (PDF, картинки, архивы) отбрасывается по Content-Type и по первому блоку — RejectedContent
+        - Читается не больше max_bytes: дальше соединение закрывается, HTML обрезается
+        """
+        content_type = response.headers.get("Content-Type")
+        if not is_html_content_type(content_type):
+            raise RejectedContent(f"не HTML ({content_type})")
+
+        chunks = []
+        received = 0
+        truncated = False
+        async for chunk in response.content.iter_chunked(READ_CHUNK_SIZE):
+            if not chunks and b"\x00" in chunk[:1024]:
+                response.close()
+                raise RejectedContent("двоичные данные вместо HTML")
+            chunks.append(chunk)
+            received += len(chunk)
+            if received >= max_bytes:
+                truncated = True
+                break
+
+        if truncated:
+            # Остаток не нужен: соединение не вернётся в пул с недочитанным телом
+            response.close()
+            print(f"  ✂️ Ответ больше {max_bytes // 1024} КБ, прочитано начало: {url}")
+
+        body = b"".join(chunks)[:max_bytes]
+        return body.decode(encoding or response.charset or "utf-8", errors="replace")
+
+    async def _revalidate(self, cached: CachedPage) -> Optional[str]:
+        """Условный запрос для устаревшей записи кэша: 304 — страница не изменилась"""
+        validators = cached.validators
+        if not validators:
+            return None
+
+        try:
+            await self.scheduler.throttle(cached.url)
+            session = self._get_session()
+            async with session.get(
+                cached.url,
+                headers=validators,
+                timeout=aiohttp.ClientTimeout(total=10),
+                allow_redirects=True,
+            ) as response:
+                if response.status in (429, 503):
+                    self.scheduler.back_off(cached.url, response.headers.get("Retry-After"))
+
+                if response.status == 304:
+                    print(f"💾 Страница не изменилась (304): {cached.url}")
+                    await asyncio.to_thread(mark_page_revalidated, cached.url)
+                    return cached.body
+
+                # Страницу, полученную по HTTP, можно сразу взять из этого ответа
+                if response.status == 200 and cached.tier == "http":
+                    content = await self._read_body(response, cached.url, 'utf-8')
+                    if content and len(content) > 1000:
+                        self._validators[cached.url] = (response.headers.get("ETag"), response.headers.get("Last-Modified"))
+                        await self._remember(cached.url, content, "http")
+                        return content
+        except RejectedContent:
+            raise
+        except Exception as e:
+            print(f"  ⚠️ Ошибка перепроверки кэша: {type(e).__name__}")
+
+        return None
+
+    async def _remember(self, url: str, content: str, tier: str):
+        """Сохраняет страницу в кэш на диске"""
+        etag, last_modified = self._validators.pop(url, (None, None))
+        await asyncio.to_thread(save_cached_page, url, content, tier, etag, last_modified)
+
+    async def close(self):
+        """Освобождает долгоживущие ресурсы парсера"""
+        await self.browser_pool.close()
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
     
     async def get_page_content(self, url: str, max_retries: int = 3) -> Optional[str]:
         """
         ✅ Получает контент страницы с множественными попытками
         
         Стратегия:
-        1. Попытка через requests (быстро)
+        1. Попытка по HTTP через общую сессию (быстро)
         2. Попытка через Playwright (для JS)
         3. Специальная обработка для разных банков
+        Если домену в прошлый раз понадобился способ 2 или 3, начинаем с него
+        (см. app/db/fetch_tiers.py)
         """
-        
-        # Проверяем кэш
-        if url in self.cache:
+        content, shared = await self._in_flight.do(normalize_url(url), self._get_page_content, url)
+        if shared:
+            print(f"🔗 Страница уже загружалась другим запросом: {url}")
+        return content
+
+    async def _get_page_content(self, url: str) -> Optional[str]:
+        # Проверяем кэш на диске
+        cached = await asyncio.to_thread(get_cached_page, url)
+        if cached and cached.is_fresh:
             print(f"💾 Используем кэш для {url}")
-            return self.cache[url]
-        
-        # 1️⃣ Попытка 1: Быстрая загрузка через requests
-        print(f"🔄 Попытка 1: requests для {url}")
-        content = await self._load_with_requests(url)
-        if content and len(content) > 1000:
-            print(f"✅ Загружено через requests")
-            self.cache[url] = content
-            return content
-        
-        # 2️⃣ Попытка 2: Playwright для JS
-        print(f"🔄 Попытка 2: Playwright для {url}")
-        content = await self._load_with_playwright(url)
-        if content and len(content) > 1000:
-            print(f"✅ Загружено через Playwright")
-            self.cache[url] = content
-            return content
+            return cached.body
+
+        # Сеть — через планировщик: лимиты хоста и общий лимит загрузок
+        async with self.scheduler.slot(url):
+            try:
+                return await self._fetch(url, cached)
+            except RejectedContent as e:
+                # Не пробуем следующие способы: Playwright и повторный запрос вернут тот же файл
+                self._validators.pop(url, None)
+                print(f"⛔ Пропускаем {url}: {e}")
+                return None
+
+    async def _fetch(self, url: str, cached: Optional[CachedPage]) -> Optional[str]:
+        """Загрузка по стратегии выше; вызывается внутри слота планировщика"""
+        if cached:
+            content = await self._revalidate(cached)
+            if content:
+                return content
         
-        # 3️⃣ Попытка 3: Специальная обработка по доменам
-        print(f"🔄 Попытка 3: Специальная обработка для {url}")
-        content = await self._load_with_special_handling(url)
-        if content and len(content) > 1000:
-            print(f"✅ Загружено со специальной обработкой")
-            self.cache[url] = content
-            return content
+        # Начинаем со способа, который сработал для домена в прошлый раз
+        host = self.scheduler.host_of(url)
+        order = tier_order(await asyncio.to_thread(get_tier_stat, host))
+        if order[0] != "http":
+            print(f"🧭 {host}: начинаем с {order[0]} (сработал в прошлый раз)")
+
+        for attempt, tier in enumerate(order, 1):
+            loader, label, done_label = self._tiers[tier]
+            print(f"🔄 Попытка {attempt}: {label} для {url}")
+            started = time.monotonic()
+            content = await loader(url)
+            if content and len(content) > 1000:
+                print(f"✅ Загружено {done_label}")
+                await self._remember(url, content, tier)
+                latency_ms = int((time.monotonic() - started) * 1000)
+                await asyncio.to_thread(
+                    record_tier_success, host, tier, latency_ms, len(content), order[0] == "http"
+                )
+                return content
         
+        self._validators.pop(url, None)
         print(f"❌ Не удалось загрузить {url}")
         return None
     
     async def _load_with_requests(self, url: str) -> Optional[str]:
-        """Загрузка через requests"""
+        """Загрузка через общую aiohttp-сессию"""
         try:
-            response = requests.get(
-                url,
-                headers=self.headers,
-                timeout=10,
-                verify=False,
-                allow_redirects=True
-            )
-            
-            if response.status_code == 200:
-                response.encoding = 'utf-8'
-                return response.text
+            return await self._http_get(url, timeout=10, encoding='utf-8')
+        except RejectedContent:
+            raise
         except Exception as e:
-            print(f"  ⚠️ requests ошибка: {type(e).__name__}")
+            print(f"  ⚠️ HTTP ошибка: {type(e).__name__}")
         
         return None
     
     async def _load_with_playwright(self, url: str, timeout: int = 30000) -> Optional[str]:
-        """Загрузка через Playwright (для JS контента)"""
+        """
+        Загрузка через Playwright (для JS контента)
+        - Картинки, видео, шрифты и счётчики не загружаются
+        - Вместо ожидания networkidle и пошаговой прокрутки — прокрутка до конца,
+          пока DOM растёт, но не дольше PLAYWRIGHT_SETTLE_TIMEOUT
+        - Возвращается основной блок страницы, если он найден
+        """
         try:
-            async with async_playwright() as p:
-                browser = await p.chromium.launch(
-                    headless=True,
-                    args=[
-                        '--disable-blink-features=AutomationControlled',
-                        '--disable-dev-shm-usage',
-                        '--no-sandbox',
-                        '--disable-setuid-sandbox',
-                    ]
-                )
+            async with self.browser_pool.page(
+                viewport={'width': 1920, 'height': 1080},
+                user_agent=self.headers['User-Agent']
+            ) as page:
+                blocked = [0]
+                if PLAYWRIGHT_BLOCK_RESOURCES:
+                    await page.route("**/*", lambda route: self._filter_request(route, blocked))
+
+                # Ждём только DOM: счётчики и виджеты могут держать сеть бесконечно
+                await self.scheduler.throttle(url)
+                response = await page.goto(url, wait_until='domcontentloaded', timeout=timeout)
+                if response and response.status in (429, 503):
+                    self.scheduler.back_off(url, response.headers.get("retry-after"))
+                if response and not is_html_content_type(response.headers.get("content-type")):
+                    raise RejectedContent(f"не HTML ({response.headers.get('content-type')})")
+                if response:
+                    self._validators[url] = (response.headers.get("etag"), response.headers.get("last-modified"))
                 
-                context = await browser.new_context(
-                    viewport={'width': 1920, 'height': 1080},
-                    user_agent=self.headers['User-Agent']
-                )
+                # Догружаем ленивый контент, пока страница растёт
+                settle_ms = await page.evaluate(SETTLE_SCRIPT, {
+                    "interval": SETTLE_INTERVAL_MS,
+                    "stableRounds": SETTLE_STABLE_ROUNDS,
+                    "maxWait": PLAYWRIGHT_SETTLE_TIMEOUT,
+                })
+                print(f"  🧩 Рендер: догрузка {settle_ms} мс, заблокировано запросов: {blocked[0]}")
                 
-                page = await context.new_page()
+                # Получаем контент: основной блок или всю страницу
+                main_content = await page.evaluate(MAIN_CONTENT_SCRIPT, {"minShare": MAIN_CONTENT_MIN_SHARE})
+                if main_content and len(main_content) > 1000:
+                    return main_content
+                return await page.content()
+                
+        except RejectedContent:
+                
+            raise
                 
-                try:
-                    # Ждём загрузки сети
-                    await page.goto(url, wait_until='networkidle', timeout=timeout)
-                    
-                    # Прокручиваем для загрузки ленивого контента
-                    await page.evaluate("""
-                        async () => {
-                            await new Promise((resolve) => {
-                                let totalHeight = 0;
-                                const distance = 100;
-                                const timer = setInterval(() => {
-                                    const scrollHeight = document.body.scrollHeight;
-                                    window.scrollBy(0, distance);
-                                    totalHeight += distance;
-                                    
-                                    if(totalHeight >= scrollHeight){
-                                        clearInterval(timer);
-                                        resolve();
-                                    }
-                                }, 100);
-                            });
-                        }
-                    """)
-                    
-                    # Получаем контент
-                    content = await page.content()
-                    await browser.close()
-                    return content
-                    
-                except Exception as e:
-                    print(f"  ⚠️ Playwright ошибка: {type(e).__name__}")
-                    await browser.close()
-                    return None
-                    
         except Exception as e:
-            print(f"  ⚠️ Критическая ошибка Playwright: {type(e).__name__}")
+            print(f"  ⚠️ Playwright ошибка: {type(e).__name__}")
             return None
+
+    @staticmethod
+    async def _filter_request(route: Route, blocked: list[int]):
+        request = route.request
+        if request.resource_type in BLOCKED_RESOURCE_TYPES or any(
+            domain in request.url for domain in TRACKER_DOMAINS
+        ):
+            blocked[0] += 1
+            await route.abort()
+        else:
+            await route.continue_()
     
     async def _load_with_special_handling(self, url: str) -> Optional[str]:
         """Специальная обработка для разных банков"""
@@ -157,20 +575,10 @@ class BankPageParser:
                 return await self._load_mtbank(url)
             else:
                 # Стандартная загрузка с другими параметрами
-                headers = self.headers.copy()
-                headers['Referer'] = url.rsplit('/', 1)[0] + '/'
-                
-                response = requests.get(
-                    url,
-                    headers=headers,
-                    timeout=15,
-                    verify=False,
-                    allow_redirects=True
-                )
-                
-                if response.status_code == 200:
-                    response.encoding = 'utf-8'
-                    return response.text
+                headers = {'Referer': url.rsplit('/', 1)[0] + '/'}
+                return await self._http_get(url, headers=headers, timeout=15, encoding='utf-8')
+        except RejectedContent:
+            raise
         except Exception as e:
             print(f"  ⚠️ Специальная обработка ошибка: {type(e).__name__}")
         
@@ -179,12 +587,10 @@ class BankPageParser:
     async def _load_sberbank(self, url: str) -> Optional[str]:
         """Специальная обработка для Сбера"""
         try:
-            headers = self.headers.copy()
-            headers['Referer'] = 'https://www.sber-bank.by/'
-            
-            response = requests.get(url, headers=headers, timeout=12, verify=False)
-            if response.status_code == 200:
-                return response.text
+            headers = {'Referer': 'https://www.sber-bank.by/'}
+            return await self._http_get(url, headers=headers, timeout=12)
+        except RejectedContent:
+            raise
         except Exception as e:
             print(f"  ⚠️ Sberbank ошибка: {type(e).__name__}")
         return None
@@ -192,12 +598,10 @@ class BankPageParser:
     async def _load_alfabank(self, url: str) -> Optional[str]:
         """Специальная обработка для Альфа Банка"""
         try:
-            headers = self.headers.copy()
-            headers['Referer'] = 'https://www.alfabank.by/'
-            
-            response = requests.get(url, headers=headers, timeout=12, verify=False)
-            if response.status_code == 200:
-                return response.text
+            headers = {'Referer': 'https://www.alfabank.by/'}
+            return await self._http_get(url, headers=headers, timeout=12)
+        except RejectedContent:
+            raise
         except Exception as e:
             print(f"  ⚠️ Alfabank ошибка: {type(e).__name__}")
         return None
@@ -205,12 +609,10 @@ class BankPageParser:
     async def _load_mtbank(self, url: str) -> Optional[str]:
         """Специальная обработка для МТБанка"""
         try:
-            headers = self.headers.copy()
-            headers['Referer'] = 'https://www.mtbank.by/'
-            
-            response = requests.get(url, headers=headers, timeout=12, verify=False)
-            if response.status_code == 200:
-                return response.text
+            headers = {'Referer': 'https://www.mtbank.by/'}
+            return await self._http_get(url, headers=headers, timeout=12)
+        except RejectedContent:
+            raise
         except Exception as e:
             print(f"  ⚠️ MTBank ошибка: {type(e).__name__}")
         return None
@@ -218,30 +620,10 @@ class BankPageParser:
     def extract_text(self, html: str, min_length: int = 100) -> str:
         """
         ✅ Умное извлечение текста из HTML
-        - Удаляет скрипты и стили
-        - Сохраняет структуру
-        - Очищает от лишних пробелов
+        Синхронная версия; из обработчиков используйте extract_page_text (пул процессов)
         """
         try:
-            soup = BeautifulSoup(html, "html.parser")
-            
-            # Удаляем лишние теги
-            for tag in soup(['script', 'style', 'meta', 'link', 'svg', 'iframe', 
-                           'noscript', 'nav', 'footer', 'button', 'form']):
-                tag.decompose()
-            
-            # Удаляем комментарии
-            for element in soup(string=lambda text: isinstance(text, str) and text.strip().startswith('<!--')):
-                element.extract()
-            
-            # Извлекаем текст с сохранением структуры
-            text = soup.get_text(separator=" ", strip=True)
-            
-            # Очищаем от множественных пробелов
-            text = re.sub(r'\s+', ' ', text)
-            
-            # Ограничиваем размер (8000 символов достаточно для LLM)
-            return text[:8000]
+            return page_text(html)
         
         except Exception as e:
             print(f"❌ Ошибка извлечения текста: {e}")
@@ -252,35 +634,9 @@ class BankPageParser:
         ✅ Извлечение структурированных данных из HTML
         - Таблицы
         - Списки
-        - Определения
         """
         try:
-            soup = BeautifulSoup(html, "html.parser")
-            data = {}
-            
-            # Извлекаем таблицы
-            tables = soup.find_all('table')
-            if tables:
-                data['tables'] = []
-                for table in tables[:3]:  # Первые 3 таблицы
-                    rows = []
-                    for tr in table.find_all('tr')[:10]:  # Первые 10 строк
-                        cells = [td.get_text(strip=True) for td in tr.find_all(['td', 'th'])]
-                        if cells:
-                            rows.append(cells)
-                    if rows:
-                        data['tables'].append(rows)
-            
-            # Извлекаем списки
-            lists = soup.find_all(['ul', 'ol'])
-            if lists:
-                data['lists'] = []
-                for lst in lists[:5]:
-                    items = [li.get_text(strip=True) for li in lst.find_all('li')]
-                    if items:
-                        data['lists'].append(items)
-            
-            return data
+            return page_structured_data(html)
         
         except Exception as e:
             print(f"⚠️ Ошибка извлечения структурированных данных: {e}")
@@ -295,8 +651,16 @@ async def get_page_content(url: str) -> Optional[str]:
     return await parser.get_page_content(url)
 
 
+async def close_parser():
+    await parser.close()
+
+
 async def extract_page_text(url: str) -> str:
     content = await get_page_content(url)
-    if content:
-        return parser.extract_text(content)
-    return ""
\ No newline at end of file
+    if not content:
+        return ""
+    try:
+        return await run_cpu(page_text, content)
+    except Exception as e:
+        print(f"❌ Ошибка извлечения текста: {e}")
+        return ""
\ No newline at end of file
@@ -1,5 +1,7 @@
 # app/keyboards/start_keyboard.py
 
+import re
+
 from aiogram.types import (
     ReplyKeyboardMarkup,
     KeyboardButton,
@@ -91,3 +93,56 @@ def get_top_level_actions_keyboard(sets: list) -> InlineKeyboardMarkup:
 
     return builder.as_markup()
 
+
+SELECTED_MARK = "✅"
+
+
+def mark_selected(label: str, selected: bool) -> str:
+    """Подпись кнопки-галочки: «✅ Название» или «Название»"""
+    base = label.removeprefix(SELECTED_MARK).strip()
+    return f"{SELECTED_MARK} {base}" if selected else base
+
+
+def with_counter(label: str, selected: int, total: int) -> str:
+    """Счётчик выбора в подписи кнопки: «➡️ Далее (2/5)»"""
+    base = re.sub(r"\s*\(\d+/\d+\)$", "", label)
+    return f"{base} ({selected}/{total})"
+
+
+def toggle_keyboard_item(
+    markup: InlineKeyboardMarkup | None,
+    item_data: str,
+    selected: bool,
+    selected_count: int,
+    item_prefix: str,
+    counter_data: str,
+) -> InlineKeyboardMarkup | None:
+    """
+    ✅ Точечное обновление клавиатуры выбора без обращения к БД
+    Меняет галочку у нажатой кнопки и счётчик на кнопке counter_data.
+    Возвращает None, если кнопки нет — тогда клавиатуру нужно построить заново
+    """
+    if markup is None:
+        return None
+
+    total = sum(
+        1 for row in markup.inline_keyboard for button in row
+        if (button.callback_data or "").startswith(item_prefix)
+    )
+
+    found = False
+    rows = []
+    for row in markup.inline_keyboard:
+        new_row = []
+        for button in row:
+            if button.callback_data == item_data:
+                button = button.model_copy(update={"text": mark_selected(button.text, selected)})
+                found = True
+            elif button.callback_data == counter_data:
+                button = button.model_copy(update={"text": with_counter(button.text, selected_count, total)})
+            new_row.append(button)
+        rows.append(new_row)
+
+    if not found:
+        return None
+    return InlineKeyboardMarkup(inline_keyboard=rows)
@@ -0,0 +1,65 @@
+# app/llm/giga_client.py
+import asyncio
+import hashlib
+from typing import Optional
+
+from gigachat import GigaChat
+from gigachat.models import ChatCompletion, Usage
+
+from app.single_flight import SingleFlight
+from config import GIGACHAT_TOKEN, GIGACHAT_CONCURRENCY
+
+
+class GigaClient:
+    """Асинхронный клиент GigaChat с ограничением числа параллельных запросов"""
+
+    def __init__(self, concurrency: int = GIGACHAT_CONCURRENCY):
+        self._giga: Optional[GigaChat] = None
+        self._semaphore = asyncio.Semaphore(max(1, concurrency))
+        # Одинаковые промпты, отправленные одновременно, уходят в GigaChat один раз
+        self._in_flight = SingleFlight()
+
+    def _get_giga(self) -> GigaChat:
+        # Один экземпляр на процесс: токен доступа и HTTP-соединения переиспользуются
+        if self._giga is None:
+            self._giga = GigaChat(
+                credentials=GIGACHAT_TOKEN,
+                scope="GIGACHAT_API_B2B",
+                verify_ssl_certs=False,
+                model="GigaChat-2-Max",
+            )
+        return self._giga
+
+    async def chat(self, prompt: str) -> ChatCompletion:
+        """
+        ✅ Запрос к GigaChat без блокировки event loop
+        Лишние запросы ждут своей очереди на семафоре
+        """
+        key = hashlib.sha256(prompt.encode("utf-8")).hexdigest()
+        result, shared = await self._in_flight.do(key, self._chat, prompt)
+        if shared:
+            # Токены уже учтены у первого запроса
+            print("🔗 Ответ GigaChat получен от такого же одновременного запроса")
+            return result.copy(update={"usage": Usage(prompt_tokens=0, completion_tokens=0, total_tokens=0)})
+        return result
+
+    async def _chat(self, prompt: str) -> ChatCompletion:
+        async with self._semaphore:
+            return await self._get_giga().achat(prompt)
+
+    async def close(self):
+        if self._giga is not None:
+            await self._giga.aclose()
+            self._giga = None
+
+
+# Глобальный экземпляр клиента
+giga_client = GigaClient()
+
+
+async def chat(prompt: str) -> ChatCompletion:
+    return await giga_client.chat(prompt)
+
+
+async def close_giga_client():
+    await giga_client.close()
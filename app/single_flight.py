@@ -0,0 +1,45 @@
+# app/single_flight.py
+import asyncio
+from typing import Any, Awaitable, Callable, Hashable
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+
+class SingleFlight:
+    """
+    ✅ Объединение одинаковых одновременных запросов
+    Пока запрос с ключом выполняется, повторные вызовы с тем же ключом не запускают
+    новый, а ждут результат первого (или его ошибку).
+    Запрос выполняется отдельной задачей: отмена одного ожидающего не отменяет его для остальных
+    """
+
+    def __init__(self):
+        self._calls: dict[Hashable, asyncio.Task] = {}
+
+    async def do(self, key: Hashable, func: Callable[..., Awaitable[Any]], *args) -> tuple[Any, bool]:
+        """Возвращает (результат, получен ли он от уже выполнявшегося запроса)"""
+        task = self._calls.get(key)
+        shared = task is not None
+        if not shared:
+            task = asyncio.ensure_future(func(*args))
+            self._calls[key] = task
+            task.add_done_callback(lambda done: self._forget(key, done))
+
+        return await asyncio.shield(task), shared
+
+    def _forget(self, key: Hashable, task: asyncio.Task):
+        if self._calls.get(key) is task:
+            del self._calls[key]
+        # Все ожидающие могли отмениться — ошибку забираем, чтобы asyncio не ругался
+        if not task.cancelled():
+            task.exception()
+
+
+def normalize_url(url: str) -> str:
+    """Ключ URL: регистр схемы и хоста, порт по умолчанию, порядок параметров и якорь не важны"""
+    parts = urlsplit(url.strip())
+    scheme = parts.scheme.lower()
+    host = (parts.hostname or "").lower()
+    if parts.port and (scheme, parts.port) not in (("http", 80), ("https", 443)):
+        host = f"{host}:{parts.port}"
+    query = urlencode(sorted(parse_qsl(parts.query, keep_blank_values=True)))
+    return urlunsplit((scheme, host, parts.path or "/", query, ""))
@@ -8,6 +8,89 @@ TOKEN = os.getenv("BOT_TOKEN")
 
 GIGACHAT_TOKEN = os.getenv("GIGA_TOKEN")
 
+# Сколько запросов к GigaChat может выполняться одновременно
+GIGACHAT_CONCURRENCY = int(os.getenv("GIGACHAT_CONCURRENCY", "2"))
+
+# Параллельность этапов парсинга: загрузка страниц и очистка HTML
+PARSE_FETCH_CONCURRENCY = int(os.getenv("PARSE_FETCH_CONCURRENCY", "16"))
+PARSE_CPU_CONCURRENCY = int(os.getenv("PARSE_CPU_CONCURRENCY", "2"))
+
+# Размер пула процессов для разбора HTML (BeautifulSoup/lxml)
+PARSE_CPU_WORKERS = int(os.getenv("PARSE_CPU_WORKERS", "2"))
+
+# Значения характеристик старше этого срока (сек) извлекаются заново
+PARSE_VALUE_MAX_AGE = int(os.getenv("PARSE_VALUE_MAX_AGE", "604800"))
+
+# Бюджет токенов на HTML страницы в промпте; блоки сверх бюджета отбрасываются по релевантности
+PARSE_PROMPT_TOKEN_BUDGET = int(os.getenv("PARSE_PROMPT_TOKEN_BUDGET", "10000"))
+
+# Пул браузеров Playwright: сколько страниц открыто одновременно и через сколько страниц перезапускать Chromium
+PLAYWRIGHT_MAX_PAGES = int(os.getenv("PLAYWRIGHT_MAX_PAGES", "2"))
+PLAYWRIGHT_RECYCLE_AFTER = int(os.getenv("PLAYWRIGHT_RECYCLE_AFTER", "50"))
+PLAYWRIGHT_BLOCK_RESOURCES = int(os.getenv("PLAYWRIGHT_BLOCK_RESOURCES", "1"))    # 1 — не грузить картинки, шрифты, видео и счётчики
+PLAYWRIGHT_SETTLE_TIMEOUT = int(os.getenv("PLAYWRIGHT_SETTLE_TIMEOUT", "8000"))   # мс, не дольше ждём догрузки контента
+
+# Общая HTTP-сессия парсера: пулы keep-alive соединений и кэш DNS (сек)
+HTTP_MAX_CONNECTIONS = int(os.getenv("HTTP_MAX_CONNECTIONS", "100"))
+HTTP_MAX_CONNECTIONS_PER_HOST = int(os.getenv("HTTP_MAX_CONNECTIONS_PER_HOST", "4"))
+HTTP_DNS_CACHE_TTL = int(os.getenv("HTTP_DNS_CACHE_TTL", "300"))
+# Больше стольких байт тела не читаем: страницы банков укладываются в пару мегабайт,
+# а ссылка на файл или бесконечный ответ не займёт память
+FETCH_MAX_BYTES = int(os.getenv("FETCH_MAX_BYTES", str(3 * 1024 * 1024)))
+
+# Память о способе загрузки по доменам (app/db/fetch_tiers.py): через столько секунд
+# домен, которому нужен Playwright или особая загрузка, снова сначала пробуем по HTTP
+FETCH_TIER_REPROBE_AFTER = int(os.getenv("FETCH_TIER_REPROBE_AFTER", "86400"))
+
+# Вежливость к сайтам банков (FetchScheduler в app/handlers/parser.py)
+FETCH_HOST_RATE = float(os.getenv("FETCH_HOST_RATE", "1"))                 # запросов в секунду к одному хосту, 0 — без ограничения
+FETCH_HOST_BURST = int(os.getenv("FETCH_HOST_BURST", "2"))                 # запросов подряд без ожидания
+FETCH_HOST_MAX_IN_FLIGHT = int(os.getenv("FETCH_HOST_MAX_IN_FLIGHT", "1")) # одновременных загрузок страниц с одного хоста
+FETCH_HOST_BACKOFF = int(os.getenv("FETCH_HOST_BACKOFF", "30"))            # сек паузы хоста после 429/503 без Retry-After
+
+# Кэш страниц на диске: срок свежести (сек) и максимум записей (лишние вытесняются по LRU)
+PAGE_CACHE_TTL = int(os.getenv("PAGE_CACHE_TTL", "21600"))
+PAGE_CACHE_MAX_ENTRIES = int(os.getenv("PAGE_CACHE_MAX_ENTRIES", "500"))
+# Кэш страниц хранится в отдельном файле: тела страниц не попадают в cards.db и его бэкап
+PAGE_CACHE_DB_URL = os.getenv("PAGE_CACHE_DB_URL", "sqlite:///page_cache.db")
+
+# Кэш ответов LLM: срок жизни (сек) и максимум записей (лишние вытесняются начиная со старых)
+EXTRACTION_CACHE_TTL = int(os.getenv("EXTRACTION_CACHE_TTL", str(30 * 86400)))
+EXTRACTION_CACHE_MAX_ENTRIES = int(os.getenv("EXTRACTION_CACHE_MAX_ENTRIES", "2000"))
+
+# Архив Excel-отчётов на диске: пустая папка — отчёты не сохраняются, только отправляются из памяти
+REPORT_ARCHIVE_DIR = os.getenv("REPORT_ARCHIVE_DIR", "")
+REPORT_ARCHIVE_MAX_FILES = int(os.getenv("REPORT_ARCHIVE_MAX_FILES", "20"))
+REPORT_ARCHIVE_MAX_AGE = int(os.getenv("REPORT_ARCHIVE_MAX_AGE", "604800"))
+
+# Основная база
+DB_URL = os.getenv("DB_URL", "sqlite:///cards.db")
+
+# SQLite (cards.db): PRAGMA для каждого соединения
+SQLITE_JOURNAL_MODE = os.getenv("SQLITE_JOURNAL_MODE", "WAL")
+SQLITE_SYNCHRONOUS = os.getenv("SQLITE_SYNCHRONOUS", "NORMAL")
+SQLITE_BUSY_TIMEOUT = int(os.getenv("SQLITE_BUSY_TIMEOUT", "5000"))           # мс ожидания блокировки
+SQLITE_MMAP_SIZE = int(os.getenv("SQLITE_MMAP_SIZE", str(256 * 1024 * 1024)))  # байт
+SQLITE_CACHE_SIZE = int(os.getenv("SQLITE_CACHE_SIZE", "-65536"))             # <0 — в КиБ (64 МБ)
+
+# Потоки для запросов к БД из обработчиков (app/db/repo.py)
+DB_THREADS = int(os.getenv("DB_THREADS", "4"))
+# Как часто (сек) кэш справочников сверяет версию с БД: изменения других воркеров видны не позже
+REFERENCE_CACHE_CHECK_INTERVAL = int(os.getenv("REFERENCE_CACHE_CHECK_INTERVAL", "5"))
+
+# Очередь задач парсинга (app/handlers/job_queue.py)
+JOB_MAX_RUNNING = int(os.getenv("JOB_MAX_RUNNING", "2"))            # одновременных задач на все воркеры
+JOB_MAX_PER_USER = int(os.getenv("JOB_MAX_PER_USER", "1"))          # одновременных задач одного пользователя на все воркеры
+JOB_POLL_INTERVAL = int(os.getenv("JOB_POLL_INTERVAL", "5"))        # сек между проверками очереди
+JOB_HEARTBEAT_INTERVAL = int(os.getenv("JOB_HEARTBEAT_INTERVAL", "30"))
+JOB_STALE_AFTER = int(os.getenv("JOB_STALE_AFTER", "120"))          # сек без heartbeat — задача возвращается в очередь
+
+# Хранилище состояний FSM (app/db/fsm_storage.py): memory | sqlite | redis
+# Для нескольких воркеров за вебхуком — redis (FSM_STORAGE_URL=redis://host:6379/0)
+FSM_STORAGE = os.getenv("FSM_STORAGE", "sqlite")
+FSM_STORAGE_URL = os.getenv("FSM_STORAGE_URL", "")                 # пусто — sqlite:///fsm.db
+FSM_STATE_TTL = int(os.getenv("FSM_STATE_TTL", "86400"))           # сек без изменений до удаления, 0 — хранить всегда
+
 PROXY_RU = os.getenv("PROXY_URL")
 
 SYSTEM_USER_ID = 1
@@ -1,17 +1,16 @@
 import asyncio
 import logging
 import os
+from functools import partial
 
 import aiohttp
 from aiohttp import web
 
-from aiogram import Bot, Dispatcher
-from aiogram.enums import ParseMode
-from aiogram.client.default import DefaultBotProperties
-from aiogram.webhook.aiohttp_server import SimpleRequestHandler
-
 from config import TOKEN, PROXY_RU
-from app.handlers.card_custom import custom
+
+# Процессы пула разбора HTML (app/handlers/cpu_pool.py) заново импортируют этот файл.
+# Бот, роутеры и БД импортируем внутри функций: иначе каждый процесс пула открывал бы
+# cards.db и fsm.db, выполнял миграции и тянул aiogram с Playwright
 
 logging.basicConfig(level=logging.INFO)
 
@@ -45,7 +44,10 @@ async def health(request):
 
 
 async def on_startup(app: web.Application):
-    bot: Bot = app["bot"]
+    from app.handlers.card_custom import run_parse_job
+    from app.handlers.job_queue import start_job_queue
+
+    bot = app["bot"]
 
     hostname = os.getenv("RENDER_EXTERNAL_HOSTNAME")
 
@@ -58,9 +60,18 @@ async def on_startup(app: web.Application):
 
     app["keep_alive_task"] = asyncio.create_task(keep_alive())
 
+    # Задачи из очереди, в том числе прерванные прошлым запуском
+    start_job_queue(partial(run_parse_job, bot=bot))
+
 
 async def on_shutdown(app: web.Application):
-    bot: Bot = app["bot"]
+    from app.llm.giga_client import close_giga_client
+    from app.handlers.parser import close_parser
+    from app.handlers.cpu_pool import close_cpu_pool
+    from app.handlers.job_queue import close_job_queue
+    from app.db.fsm_storage import close_fsm_storage
+
+    bot = app["bot"]
 
     try:
         await bot.delete_webhook()
@@ -71,17 +82,32 @@ async def on_shutdown(app: web.Application):
     if task:
         task.cancel()
 
+    # До закрытия клиентов: выполняющиеся задачи возвращаются в очередь
+    await close_job_queue()
+    await close_giga_client()
+    await close_parser()
+    await close_cpu_pool()
+    await close_fsm_storage()
+
     logging.info("!!! Shutdown completed")
 
 
 async def main():
+    from aiogram import Bot, Dispatcher
+    from aiogram.enums import ParseMode
+    from aiogram.client.default import DefaultBotProperties
+    from aiogram.webhook.aiohttp_server import SimpleRequestHandler
+
+    from app.handlers.card_custom import custom
+    from app.db.fsm_storage import fsm_storage
+
     bot = Bot(
         token=TOKEN,
         proxy=PROXY_RU,
         default=DefaultBotProperties(parse_mode=ParseMode.HTML),
     )
 
-    dp = Dispatcher()
+    dp = Dispatcher(storage=fsm_storage)
     dp.include_router(custom)
 
     app = web.Application()
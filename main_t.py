@@ -1,21 +1,40 @@
 import asyncio
 import sys
 import logging
-
-from aiogram import Dispatcher, Bot, html
-from aiogram.enums import ParseMode
-from aiogram.client.default import DefaultBotProperties
+from functools import partial
 
 from config import TOKEN
-from app.handlers.card_custom import custom
+
+# Процессы пула разбора HTML заново импортируют этот файл — бот, роутеры и БД импортируем внутри функций
 
 logging.basicConfig(level=logging.INFO)
 
-dp = Dispatcher()
 
+async def on_startup(bot):
+    from app.handlers.card_custom import run_parse_job
+    from app.handlers.job_queue import start_job_queue
+
+    start_job_queue(partial(run_parse_job, bot=bot))
+
+
+async def on_shutdown():
+    from app.handlers.job_queue import close_job_queue
+
+    await close_job_queue()
 
 
 async def main() -> None:
+    from aiogram import Dispatcher, Bot
+    from aiogram.enums import ParseMode
+    from aiogram.client.default import DefaultBotProperties
+
+    from app.handlers.card_custom import custom
+    from app.db.fsm_storage import fsm_storage
+
+    dp = Dispatcher(storage=fsm_storage)
+    dp.startup.register(on_startup)
+    dp.shutdown.register(on_shutdown)
+
     bot = Bot(token = TOKEN, default = DefaultBotProperties(parse_mode = ParseMode.HTML))
     dp.include_router(custom)
 
@@ -25,4 +44,4 @@ async def main() -> None:
 
 if __name__ == "__main__":
     logging.basicConfig(level=logging.INFO, stream=sys.stdout)
-    asyncio.run(main())
\ No newline at end of file
+    asyncio.run(main())
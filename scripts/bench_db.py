@@ -0,0 +1,146 @@
+# scripts/bench_db.py
+"""
+Задержка чтения cards.db во время записи парсинга
+
+Работает с копиями базы: писатель в отдельном процессе сохраняет значения продуктов
+(как run_parse_job), читатель в это время выбирает текущие
+значения продукта (как проверка устаревших характеристик перед запросом к LLM).
+Сравниваются настройки SQLite по умолчанию (журнал DELETE) и make_engine() из app/db/model.py.
+
+Запуск из корня проекта:
+    python -m scripts.bench_db [секунд]
+"""
+import multiprocessing
+import os
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+
+from sqlalchemy import create_engine, text
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import sessionmaker
+
+USER_ID = 1
+PRODUCTS = list(range(1, 41))
+CHARS = list(range(1, 31))
+
+# Режим журнала копии: по умолчанию SQLite создаёт базы в DELETE, make_engine сам включит WAL
+JOURNAL_MODES = {
+    "default": "DELETE",
+    "tuned": "WAL",
+}
+
+
+def _make_engine(label: str, url: str):
+    if label == "default":
+        return create_engine(url, future=True)
+
+    from app.db.model import make_engine
+    return make_engine(url)
+
+
+def _copy_database(source: str, target: str, journal_mode: str):
+    """
+    Согласованная копия через backup API: cards.db может быть в WAL,
+    и простое копирование файла потеряло бы изменения из -wal
+    """
+    src = sqlite3.connect(f"file:{source}?mode=ro", uri=True)
+    dst = sqlite3.connect(target)
+    try:
+        src.backup(dst)
+        dst.execute(f"PRAGMA journal_mode={journal_mode}")
+    finally:
+        dst.close()
+        src.close()
+
+
+def _writer(label: str, url: str, stop, writes, write_errors):
+    from app.db.current_values import save_current_values
+
+    engine = _make_engine(label, url)
+    Session = sessionmaker(bind=engine, autoflush=False, autocommit=False)
+    n = 0
+    while not stop.is_set():
+        db = Session()
+        try:
+            for product_id in PRODUCTS:
+                if stop.is_set():
+                    break
+                values = {char_id: f"значение {n} {char_id}" for char_id in CHARS}
+                save_current_values(db, USER_ID, product_id, values, f"hash{n}")
+                db.commit()
+                writes.value += 1
+                n += 1
+        except OperationalError:
+            db.rollback()
+            write_errors.value += 1
+        finally:
+            db.close()
+    engine.dispose()
+
+
+def _run(label: str, url: str, seconds: float):
+    from app.db.model import Base, get_current_values_map
+
+    engine = _make_engine(label, url)
+    Base.metadata.create_all(bind=engine)
+    with engine.connect() as conn:
+        journal_mode = conn.execute(text("PRAGMA journal_mode")).scalar()
+    Session = sessionmaker(bind=engine, autoflush=False, autocommit=False)
+
+    stop = multiprocessing.Event()
+    writes = multiprocessing.Value("i", 0)
+    write_errors = multiprocessing.Value("i", 0)
+    writer = multiprocessing.Process(target=_writer, args=(label, url, stop, writes, write_errors))
+    writer.start()
+    time.sleep(0.5)
+
+    latencies = []
+    read_errors = 0
+    deadline = time.perf_counter() + seconds
+    while time.perf_counter() < deadline:
+        db = Session()
+        started = time.perf_counter()
+        try:
+            get_current_values_map(db, USER_ID, [PRODUCTS[0]], CHARS)
+            latencies.append((time.perf_counter() - started) * 1000)
+        except OperationalError:
+            read_errors += 1
+        finally:
+            db.close()
+        time.sleep(0.005)
+
+    stop.set()
+    writer.join()
+    engine.dispose()
+
+    latencies.sort()
+    p95 = latencies[int(len(latencies) * 0.95) - 1] if latencies else 0
+    print(
+        f"{label:<8} журнал: {journal_mode:<6} чтений: {len(latencies):>5}  "
+        f"p50: {statistics.median(latencies) if latencies else 0:7.2f} мс  "
+        f"p95: {p95:7.2f} мс  max: {max(latencies, default=0):8.2f} мс  "
+        f"ошибок чтения: {read_errors}  "
+        f"записей: {writes.value}  ошибок записи: {write_errors.value}"
+    )
+
+
+def main():
+    seconds = float(sys.argv[1]) if len(sys.argv) > 1 else 5.0
+
+    # Копия рядом с cards.db: тот же диск и та же стоимость fsync
+    with tempfile.TemporaryDirectory(dir=".") as tmp:
+        # app/db/model.py при импорте открывает базу и выполняет миграции —
+        # направляем его на отдельный файл, чтобы не трогать cards.db (и не переводить его в WAL)
+        os.environ["DB_URL"] = f"sqlite:///{os.path.join(tmp, 'import.db')}"
+
+        for label, journal_mode in JOURNAL_MODES.items():
+            path = os.path.join(tmp, f"{label}.db")
+            _copy_database("cards.db", path, journal_mode)
+            _run(label, f"sqlite:///{path}", seconds)
+
+
+if __name__ == "__main__":
+    main()